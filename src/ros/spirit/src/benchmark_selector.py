@@ -0,0 +1,462 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark the past image selector.
+
+The selector and its evaluators are driven with a synthetic flight, without a
+ROS master. For every combination of evaluation method, coefficient set, and
+image queue length, the latency of the pose and image callbacks, the pose
+throughput, and the memory used are measured.
+
+Each configuration is written as one JSON object per line, so that the results
+of different commits can be compared with ``--compare``.
+
+Examples
+--------
+Run the full sweep, and compare against a previous run::
+
+    $ ./benchmark_selector.py -o new.jsonl
+    $ ./benchmark_selector.py --compare old.jsonl new.jsonl
+
+"""
+from __future__ import division, print_function
+import argparse
+from collections import OrderedDict
+import json
+import os
+import resource
+import subprocess
+import sys
+import timeit
+
+import numpy as np
+import yaml
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+import rospkg
+import rospy
+from sensor_msgs.msg import Image
+from std_msgs.msg import Bool
+
+from helpers import Pose
+from past_image_selector import Selector
+
+
+QUEUE_LENGTHS = (30, 100, 1000, 10000)
+PERCENTILES = (50, 90, 99)
+
+
+class NullPublisher(object):
+    """
+    A publisher which drops all messages.
+
+    """
+    def publish(self, message):
+        pass
+
+
+class BenchmarkSelector(Selector):
+    """
+    A selector whose parameters are given directly instead of by rosparam.
+
+    Nothing is published, and evaluation is not threaded, so that the time
+    taken by each callback can be measured.
+
+    Parameters
+    ----------
+    eval_method : str
+        The name of the evaluation method.
+    eval_params : dict
+        The parameters of the evaluation method.
+    eval_coeffs : dict
+        The coefficients of each component used.
+    kwargs
+        Additional arguments for `Selector`.
+
+    """
+    def __init__(self, eval_method, eval_params, eval_coeffs, **kwargs):
+        self._eval_params = {"thresh_distance": None, "thresh_yaw": None}
+        self._eval_params.update(eval_params)
+        super(BenchmarkSelector, self).__init__(eval_method=eval_method,
+                                                eval_coeffs=eval_coeffs,
+                                                debug=True, threaded=False,
+                                                **kwargs)
+        self.past_image_pub = NullPublisher()
+        self.past_pose_pub = NullPublisher()
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["_eval_params"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class Flight(object):
+    """
+    A synthetic flight around a circle, with noisy poses.
+
+    Every image message shares the same data, so the memory measured is that
+    used by the selector itself, plus the image arena if one is used.
+
+    Parameters
+    ----------
+    seed : int
+        The seed of the random number generator.
+    rate : float
+        The rate at which poses are generated, in Hz.
+    image_size : Sequence[int]
+        The height and width of the images.
+
+    """
+    def __init__(self, seed=0, rate=30, image_size=(360, 640)):
+        self.rng = np.random.RandomState(seed)
+        self.rate = rate
+        height, width = image_size
+        self.image = Image(height=height, width=width, encoding="rgb8",
+                           step=3 * width, data=b"\0" * (3 * width * height))
+        self.count = 0
+
+    def pose_stamped(self):
+        """
+        Generate the next pose.
+
+        Returns
+        -------
+        PoseStamped
+            The pose of the drone.
+
+        """
+        t = self.count / self.rate
+        angle = 0.2 * t
+        position = np.array([2 * np.cos(angle), 2 * np.sin(angle),
+                             1 + 0.3 * np.sin(0.5 * t)])
+        position += self.rng.normal(scale=0.05, size=3)
+        yaw = angle + np.pi / 2 + self.rng.normal(scale=0.1)
+        orientation = np.array([0, 0, np.sin(yaw / 2), np.cos(yaw / 2)])
+        orientation += self.rng.normal(scale=0.01, size=4)
+
+        pose_stamped = Pose.generate_stamped(position, orientation, self.count)
+        pose_stamped.header.stamp = rospy.Time.from_sec(t)
+        self.count += 1
+        return pose_stamped
+
+
+def load_params():
+    """
+    Load the parameters of all evaluation methods from the launch config.
+
+    The yaw threshold is converted to radians, as in the launch file.
+
+    Returns
+    -------
+    dict
+        The parameters of each evaluation method.
+
+    """
+    with open(os.path.join(rospkg.RosPack().get_path("spirit"),
+                           "config", "launch_params.yaml")) as fin:
+        params = yaml.safe_load(fin)["past_image"]
+    del params["general"]
+    for method_params in params.values():
+        if "thresh_yaw" in method_params:
+            method_params["thresh_yaw"] = np.radians(
+                method_params["thresh_yaw"])
+    return params
+
+
+def coefficient_sets(method_params):
+    """
+    Generate the coefficient sets to benchmark for an evaluation method.
+
+    These are the configured coefficients, followed by each configured
+    component on its own.
+
+    Parameters
+    ----------
+    method_params : dict
+        The parameters of the evaluation method.
+
+    Returns
+    -------
+    OrderedDict
+        The coefficients of each component, by the name of the set.
+
+    """
+    coeffs = OrderedDict(
+        (param.split("coeff_", 1)[1], coeff)
+        for param, coeff in sorted(method_params.items())
+        if param.startswith("coeff_") and coeff != 0
+    )
+    sets = OrderedDict([("default", coeffs)])
+    if len(coeffs) > 1:
+        for component, coeff in coeffs.items():
+            sets[component] = OrderedDict([(component, coeff)])
+    return sets
+
+
+def summarize(latencies):
+    """
+    Summarize callback latencies.
+
+    Parameters
+    ----------
+    latencies : Sequence[float]
+        The latencies, in seconds.
+
+    Returns
+    -------
+    OrderedDict
+        The mean, percentiles, and maximum, in milliseconds.
+
+    """
+    latencies = 1000 * np.asarray(latencies)
+    if not latencies.size:
+        return None
+    summary = OrderedDict([("mean", latencies.mean())])
+    for percentile in PERCENTILES:
+        summary["p{}".format(percentile)] = np.percentile(latencies,
+                                                          percentile)
+    summary["max"] = latencies.max()
+    return OrderedDict((key, round(float(value), 4))
+                       for key, value in summary.items())
+
+
+def run(method, params, coeffs, queue_length, n_poses=100, n_warmup=10,
+        image_period=15, batch=True, index_cell_size=None,
+        image_storage="message", seed=0):
+    """
+    Benchmark one configuration of the selector.
+
+    The image queue is filled before measuring, so that frames are evicted
+    while the poses are being evaluated.
+
+    Parameters
+    ----------
+    method : str
+        The name of the evaluation method.
+    params : dict
+        The parameters of the evaluation method.
+    coeffs : dict
+        The coefficients of each component used.
+    queue_length : int
+        The number of frames kept by the selector.
+    n_poses : Optional[int]
+        The number of poses to measure. Default is 100.
+    n_warmup : Optional[int]
+        The number of poses sent before measuring. Default is 10.
+    image_period : Optional[int]
+        The number of poses sent for each image. Default is 15, which matches
+        the framerate reducer.
+    batch : Optional[bool]
+        Whether to use vectorized evaluation. Default is True.
+    index_cell_size : Optional[float]
+        The cell size of the spatial index. Default is None, for no index.
+    image_storage : Optional[str]
+        How the frame store keeps images. Default is "message".
+    seed : Optional[int]
+        The seed of the synthetic flight. Default is 0.
+
+    Returns
+    -------
+    OrderedDict
+        The measurements.
+
+    """
+    flight = Flight(seed)
+    tracked = Bool(True)
+
+    if tracemalloc is not None:
+        tracemalloc.start()
+    selector = BenchmarkSelector(method, params, coeffs,
+                                 image_queue_length=queue_length,
+                                 batch_evaluation=batch,
+                                 index_cell_size=index_cell_size,
+                                 image_storage=image_storage)
+    for _ in range(queue_length):
+        selector.frames.append(flight.pose_stamped(), flight.image)
+    store_bytes = None
+    if tracemalloc is not None:
+        store_bytes = tracemalloc.get_traced_memory()[0]
+
+    pose_latencies = []
+    image_latencies = []
+    for i in range(n_warmup + n_poses):
+        pose_stamped = flight.pose_stamped()
+        start = timeit.default_timer()
+        selector.pose_callback(pose_stamped)
+        pose_latency = timeit.default_timer() - start
+
+        image_latency = None
+        if not i % image_period:
+            selector.tracked_callback(tracked)
+            start = timeit.default_timer()
+            selector.image_callback(flight.image)
+            image_latency = timeit.default_timer() - start
+
+        if i >= n_warmup:
+            pose_latencies.append(pose_latency)
+            if image_latency is not None:
+                image_latencies.append(image_latency)
+
+    peak_bytes = None
+    if tracemalloc is not None:
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    selector.frames.close()
+
+    return OrderedDict([
+        ("method", method),
+        ("coefficients", OrderedDict(coeffs)),
+        ("queue_length", queue_length),
+        ("batch", batch),
+        ("index_cell_size", index_cell_size),
+        ("image_storage", image_storage),
+        ("n_poses", n_poses),
+        ("n_frames", len(selector.frames)),
+        ("pose_latency_ms", summarize(pose_latencies)),
+        ("image_latency_ms", summarize(image_latencies)),
+        ("throughput_hz", round(len(pose_latencies) / sum(pose_latencies), 1)),
+        ("store_bytes", store_bytes),
+        ("peak_bytes", peak_bytes),
+        ("max_rss_kb", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss),
+    ])
+
+
+def sweep(methods=None, queue_lengths=QUEUE_LENGTHS, **kwargs):
+    """
+    Benchmark every combination of method, coefficient set, and queue length.
+
+    Parameters
+    ----------
+    methods : Optional[Sequence[str]]
+        The evaluation methods. Default is every configured method.
+    queue_lengths : Optional[Sequence[int]]
+        The image queue lengths. Default is `QUEUE_LENGTHS`.
+    kwargs
+        Additional arguments for `run`.
+
+    Yields
+    ------
+    OrderedDict
+        The measurements of each configuration, with the name of the
+        coefficient set and the commit being benchmarked.
+
+    """
+    all_params = load_params()
+    commit = git_commit()
+    for method in methods or sorted(all_params):
+        params = all_params[method]
+        for name, coeffs in coefficient_sets(params).items():
+            for queue_length in queue_lengths:
+                result = OrderedDict([("commit", commit),
+                                      ("coefficient_set", name)])
+                result.update(run(method, params, coeffs, queue_length,
+                                  **kwargs))
+                yield result
+
+
+def git_commit():
+    """
+    Get the commit of the source being benchmarked.
+
+    Returns
+    -------
+    str | None
+        The abbreviated commit hash, or None if it is unknown.
+
+    """
+    try:
+        output = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode().strip()
+
+
+def compare(old_path, new_path, statistic="p50"):
+    """
+    Print the change in pose latency between two benchmark results.
+
+    Parameters
+    ----------
+    old_path : str
+        The results of the baseline.
+    new_path : str
+        The results to compare against the baseline.
+    statistic : Optional[str]
+        The latency statistic to compare. Default is "p50".
+
+    """
+    def key(result):
+        return (result["method"], result["coefficient_set"],
+                result["queue_length"], result["batch"],
+                result["index_cell_size"], result.get("image_storage"))
+
+    def load(path):
+        with open(path) as fin:
+            return OrderedDict((key(result), result)
+                               for result in map(json.loads, fin))
+
+    old = load(old_path)
+    for config, result in load(new_path).items():
+        if config not in old:
+            continue
+        before = old[config]["pose_latency_ms"][statistic]
+        after = result["pose_latency_ms"][statistic]
+        print("{:<18} {:<28} {:>6}  {:>9.3f} ms -> {:>9.3f} ms  ({:+.0%})"
+              .format(config[0], config[1], config[2], before, after,
+                      after / before - 1))
+
+
+def main():
+    """
+    Main entry point for script.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-m", "--methods", nargs="+",
+                        help="evaluation methods (default: all)")
+    parser.add_argument("-q", "--queue-lengths", nargs="+", type=int,
+                        default=QUEUE_LENGTHS, help="image queue lengths")
+    parser.add_argument("-n", "--poses", type=int, default=100,
+                        help="poses measured per configuration")
+    parser.add_argument("--scalar", action="store_true",
+                        help="disable vectorized evaluation")
+    parser.add_argument("--index-cell-size", type=float,
+                        help="cell size of the spatial index, in metres")
+    parser.add_argument("--image-storage",
+                        choices=("message", "arena", "compressed"),
+                        default="message", help="how frames keep images")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two results instead of benchmarking")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    # Use wall time without initializing a node.
+    rospy.rostime.set_rostime_initialized(True)
+
+    fout = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for result in sweep(args.methods, args.queue_lengths,
+                            n_poses=args.poses, batch=not args.scalar,
+                            index_cell_size=args.index_cell_size,
+                            image_storage=args.image_storage):
+            fout.write(json.dumps(result) + "\n")
+            fout.flush()
+    finally:
+        if fout is not sys.stdout:
+            fout.close()
+
+
+if __name__ == "__main__":
+    main()
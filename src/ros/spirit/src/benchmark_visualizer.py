@@ -0,0 +1,513 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark the visualizer backends.
+
+The scene follows a scripted flight in front of a fixed past camera pose, with
+a new background every few frames. Frames are drawn as fast as possible, and
+the frame rate and the time taken by each stage are written as one JSON object
+per backend.
+
+By default, the scene is rendered offscreen, without a display. PyOpenGL then
+chooses its platform from ``PYOPENGL_PLATFORM``, which defaults to "egl" here.
+Set it to "osmesa" to render with OSMesa instead.
+
+Selected frames can be dumped as images, and compared pixel by pixel against
+the frames dumped by an earlier run with ``--reference``, to check that a
+change does not alter what is drawn. When several backends are given, each
+runs in its own process, and their frames are compared with those of the
+first. The window backends need a platform with OpenGL; a backend which cannot
+render any frames fails the run.
+
+Examples
+--------
+Dump frames before and after a change, and compare them::
+
+    $ ./benchmark_visualizer.py --dump frames/old
+    $ ./benchmark_visualizer.py --dump frames/new --reference frames/old
+
+Run the same scene through both window backends::
+
+    $ ./benchmark_visualizer.py --backends pygame qt --dump frames
+
+"""
+from __future__ import division, print_function
+import argparse
+from collections import OrderedDict
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+
+# PyOpenGL chooses its platform when it is first imported, and windows cannot
+# use the offscreen platforms.
+_parser = argparse.ArgumentParser(add_help=False)
+_parser.add_argument("-b", "--backends", nargs="+", default=["offscreen"])
+if _parser.parse_known_args()[0].backends == ["offscreen"]:
+    os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+    os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+
+import numpy as np
+from OpenGL import GL as gl
+import pygame as pg
+
+import rospy
+from sensor_msgs.msg import Image
+
+from benchmark_selector import git_commit, summarize
+from helpers import LatencyTracer, Pose
+from opengl_helpers import gl_font
+from renderer import BACKENDS, Drone
+
+
+class Scene(object):
+    """
+    A scripted flight of the drone, seen from a fixed past camera pose.
+
+    The drone circles in front of the camera while turning, and the
+    background is a moving colour gradient. Everything is deterministic, so
+    that the frames of different runs can be compared.
+
+    Parameters
+    ----------
+    rate : Optional[float]
+        The rate at which poses are generated, in Hz. Default is 30.
+    image_size : Optional[Sequence[int]]
+        The height and width of the backgrounds. Default is (360, 640).
+
+    """
+    def __init__(self, rate=30, image_size=(360, 640)):
+        self.rate = rate
+        self.image_size = image_size
+        height, width = image_size
+        rows, columns = np.mgrid[:height, :width]
+        self._gradient = np.dstack([255 * columns / width,
+                                    255 * rows / height,
+                                    np.full((height, width), 128)])
+
+    def pose_cam(self):
+        """
+        Generate the pose of the past camera.
+
+        Returns
+        -------
+        PoseStamped
+            The pose of the camera.
+
+        """
+        return Pose.generate_stamped([0, 0, 0], [0, 0, 0, 1])
+
+    def pose_drone(self, count):
+        """
+        Generate a pose of the drone.
+
+        Parameters
+        ----------
+        count : int
+            The number of the pose.
+
+        Returns
+        -------
+        PoseStamped
+            The pose of the drone.
+
+        """
+        t = count / self.rate
+        position = [0.5 * np.sin(t), -1.5 + 0.3 * np.cos(t),
+                    0.2 * np.sin(2 * t)]
+        yaw = 0.5 * t
+        orientation = [0, 0, np.sin(yaw / 2), np.cos(yaw / 2)]
+        pose_stamped = Pose.generate_stamped(position, orientation, count)
+        pose_stamped.header.stamp = rospy.Time.from_sec(t)
+        return pose_stamped
+
+    def background(self, count):
+        """
+        Generate a background image.
+
+        Parameters
+        ----------
+        count : int
+            The number of the image.
+
+        Returns
+        -------
+        Image
+            An rgb8 image message.
+
+        """
+        height, width = self.image_size
+        pixels = np.roll(self._gradient, 8 * count, axis=1).astype(np.uint8)
+        return Image(height=height, width=width, encoding="rgb8",
+                     step=3 * width, data=pixels.tobytes())
+
+    def text(self):
+        """
+        Generate the messages written over the scene.
+
+        These are the messages which the visualizer shows while tracking is
+        lost.
+
+        Returns
+        -------
+        dict
+            The text, position, font, and colour of each message, by name, as
+            used by `renderer.Screen.text`.
+
+        """
+        height, width = self.image_size
+        return {
+            "tracking": ("Tracking lost", None, gl_font("helvetica", 18),
+                         (1, 0, 0)),
+            "status": ("Drone pose is not being tracked.\nRecovering...",
+                       (-0.45 * width, -0.35 * height), None, (1, 1, 0)),
+        }
+
+
+def save_frame(pixels, filename):
+    """
+    Save a frame as an image.
+
+    Parameters
+    ----------
+    pixels : np.ndarray
+        A (height, width, 3) array of RGB values, starting from the top row.
+    filename : str
+        The name of the file. The format is chosen from its extension.
+
+    """
+    height, width = pixels.shape[:2]
+    surface = pg.image.frombuffer(np.ascontiguousarray(pixels).tobytes(),
+                                  (width, height), "RGB")
+    pg.image.save(surface, filename)
+
+
+def load_frame(filename):
+    """
+    Load a frame saved by `save_frame`.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the file.
+
+    Returns
+    -------
+    np.ndarray
+        A (height, width, 3) array of RGB values, starting from the top row.
+
+    """
+    surface = pg.image.load(filename)
+    width, height = surface.get_size()
+    return np.frombuffer(pg.image.tostring(surface, "RGB"),
+                         dtype=np.uint8).reshape(height, width, 3)
+
+
+def pixel_diff(a, b, tolerance=0):
+    """
+    Compare two frames pixel by pixel.
+
+    Parameters
+    ----------
+    a, b : np.ndarray
+        The frames, as (height, width, 3) arrays.
+    tolerance : Optional[int]
+        The largest difference of a channel which is ignored. Default is 0.
+
+    Returns
+    -------
+    OrderedDict
+        The largest difference of any channel, and the fraction of pixels
+        which differ by more than `tolerance`. If the sizes do not match, the
+        fraction is 1.
+
+    """
+    if a.shape != b.shape:
+        return OrderedDict([("max", None), ("fraction", 1)])
+    difference = np.abs(a.astype(np.int16) - b.astype(np.int16)).max(axis=2)
+    return OrderedDict([
+        ("max", int(difference.max())),
+        ("fraction", float((difference > tolerance).mean())),
+    ])
+
+
+def run(backend="offscreen", n_frames=300, n_warmup=10, size=(640, 360),
+        image_period=15, distance=None, text=False, dump_dir=None,
+        dump_period=50):
+    """
+    Render the scripted scene with one backend.
+
+    Parameters
+    ----------
+    backend : Optional[str]
+        The backend, which is a key of `renderer.BACKENDS`. Default is
+        "offscreen".
+    n_frames : Optional[int]
+        The number of frames to measure. Default is 300.
+    n_warmup : Optional[int]
+        The number of frames drawn before measuring. Default is 10.
+    size : Optional[Sequence[int]]
+        The width and height of the frames. Default is 640x360.
+    image_period : Optional[int]
+        The number of frames drawn for each background. Default is 15, which
+        matches the framerate reducer.
+    distance : Optional[float]
+        The distance at which to draw the drone, zooming the background to
+        match. Default is no zoom.
+    text : Optional[bool]
+        Whether to write messages over the scene on every frame. Default is
+        False.
+    dump_dir : Optional[str]
+        The directory in which to save frames. Default is not to save them.
+    dump_period : Optional[int]
+        The number of measured frames for each frame saved. Default is 50.
+
+    Returns
+    -------
+    OrderedDict
+        The measurements.
+
+    Raises
+    ------
+    RuntimeError
+        If the backend did not render any frames.
+
+    """
+    width, height = size
+    scene = Scene(image_size=(height, width))
+    screen = BACKENDS[backend](size, model=Drone(), fov_diagonal=92,
+                               distance=distance)
+    screen.start()
+    if dump_dir is not None and not os.path.isdir(dump_dir):
+        os.makedirs(dump_dir)
+
+    screen.pose_cam = Pose(scene.pose_cam())
+    if text:
+        screen.text.update(scene.text())
+    frame_times = []
+    n_dumped = 0
+    for i in range(n_warmup + n_frames):
+        count = i - n_warmup
+        if not count:
+            screen.tracer = LatencyTracer()
+        if not i % image_period:
+            screen.add_textures(scene.background(i // image_period))
+            # Backgrounds are converted in the background. Waiting for them
+            # keeps the frames the same from one run to the next.
+            screen.decoder.wait()
+        screen.pose_drone = Pose(scene.pose_drone(i))
+        dump = dump_dir is not None and count >= 0 and not count % dump_period
+
+        start = timeit.default_timer()
+        pixels = screen.render_frame(read=dump)
+        elapsed = timeit.default_timer() - start
+
+        if count < 0:
+            continue
+        frame_times.append(elapsed)
+        if dump:
+            save_frame(pixels, os.path.join(
+                dump_dir, "frame_{:05d}.png".format(count)))
+            n_dumped += 1
+
+    platform = renderer = None
+    if backend == "offscreen":
+        platform = screen.context.platform
+        renderer = gl.glGetString(gl.GL_RENDERER)
+    screen.close()
+
+    stages = OrderedDict((stage, summarize(screen.tracer.samples(stage)))
+                         for stage in ("upload", "render"))
+    if stages["render"] is None:
+        raise RuntimeError("The {} backend did not render any frames."
+                           .format(backend))
+    return OrderedDict([
+        ("commit", git_commit()),
+        ("backend", backend),
+        ("platform", platform),
+        ("renderer", renderer.decode() if renderer else None),
+        ("size", [width, height]),
+        ("distance", distance),
+        ("text", text),
+        ("n_frames", n_frames),
+        ("fps", round(len(frame_times) / sum(frame_times), 1)),
+        ("frame_ms", summarize(frame_times)),
+        ("upload_ms", stages["upload"]),
+        ("render_ms", stages["render"]),
+        ("n_dumped", n_dumped),
+        ("n_buffers", screen.decoder.n_allocated),
+    ])
+
+
+def compare(reference_dir, dump_dir, tolerance=0):
+    """
+    Compare dumped frames with the frames of a reference run.
+
+    Parameters
+    ----------
+    reference_dir : str
+        The directory of the reference frames.
+    dump_dir : str
+        The directory of the frames to check.
+    tolerance : Optional[int]
+        The largest difference of a channel which is ignored. Default is 0.
+
+    Returns
+    -------
+    OrderedDict
+        The difference of each frame, by filename. Frames missing from the
+        reference are skipped.
+
+    """
+    differences = OrderedDict()
+    for filename in sorted(os.listdir(dump_dir)):
+        reference = os.path.join(reference_dir, filename)
+        if not os.path.exists(reference):
+            continue
+        differences[filename] = pixel_diff(
+            load_frame(reference), load_frame(os.path.join(dump_dir, filename)),
+            tolerance)
+    return differences
+
+
+def run_backends(args):
+    """
+    Run the scene through several backends, and compare their frames.
+
+    Each backend runs in its own process, since PyOpenGL cannot change its
+    platform once imported. Frames are saved in a subdirectory per backend.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The parsed arguments.
+
+    Returns
+    -------
+    OrderedDict
+        The difference of each frame of each backend from those of the first
+        backend, by backend and filename.
+
+    """
+    dump = args.dump if args.dump is not None else tempfile.mkdtemp()
+    for backend in args.backends:
+        command = [
+            sys.executable, os.path.abspath(__file__),
+            "--backends", backend,
+            "--frames", str(args.frames),
+            "--size", str(args.size[0]), str(args.size[1]),
+            "--image-period", str(args.image_period),
+            "--dump", os.path.join(dump, backend),
+            "--dump-period", str(args.dump_period),
+        ]
+        if args.distance is not None:
+            command += ["--distance", str(args.distance)]
+        if args.text:
+            command.append("--text")
+        subprocess.check_call(command)
+
+    reference = os.path.join(dump, args.backends[0])
+    return OrderedDict(
+        (backend, compare(reference, os.path.join(dump, backend),
+                          args.tolerance))
+        for backend in args.backends[1:])
+
+
+def check(differences, max_fraction):
+    """
+    Report the frames which differ too much.
+
+    Parameters
+    ----------
+    differences : dict
+        The difference of each frame, by filename.
+    max_fraction : float
+        The largest fraction of pixels which may differ.
+
+    Returns
+    -------
+    bool
+        Whether all frames are close enough. False if there are no frames.
+
+    """
+    if not differences:
+        print("No frames to compare", file=sys.stderr)
+        return False
+    failed = [filename for filename, difference in differences.items()
+              if difference["fraction"] > max_fraction]
+    if failed:
+        print("{} of {} frames differ: {}".format(
+            len(failed), len(differences), ", ".join(failed)),
+            file=sys.stderr)
+    return not failed
+
+
+def main():
+    """
+    Main entry point for script.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-b", "--backends", nargs="+", default=["offscreen"],
+                        choices=sorted(BACKENDS),
+                        help="backends to run (default: offscreen)")
+    parser.add_argument("-n", "--frames", type=int, default=300,
+                        help="number of frames to measure (default: 300)")
+    parser.add_argument("--size", nargs=2, type=int, default=(640, 360),
+                        metavar=("WIDTH", "HEIGHT"),
+                        help="size of the frames (default: 640 360)")
+    parser.add_argument("--image-period", type=int, default=15,
+                        help="frames drawn for each background (default: 15)")
+    parser.add_argument("--distance", type=float,
+                        help="distance at which to draw the drone, zooming "
+                             "the background to match (default: no zoom)")
+    parser.add_argument("--text", action="store_true",
+                        help="write messages over the scene on every frame")
+    parser.add_argument("--dump", metavar="DIR",
+                        help="save frames as images in this directory")
+    parser.add_argument("--dump-period", type=int, default=50,
+                        help="frames measured for each frame saved "
+                             "(default: 50)")
+    parser.add_argument("--reference", metavar="DIR",
+                        help="compare the saved frames with those in this "
+                             "directory, and fail if any differ")
+    parser.add_argument("--tolerance", type=int, default=0,
+                        help="largest difference of a channel which is "
+                             "ignored (default: 0)")
+    parser.add_argument("--max-fraction", type=float, default=0,
+                        help="largest fraction of pixels which may differ "
+                             "(default: 0)")
+    args = parser.parse_args()
+    if args.reference is not None and args.dump is None:
+        parser.error("--reference needs --dump")
+    if args.reference is not None and len(args.backends) > 1:
+        parser.error("--reference needs a single backend")
+
+    if len(args.backends) > 1:
+        differences = run_backends(args)
+        print(json.dumps(differences))
+        if not all([check(backend_differences, args.max_fraction)
+                    for backend_differences in differences.values()]):
+            sys.exit(1)
+        return
+
+    try:
+        result = run(args.backends[0], n_frames=args.frames, size=args.size,
+                     image_period=args.image_period, distance=args.distance,
+                     text=args.text, dump_dir=args.dump,
+                     dump_period=args.dump_period)
+    except RuntimeError as e:
+        sys.exit(e)
+    print(json.dumps(result))
+
+    if args.reference is not None:
+        differences = compare(args.reference, args.dump, args.tolerance)
+        print(json.dumps(differences))
+        if not check(differences, args.max_fraction):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,14 +4,16 @@ Evaluators for solving SPIRIT.
 
 """
 from __future__ import division
+from collections import namedtuple, OrderedDict
 import sys
+import timeit
 
 import numpy as np
 
-from helpers import memoize, Pose, Frame
+from helpers import memoize, Pose, Frame, Quat
 
 
-def get_evaluator(method, parent):
+def get_evaluator(method, parent, **kwargs):
     """
     Get an evaluator.
 
@@ -21,6 +23,8 @@ def get_evaluator(method, parent):
         The name of the evaluator.
     parent : Selector
         The selector using the evaluator.
+    kwargs : dict
+        Additional keyword arguments passed to the evaluator.
 
     Returns
     -------
@@ -28,7 +32,104 @@ def get_evaluator(method, parent):
         The initialized evaluator.
 
     """
-    return getattr(sys.modules[__name__], method)(parent)
+    return getattr(sys.modules[__name__], method)(parent, **kwargs)
+
+
+def get_components(method):
+    """
+    Get the scoring components of an evaluator.
+
+    Parameters
+    ----------
+    method : str
+        The name of the evaluator.
+
+    Returns
+    -------
+    OrderedDict
+        The inputs of each component, by name.
+
+    """
+    return getattr(sys.modules[__name__], method).components()
+
+
+# Inputs which are part of the state of the selector, rather than parameters.
+STATE_INPUTS = ("pose", "current_frame")
+
+
+def component(*inputs):
+    """
+    Register a method as a scoring component of its evaluator.
+
+    The method scores one frame. Its vectorized kernel, which scores stacked
+    frames, is the method of the same name with a ``_batch`` suffix.
+
+    Parameters
+    ----------
+    inputs : Sequence[str]
+        What the score depends on, apart from the frame. This is any of
+        `STATE_INPUTS`, and the names of the parameters used. A component
+        which does not depend on the pose is only recalculated for new frames,
+        or when the current frame changes.
+
+    Returns
+    -------
+    callable
+        The decorator.
+
+    """
+    def register(method):
+        method.component_inputs = inputs
+        return method
+    return register
+
+
+# The compiled scoring of an evaluator.
+Scoring = namedtuple("Scoring", "coeffs terms kernels weights static_kernels "
+                                "static_weights can_batch switch_margin "
+                                "min_dwell")
+
+
+def _distance_shell(ref_distance, quadratic, linear, score):
+    """
+    Find the distances at which a frame can have a given score.
+
+    The score is bounded below by ``quadratic * u**2 + linear * (u + 1)``,
+    where ``u = (distance - ref_distance) / ref_distance``.
+
+    Parameters
+    ----------
+    ref_distance : float
+        The reference distance.
+    quadratic : float
+        The coefficient of the squared relative distance error.
+    linear : float
+        The coefficient of the relative distance.
+    score : float
+        The highest score of interest.
+
+    Returns
+    -------
+    tuple of float | None
+        The minimum and maximum distances, or None if the score is not
+        bounded by the distance.
+
+    """
+    if quadratic > 0:
+        discriminant = linear**2 - 4 * quadratic * (linear - score)
+        if discriminant < 0:
+            return np.inf, -np.inf
+        u_min = (-linear - np.sqrt(discriminant)) / (2 * quadratic)
+        u_max = (-linear + np.sqrt(discriminant)) / (2 * quadratic)
+    elif linear > 0:
+        u_min = -1
+        u_max = score / linear - 1
+    else:
+        return None
+
+    tolerance = 1e-9 * ref_distance  # Rounding errors
+    return (ref_distance * (1 + u_min) - tolerance,
+            ref_distance * (1 + u_max) + tolerance)
 
 
 class Evaluator(object):
@@ -36,23 +137,167 @@ class Evaluator(object):
     Base class for evaluators.
 
     The methods used and their coefficients can be set in the configuration file
-    by setting the ``coeff_{method_name}`` for the appropriate evaluator.
+    by setting the ``coeff_{method_name}`` for the appropriate evaluator. Each
+    method which can be used is registered with `component`.
+
+    The coefficients and parameters used are compiled once by `compile`, and
+    can be recompiled at any time. If every method used also has a vectorized
+    ``{method_name}_batch`` kernel, all frames are scored in a single pass
+    over stacked arrays instead of one frame at a time, as a weighted sum of
+    the kernels. The scores of methods which do not depend on the pose are
+    only recalculated for new frames, or when the current frame changes.
+
+    To keep the selection from flickering between frames with similar
+    scores, the current frame is only replaced by a frame which scores at
+    least ``switch_margin`` lower, and only once it has been selected for at
+    least ``min_dwell`` seconds, by the stamps of the poses. Unstamped poses
+    are timed by the clock instead. If time goes backwards, as when a bag
+    loops or simulated time is reset, the dwell time starts again. Both
+    parameters are optional, and can be set for each evaluator.
 
     Parameters
     ----------
     parent : Selector
         The selector using the evaluator.
+    batch : Optional[bool]
+        Whether to use vectorized evaluation when it is available. Default is
+        True.
 
     Attributes
     ----------
     is_busy : bool
         Whether a calculation is currently running.
+    batch : bool
+        Whether to use vectorized evaluation when it is available.
+    coeffs
+    n_switches : int
+        The number of times a different frame was selected.
+    n_held : int
+        The number of times the current frame was kept, although another
+        frame scored lower.
+
+    Raises
+    ------
+    AttributeError
+        If a coefficient is given for a method which is not a component.
 
     """
-    def __init__(self, parent):
+    _registries = {}
+    switching_params = {"switch_margin": 0, "min_dwell": 0}
+
+    def __init__(self, parent, batch=True):
         self.is_busy = False
+        self.batch = batch
         self._parent = parent
         self._vars_frame = {}
+        self.n_switches = 0
+        self.n_held = 0
+        self._switch_time = None
+
+        self._static_scores = None
+        self._static_version = None
+        self._static_frame = None
+        self.compile()
+
+    @classmethod
+    def components(cls):
+        """
+        Get the scoring components of the evaluator.
+
+        Returns
+        -------
+        OrderedDict
+            The inputs of each component, by name.
+
+        """
+        try:
+            return cls._registries[cls]
+        except KeyError:
+            pass
+        registry = OrderedDict()
+        for name in sorted(dir(cls)):
+            inputs = getattr(getattr(cls, name), "component_inputs", None)
+            if inputs is not None:
+                registry[name] = inputs
+        cls._registries[cls] = registry
+        return registry
+
+    def compile(self):
+        """
+        Compile the coefficients and parameters of the components used.
+
+        The coefficients are read from the parent, and the parameters are
+        fetched from the parent once, and stored as attributes. The scoring
+        is replaced in a single step, so that this can be called to reload
+        the parameters while the parent keeps running, as long as no
+        evaluation is running at the same time.
+
+        Raises
+        ------
+        AttributeError
+            If a coefficient is given for a method which is not a component.
+
+        """
+        registry = self.components()
+        coeffs = OrderedDict(self._parent.eval_coeffs)
+        unknown = [name for name in coeffs if name not in registry]
+        if unknown:
+            raise AttributeError("{} has no components named {}".format(
+                type(self).__name__, ", ".join(unknown)))
+
+        for name in getattr(self._parent, "eval_method_params", ()):
+            self.__dict__.pop(name, None)
+        for name in coeffs:
+            for param in registry[name]:
+                if param not in STATE_INPUTS:
+                    self.__dict__[param] = getattr(self._parent, param)
+
+        static = [name for name in coeffs
+                  if "pose" not in registry[name]]
+        dynamic = [name for name in coeffs if name not in static]
+        can_batch = all(hasattr(self, "{}_batch".format(name))
+                        for name in coeffs)
+
+        switching = {}
+        for param, default in self.switching_params.items():
+            try:
+                switching[param] = getattr(self._parent, param)
+            except (AttributeError, KeyError):
+                switching[param] = default
+            if switching[param] in (None, "None"):
+                switching[param] = default
+
+        def kernels(names):
+            if not can_batch:
+                return ()
+            return tuple(getattr(self, "{}_batch".format(name))
+                         for name in names)
+
+        self._scoring = Scoring(
+            coeffs=coeffs,
+            terms=tuple((coeffs[name], getattr(self, name))
+                        for name in coeffs),
+            kernels=kernels(dynamic),
+            weights=np.array([coeffs[name] for name in dynamic], dtype=float),
+            static_kernels=kernels(static),
+            static_weights=np.array([coeffs[name] for name in static],
+                                    dtype=float),
+            can_batch=can_batch,
+            **switching)
+        self._static_scores = None
+
+    @property
+    def coeffs(self):
+        """
+        The coefficients of the components used.
+
+        Returns
+        -------
+        OrderedDict
+            The coefficient of each component, by name.
+
+        """
+        return self._scoring.coeffs
 
     def _evaluate_frame(self, pose, frame):
         """
@@ -73,46 +318,342 @@ class Evaluator(object):
         """
         try:
             self.is_busy = True
-            score = sum(coeff * self.__getattribute__(component)(pose, frame)
-                        for component, coeff in self.eval_coeffs.items())
+            score = sum(coeff * method(pose, frame)
+                        for coeff, method in self._scoring.terms)
             self._vars_frame = {}
         finally:
             self.is_busy = False
 
         return score
 
-    def select_best_frame(self):
+    @staticmethod
+    def _evaluate_frames(pose, frames, kernels, weights):
+        """
+        Evaluate the scores for a pose against all frames at once.
+
+        Parameters
+        ----------
+        pose : Pose
+            The pose to be evaluated.
+        frames : FrameArrays
+            The frames against which the pose is evaluated.
+        kernels : Sequence[callable]
+            The vectorized kernels of the methods to evaluate.
+        weights : np.ndarray
+            The coefficient of each kernel.
+
+        Returns
+        -------
+        np.ndarray
+            The score for the pose against each frame.
+
+        """
+        if not len(kernels):
+            return np.zeros(len(frames))
+        return weights.dot([kernel(pose, frames) for kernel in kernels])
+
+    def _update_static_scores(self, pose, kernels, weights):
+        """
+        Update the scores of the methods which do not depend on the pose.
+
+        Only new frames are evaluated, unless the current frame has changed.
+
+        Parameters
+        ----------
+        pose : Pose
+            The pose to be evaluated. It does not affect the scores.
+        kernels : Sequence[callable]
+            The vectorized kernels of the methods to evaluate.
+        weights : np.ndarray
+            The coefficient of each kernel.
+
+        Returns
+        -------
+        np.ndarray
+            The score of each row of the frame store.
+
+        """
+        frames = self.frames
+        version = frames.version
+        n_frames = len(frames)
+
+        if (self._static_frame is not self.current_frame
+                or self._static_scores is None
+                or len(self._static_scores) != frames.capacity):
+            self._static_scores = np.zeros(frames.capacity)
+            rows = frames.rows()
+        else:
+            n_new = min(version - self._static_version, n_frames)
+            rows = frames.rows(n_frames - n_new)
+
+        if len(rows):
+            self._static_scores[rows] = self._evaluate_frames(
+                pose, frames.view(rows), kernels, weights)
+        self._static_version = version
+        self._static_frame = self.current_frame
+        return self._static_scores
+
+    @property
+    def can_batch(self):
+        """
+        Check if all the components used have a vectorized implementation.
+
+        Returns
+        -------
+        bool
+            Whether the frames can be evaluated in a single pass.
+
+        """
+        return self._scoring.can_batch
+
+    def select_best_frame(self, pose=None):
         """
         Select the best frame using the minimum of all individual frame scores.
 
+        The current frame is kept unless the switching policy allows the best
+        frame to replace it.
+
+        Parameters
+        ----------
+        pose : Optional[Pose]
+            The pose to be evaluated. Default is the latest pose of the
+            selector.
+
         Returns
         -------
         Frame
             The best frame.
 
         """
+        if pose is None:
+            pose = self.pose
+
         if self.frames:
             if self.current_frame is None:
                 return self.frames[0]
 
-            results = {}
-            try:
-                for frame in self.frames:
-                    results[frame] = self._evaluate_frame(self.pose, frame)
-            except RuntimeError:
-                # A new frame was added. Cancel the calculation and keep the
-                # displayed frame the same.
-                return self.current_frame
+            if self.batch and self.can_batch:
+                best_frame, best_score = self._select_best_frame_batch(pose)
             else:
-                return min(results, key=results.get)
+                results = {frame: self._evaluate_frame(pose, frame)
+                           for frame in self.frames}
+                best_frame = min(results, key=results.get)
+                best_score = results[best_frame]
+            return self._switch(pose, best_frame, best_score)
+
+    def _switch(self, pose, best_frame, best_score):
+        """
+        Decide whether to replace the current frame with the best frame.
+
+        Parameters
+        ----------
+        pose : Pose
+            The pose being evaluated.
+        best_frame : Frame
+            The frame with the lowest score.
+        best_score : float
+            The score of the best frame.
+
+        Returns
+        -------
+        Frame
+            The frame to show.
+
+        """
+        current_frame = self.current_frame
+        if best_frame is current_frame:
+            return current_frame
+
+        scoring = self._scoring
+        now = pose.header.stamp.to_sec() or timeit.default_timer()
+        if self._switch_time is not None and now < self._switch_time:
+            self._switch_time = None
+        if self._is_stored(current_frame):
+            if (self._switch_time is not None
+                    and now - self._switch_time < scoring.min_dwell):
+                self.n_held += 1
+                return current_frame
+            if scoring.switch_margin > 0:
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    current_score = self._evaluate_frame(pose, current_frame)
+                if best_score > current_score - scoring.switch_margin:
+                    self.n_held += 1
+                    return current_frame
+
+        self._switch_time = now
+        self.n_switches += 1
+        return best_frame
+
+    def _is_stored(self, frame):
+        """
+        Check whether a frame is still in the frame store.
+
+        Frames are compared by identity, since their stamps need not be set,
+        distinct, or in order.
+
+        Parameters
+        ----------
+        frame : Frame
+            The frame.
+
+        Returns
+        -------
+        bool
+            Whether the frame is stored.
+
+        """
+        return frame in self.frames
+
+    def _select_best_frame_batch(self, pose):
+        """
+        Select the best frame, evaluating all frames at once.
+
+        If the frame store keeps a spatial index, only the frames which can
+        possibly be the best are evaluated. Frames with an undefined score are
+        never selected, unless all scores are undefined.
+
+        Parameters
+        ----------
+        pose : Pose
+            The pose to be evaluated.
+
+        Returns
+        -------
+        Frame
+            The best frame.
+        float
+            The score of the best frame.
+
+        """
+        try:
+            self.is_busy = True
+            with np.errstate(divide="ignore", invalid="ignore"):
+                if self.can_prune:
+                    rows, scores = self._score_within_shell(pose)
+                else:
+                    rows, scores = None, self._score_rows(pose)
+        finally:
+            self.is_busy = False
+
+        scores[np.isnan(scores)] = np.inf
+        return (self.frames.frame(self.frames.argmin(scores, rows)),
+                scores.min())
+
+    def _score_rows(self, pose, rows=None):
+        """
+        Evaluate the scores for a pose against some of the stored frames.
+
+        Parameters
+        ----------
+        pose : Pose
+            The pose to be evaluated.
+        rows : Optional[np.ndarray]
+            The rows of the frames to evaluate. Default is every frame, in
+            storage order.
+
+        Returns
+        -------
+        np.ndarray
+            The score for the pose against each frame.
+
+        """
+        scoring = self._scoring
+        frames = self.frames.view(rows)
+        scores = self._evaluate_frames(pose, frames, scoring.kernels,
+                                       scoring.weights)
+        if scoring.static_kernels:
+            static_scores = self._update_static_scores(
+                pose, scoring.static_kernels, scoring.static_weights)
+            if rows is None:
+                scores += static_scores[:len(frames)]
+            else:
+                scores += static_scores[rows]
+        return scores
+
+    def _score_within_shell(self, pose):
+        """
+        Evaluate only the frames which can possibly be the best.
+
+        Frames near the reference distance from the pose are evaluated first.
+        Every component is non-negative, so the distance components alone
+        give a lower bound for the score of each frame. Frames whose bound is
+        higher than the best score found so far are never evaluated.
+
+        Parameters
+        ----------
+        pose : Pose
+            The pose to be evaluated.
+
+        Returns
+        -------
+        rows : np.ndarray | None
+            The rows of the frames evaluated, or None if every frame was.
+        scores : np.ndarray
+            The score for the pose against each frame evaluated.
+
+        """
+        index = self.frames.index
+        position = pose.position
+        width = index.cell_size
+        rows = []
+        while not len(rows):
+            rows = index.query(position, self.ref_distance - width,
+                               self.ref_distance + width)
+            width *= 2
+
+        scores = self._score_rows(pose, rows)
+        if not np.isfinite(scores).any():
+            return None, self._score_rows(pose)
+
+        min_distance, max_distance = self._distance_bounds(
+            scores[np.isfinite(scores)].min())
+        rows = np.union1d(rows, index.query(position, min_distance,
+                                            max_distance))
+        return rows, self._score_rows(pose, rows)
+
+    # noinspection PyMethodMayBeStatic,PyUnusedLocal
+    def _distance_bounds(self, score):
+        """
+        Find the distances from the pose at which a frame can have a score.
+
+        Parameters
+        ----------
+        score : float
+            The highest score of interest.
+
+        Returns
+        -------
+        tuple of float | None
+            The minimum and maximum distances from the pose, or None if the
+            score of a frame is not bounded by its distance.
+
+        """
+        return None
+
+    @property
+    def can_prune(self):
+        """
+        Check if frames can be skipped based on their distance from the pose.
+
+        Returns
+        -------
+        bool
+            Whether the frame store has a spatial index, and the scores are
+            bounded by distance.
+
+        """
+        return (self.frames.index is not None
+                and all(coeff >= 0 for coeff in self.coeffs.values())
+                and self._distance_bounds(0) is not None)
 
     def __getattr__(self, name):
         """
         Return undefined attributes.
 
-        Upon first access, the value of the parameter is obtained from the
-        parent class and stored as an attribute, from where it is read on
-        subsequent accesses.
+        Parameters which have not been compiled are obtained from the parent
+        class upon first access, and stored as attributes, from where they are
+        read on subsequent accesses. Anything else, such as the frames, is
+        read from the parent class.
 
         Parameters
         ----------
@@ -139,6 +680,7 @@ class ConstantTimeDelay(Evaluator):
     Use an evaluator which keeps a constant time delay.
 
     """
+    @component("pose", "ref_delay")
     def time(self, pose, frame):
         """
         Get the time difference between pose and frame.
@@ -159,12 +701,33 @@ class ConstantTimeDelay(Evaluator):
         optimum_timestamp = pose.header.stamp.to_sec() - self.ref_delay
         return abs(frame.stamp.to_sec() - optimum_timestamp)
 
+    def time_batch(self, pose, frames):
+        """
+        Get the time differences between pose and frames.
+
+        Parameters
+        ----------
+        pose : Pose
+            The pose to be evaluated.
+        frames : FrameArrays
+            The frames against which the pose is evaluated.
+
+        Returns
+        -------
+        np.ndarray
+            The difference between the optimum and frame timestamps.
+
+        """
+        optimum_timestamp = pose.header.stamp.to_sec() - self.ref_delay
+        return np.abs(frames.stamps - optimum_timestamp)
+
 
 class ConstantDistance(Evaluator):
     """
     Use an evaluator which maintains a constant absolute distance.
 
     """
+    @component("pose", "ref_distance")
     def distance(self, pose, frame):
         """
         Get the absolute distance between pose and frame.
@@ -185,6 +748,34 @@ class ConstantDistance(Evaluator):
         """
         return abs(frame.distance(pose) - self.ref_distance)
 
+    def distance_batch(self, pose, frames):
+        """
+        Get the absolute distances between pose and frames.
+
+        Parameters
+        ----------
+        pose : Pose
+            The pose to be evaluated.
+        frames : FrameArrays
+            The frames against which the pose is evaluated.
+
+        Returns
+        -------
+        np.ndarray
+            The difference of the distance between each frame and pose, and
+            the reference distance.
+
+        """
+        return np.abs(frames.distance(pose) - self.ref_distance)
+
+    def _distance_bounds(self, score):
+        coeff = self.coeffs.get("distance", 0)
+        if coeff <= 0:
+            return None
+        tolerance = 1e-9 * self.ref_distance  # Rounding errors
+        return (self.ref_distance - score / coeff - tolerance,
+                self.ref_distance + score / coeff + tolerance)
+
 
 class Spirit(Evaluator):
     """
@@ -192,6 +783,7 @@ class Spirit(Evaluator):
 
     """
     @staticmethod
+    @component("pose")
     def centrality(pose, frame):
         """
         Get how close to the centre of the frame the pose is.
@@ -214,6 +806,28 @@ class Spirit(Evaluator):
         dx, dy, dz = frame.rel_position(pose)
         return (dx**2 + dz**2) / dy**2
 
+    @staticmethod
+    def centrality_batch(pose, frames):
+        """
+        Get how close to the centre of each frame the pose is.
+
+        Parameters
+        ----------
+        pose : Pose
+            The pose to be evaluated.
+        frames : FrameArrays
+            The frames against which the pose is evaluated.
+
+        Returns
+        -------
+        np.ndarray
+            The centrality scores.
+
+        """
+        dx, dy, dz = frames.rel_position(pose).T
+        return (dx**2 + dz**2) / dy**2
+
+    @component("pose", "ref_distance")
     def centrality2(self, pose, frame):
         """
         Get how close to the centre of the frame the pose is.
@@ -237,7 +851,28 @@ class Spirit(Evaluator):
         dx, dy, dz = frame.rel_position(pose)
         return np.linalg.norm([dx, dz]) / self.ref_distance
 
+    def centrality2_batch(self, pose, frames):
+        """
+        Get how close to the centre of each frame the pose is.
+
+        Parameters
+        ----------
+        pose : Pose
+            The pose to be evaluated.
+        frames : FrameArrays
+            The frames against which the pose is evaluated.
+
+        Returns
+        -------
+        np.ndarray
+            The centrality scores.
+
+        """
+        dx, dy, dz = frames.rel_position(pose).T
+        return np.hypot(dx, dz) / self.ref_distance
+
     @memoize
+    @component("pose")
     def direction(self, pose, frame):
         """
         Get how close the yaws of pose and frame are.
@@ -257,7 +892,28 @@ class Spirit(Evaluator):
         """
         return frame.rel_euler(pose)[2] ** 2
 
+    @staticmethod
+    def direction_batch(pose, frames):
+        """
+        Get how close the yaws of pose and each frame are.
+
+        Parameters
+        ----------
+        pose : Pose
+            The pose to be evaluated.
+        frames : FrameArrays
+            The frames against which the pose is evaluated.
+
+        Returns
+        -------
+        np.ndarray
+            The direction scores.
+
+        """
+        return frames.rel_euler(pose)[:, 2] ** 2
+
     @memoize
+    @component("pose", "ref_distance")
     def distance(self, pose, frame):
         """
         Get the closeness to the reference distance.
@@ -278,7 +934,28 @@ class Spirit(Evaluator):
         return ((frame.distance(pose) - self.ref_distance)
                 / self.ref_distance)**2
 
+    def distance_batch(self, pose, frames):
+        """
+        Get the closeness of each frame to the reference distance.
+
+        Parameters
+        ----------
+        pose : Pose
+            The pose to be evaluated.
+        frames : FrameArrays
+            The frames against which the pose is evaluated.
+
+        Returns
+        -------
+        np.ndarray
+            The distance scores.
+
+        """
+        return ((frames.distance(pose) - self.ref_distance)
+                / self.ref_distance)**2
+
     # noinspection PyUnusedLocal
+    @component("current_frame")
     def direction_with_current(self, pose, frame):
         """
         Get how close the yaws of pose and the currently displayed frame are.
@@ -299,6 +976,29 @@ class Spirit(Evaluator):
         return self.direction(frame.pose, self.current_frame)
 
     # noinspection PyUnusedLocal
+    def direction_with_current_batch(self, pose, frames):
+        """
+        Get how close the yaws of each frame and the current frame are.
+
+        Parameters
+        ----------
+        pose : Pose
+            (Unused) The pose to be evaluated.
+        frames : FrameArrays
+            The frames against which the pose is evaluated.
+
+        Returns
+        -------
+        np.ndarray
+            The similar direction scores.
+
+        """
+        rel_rotations = Quat.rel_rotation_batch(
+            frames.orientations, self.current_frame.pose.orientation)
+        return Quat.to_euler_batch(rel_rotations)[:, 2] ** 2
+
+    # noinspection PyUnusedLocal
+    @component("pose", "ref_distance")
     def distance_with_current(self, pose, frame):
         """
         Get the closeness to the currently displayed frame.
@@ -318,6 +1018,31 @@ class Spirit(Evaluator):
         """
         return frame.distance(pose) / self.ref_distance
 
+    def distance_with_current_batch(self, pose, frames):
+        """
+        Get the closeness of each frame to the currently displayed frame.
+
+        Parameters
+        ----------
+        pose : Pose
+            The pose to be evaluated.
+        frames : FrameArrays
+            The frames against which the pose is evaluated.
+
+        Returns
+        -------
+        np.ndarray
+            The similar distance scores.
+
+        """
+        return frames.distance(pose) / self.ref_distance
+
+    def _distance_bounds(self, score):
+        return _distance_shell(self.ref_distance,
+                               self.coeffs.get("distance", 0),
+                               self.coeffs.get("distance_with_current", 0),
+                               score)
+
 
 class Murata(Evaluator):
     """
@@ -352,6 +1077,7 @@ class Murata(Evaluator):
         return super(Murata, self)._evaluate_frame(pose, frame)
 
     # noinspection PyUnusedLocal
+    @component("pose", "ref_height")
     def height(self, pose, frame):
         """
         Get the closeness to a reference height.
@@ -372,7 +1098,28 @@ class Murata(Evaluator):
         return ((self._vars_frame["dzg"] - self.ref_height)
                 / self.ref_height)**2
 
+    def height_batch(self, pose, frames):
+        """
+        Get the closeness of each frame to a reference height.
+
+        Parameters
+        ----------
+        pose : Pose
+            The pose to be evaluated.
+        frames : FrameArrays
+            The frames against which the pose is evaluated.
+
+        Returns
+        -------
+        np.ndarray
+            The height scores.
+
+        """
+        dzg = pose.position[2] - frames.positions[:, 2]
+        return ((dzg - self.ref_height) / self.ref_height)**2
+
     @staticmethod
+    @component("pose")
     def direction(pose, frame):
         """
         Get how close the yaws of pose and frame are.
@@ -392,7 +1139,28 @@ class Murata(Evaluator):
         """
         return frame.rel_euler(pose)[2] ** 2
 
+    @staticmethod
+    def direction_batch(pose, frames):
+        """
+        Get how close the yaws of pose and each frame are.
+
+        Parameters
+        ----------
+        pose : Pose
+            The pose to be evaluated.
+        frames : FrameArrays
+            The frames against which the pose is evaluated.
+
+        Returns
+        -------
+        np.ndarray
+            The direction scores.
+
+        """
+        return frames.rel_euler(pose)[:, 2] ** 2
+
     # noinspection PyUnusedLocal
+    @component("pose")
     def elevation(self, pose, frame):
         """
         Get the closeness to the reference elevation.
@@ -412,6 +1180,28 @@ class Murata(Evaluator):
         """
         return np.arctan2(self._vars_frame["dzg"], self._vars_frame["dyg"]) ** 2
 
+    @staticmethod
+    def elevation_batch(pose, frames):
+        """
+        Get the closeness of each frame to the reference elevation.
+
+        Parameters
+        ----------
+        pose : Pose
+            The pose to be evaluated.
+        frames : FrameArrays
+            The frames against which the pose is evaluated.
+
+        Returns
+        -------
+        np.ndarray
+            The elevation scores.
+
+        """
+        dxg, dyg, dzg = (pose.position - frames.positions).T
+        return np.arctan2(dzg, dyg) ** 2
+
+    @component("pose", "ref_distance")
     def distance(self, pose, frame):
         """
         Get the closeness to the reference distance.
@@ -431,3 +1221,27 @@ class Murata(Evaluator):
         """
         return ((frame.distance(pose) - self.ref_distance)
                 / self.ref_distance)**2
+
+    def distance_batch(self, pose, frames):
+        """
+        Get the closeness of each frame to the reference distance.
+
+        Parameters
+        ----------
+        pose : Pose
+            The pose to be evaluated.
+        frames : FrameArrays
+            The frames against which the pose is evaluated.
+
+        Returns
+        -------
+        np.ndarray
+            The distance scores.
+
+        """
+        return ((frames.distance(pose) - self.ref_distance)
+                / self.ref_distance)**2
+
+    def _distance_bounds(self, score):
+        return _distance_shell(self.ref_distance,
+                               self.coeffs.get("distance", 0), 0, score)
@@ -4,22 +4,38 @@ Helper functions and classes for general use.
 
 """
 from __future__ import division
+from collections import deque, namedtuple, OrderedDict
+from contextlib import contextmanager
 from functools import partial, update_wrapper
-from time import localtime, strftime
+import math
+import threading
+from time import localtime, sleep, strftime
+import timeit
+
+try:
+    from queue import Queue
+except ImportError:  # Python 2
+    from Queue import Queue
 
 import numpy as np
 from numpy.linalg import norm
 
+try:
+    import cv2
+except ImportError:  # Only needed for compressed image storage.
+    cv2 = None
+
 import rospy
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
 from geometry_msgs.msg import Point, PoseStamped, Quaternion
 from sensor_msgs.msg import Image
 from std_msgs.msg import Header
-import tf
 
 
 d2r = np.deg2rad
 r2d = np.rad2deg
 EULER_CONVENTION = "rxyz"
+_EPS = np.finfo(float).eps * 4  # Same tolerance as tf.transformations
 
 
 def unit_vector(v):
@@ -44,11 +60,71 @@ def unit_vector(v):
         return np.asarray(v)
 
 
+def unit_vectors(vs):
+    """
+    Change the length of each row vector to unity in the same direction.
+
+    Parameters
+    ----------
+    vs : array-like
+        An array of vectors to be normalized, with the vectors along the last
+        axis.
+
+    Returns
+    -------
+    np.ndarray
+        The normalized vectors. Vectors with a length of 0 are unchanged.
+
+    """
+    vs = np.asarray(vs, dtype=float)
+    norms = np.linalg.norm(vs, axis=-1)[..., np.newaxis]
+    return np.divide(vs, norms, out=vs.copy(), where=norms != 0)
+
+
+CacheInfo = namedtuple("CacheInfo", "hits misses maxsize")
+
+
 # noinspection PyPep8Naming
 class memoize(object):
-    def __init__(self, func):
+    """
+    Memoize a method, with a separate cache for each instance.
+
+    Each cache holds at most `maxsize` results, and the least recently used
+    result is discarded first. The decorator can be used either as
+    ``@memoize`` or as ``@memoize(maxsize=n)``.
+
+    Parameters
+    ----------
+    func : Callable
+        The method to memoize.
+    maxsize : Optional[int]
+        The maximum number of results cached for each instance. Default is
+        128. If None, the cache is unbounded.
+
+    Attributes
+    ----------
+    hits : int
+        The number of calls answered from the cache, over all instances.
+    misses : int
+        The number of calls which had to be evaluated, over all instances.
+    instances : list of memoize
+        (Class attribute) Every memoized method.
+
+    """
+    instances = []
+
+    def __new__(cls, func=None, maxsize=128):
+        if func is None:
+            return partial(cls, maxsize=maxsize)
+        return super(memoize, cls).__new__(cls)
+
+    def __init__(self, func, maxsize=128):
         self.func = func
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
         update_wrapper(self, func)
+        memoize.instances.append(self)
 
     def __get__(self, instance, owner):
         if instance is None:
@@ -58,16 +134,52 @@ class memoize(object):
     def __call__(self, *args, **kwargs):
         obj = args[0]
         try:
-            cache = obj.__cache__
+            caches = obj.__cache__
         except AttributeError:
-            cache = obj.__cache__ = {}
-        key = (self.func, args[1:], frozenset(kwargs.items()))
+            caches = obj.__cache__ = {}
         try:
-            res = cache[key]
+            cache = caches[self.func]
         except KeyError:
-            res = cache[key] = self.func(*args, **kwargs)
+            cache = caches[self.func] = OrderedDict()
+
+        key = (args[1:], frozenset(kwargs.items())) if kwargs else args[1:]
+        try:
+            res = cache.pop(key)
+            self.hits += 1
+        except KeyError:
+            res = self.func(*args, **kwargs)
+            self.misses += 1
+            if self.maxsize is not None and len(cache) >= self.maxsize:
+                cache.popitem(last=False)
+        cache[key] = res  # Most recently used results are last.
         return res
 
+    def cache_info(self):
+        """
+        Report the cache statistics of the memoized method.
+
+        Returns
+        -------
+        CacheInfo
+            The number of hits and misses, and the maximum size of the cache.
+
+        """
+        return CacheInfo(self.hits, self.misses, self.maxsize)
+
+    @classmethod
+    def cache_infos(cls):
+        """
+        Report the cache statistics of every memoized method.
+
+        Returns
+        -------
+        dict
+            The cache statistics, keyed by the name of the method.
+
+        """
+        return {getattr(m.func, "__qualname__", m.func.__name__): m.cache_info()
+                for m in cls.instances}
+
 
 class Pose(object):
     """
@@ -251,12 +363,17 @@ class Frame(object):
     """
     Encapsulate an image and the pose it was taken in.
 
+    Results relative to another pose are memoized for the few most recent
+    poses only, since a new `Pose` is created for every pose message.
+
     Parameters
     ----------
     pose_stamped : PoseStamped
         The pose of the drone when the image was taken.
     image : Image
         The image that was taken.
+    load_image : Optional[callable]
+        A function returning the image, if it is not given directly.
 
     Attributes
     ----------
@@ -266,24 +383,41 @@ class Frame(object):
         The pose of the drone at which the image was taken.
     rotation_matrix : np.ndarray
         The rotation matrix of the frame orientation.
-    image : Image
-        The image that was taken.
+    image
     stamp : rospy.rostime.Time
         The timestamp of the pose.
     stamp_str : str
         The timestamp of the pose, in human readable format.
 
     """
-    def __init__(self, pose_stamped, image):
+    def __init__(self, pose_stamped, image=None, load_image=None):
         self.pose_stamped = pose_stamped
         self.pose = Pose(pose_stamped)
         self.rotation_matrix = Quat.rotation_matrix(self.pose.orientation)
-        self.image = image
+        self._image = image
+        self._load_image = load_image
         self.stamp = self.pose.header.stamp
         self.stamp_str = strftime("%Y-%m-%d %H:%M:%S",
                                   localtime(self.stamp.to_time()))
 
-    @memoize
+    @property
+    def image(self):
+        """
+        The image that was taken.
+
+        Images which are loaded on access are not kept by the frame.
+
+        Returns
+        -------
+        Image | None
+            The image, or None if it is no longer available.
+
+        """
+        if self._load_image is not None:
+            return self._load_image()
+        return self._image
+
+    @memoize(maxsize=4)
     def rel_position(self, pose):
         """
         Calculate the relative position with another pose, with local reference.
@@ -302,7 +436,7 @@ class Frame(object):
         return self.pose.rel_position(pose,
                                       rotation_matrix=self.rotation_matrix)
 
-    @memoize
+    @memoize(maxsize=4)
     def rel_euler(self, pose):
         """
         Calculate the relative angle with another pose.
@@ -320,7 +454,7 @@ class Frame(object):
         """
         return self.pose.rel_euler(pose)
 
-    @memoize
+    @memoize(maxsize=4)
     def distance(self, pose):
         """
         Calculate the distance to another pose.
@@ -342,217 +476,2146 @@ class Frame(object):
         return "<Frame({pose})>".format(pose=self.pose)
 
 
-class Fov(object):
+class FrameArrays(object):
     """
-    Field of view methods.
+    Stacked pose data of a sequence of frames, for vectorized evaluation.
+
+    The methods mirror those of `Frame`, but return one row per frame.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        An (N, 3) array of the x, y, and z coordinates of each frame.
+    orientations : np.ndarray
+        An (N, 4) array of the x, y, z, and w quaternion of each frame.
+    rotation_matrices : np.ndarray
+        An (N, 3, 3) array of the rotation matrix of each frame.
+    stamps : np.ndarray
+        An (N,) array of the timestamp of each frame, in seconds.
+
+    Attributes
+    ----------
+    positions : np.ndarray
+        An (N, 3) array of the x, y, and z coordinates of each frame.
+    orientations : np.ndarray
+        An (N, 4) array of the x, y, z, and w quaternion of each frame.
+    rotation_matrices : np.ndarray
+        An (N, 3, 3) array of the rotation matrix of each frame.
+    stamps : np.ndarray
+        An (N,) array of the timestamp of each frame, in seconds.
 
     """
-    @staticmethod
-    def d2v(fov_diagonal, aspect_ratio=4 / 3):
+    def __init__(self, positions, orientations, rotation_matrices, stamps):
+        self.positions = positions
+        self.orientations = orientations
+        self.rotation_matrices = rotation_matrices
+        self.stamps = stamps
+
+    def rel_position(self, pose):
         """
-        Convert a diagonal field of view to vertical.
+        Calculate the relative positions with another pose, with local reference.
 
         Parameters
         ----------
-        fov_diagonal : float
-            The diagonal field of view.
-        aspect_ratio: Optional[float]
-            The aspect ratio of the display. Default is 4:3.
+        pose : Pose
+            The target pose.
 
         Returns
         -------
-        float
-            The vertical field of view.
+        np.ndarray
+            An (N, 3) array of the x, y, z relative positions.
 
         """
-        ratio_diagonal = np.sqrt(1 + aspect_ratio**2)
-        return 2 * r2d(np.arctan(np.tan(d2r(fov_diagonal) / 2)
-                                 / ratio_diagonal))
+        return np.einsum("nij,nj->ni", self.rotation_matrices,
+                         pose.position - self.positions)
 
-    @staticmethod
-    def v2h(fov_vertical, aspect_ratio=4 / 3):
+    def rel_euler(self, pose):
         """
-        Convert a vertical field of view to horizontal.
+        Calculate the relative angles with another pose.
 
         Parameters
         ----------
-        fov_vertical : float
-            The vertical field of view.
-        aspect_ratio: Optional[float]
-            The aspect ratio of the display. Default is 4:3.
+        pose : Pose
+            The target pose.
 
         Returns
         -------
-        float
-            The horizontal field of view.
+        np.ndarray
+            An (N, 3) array of the relative angles as Euler, in the order of
+            pitch, roll, yaw.
 
         """
-        return 2 * r2d(np.arctan(np.tan(d2r(fov_vertical) / 2) * aspect_ratio))
-
-
-class Quat(object):
-    """
-    Quaternion methods.
+        return Quat.to_euler_batch(Quat.rel_rotation_batch(pose.orientation,
+                                                           self.orientations))
 
-    """
-    @staticmethod
-    def to_euler(quaternion):
+    def distance(self, pose):
         """
-        Change a quaternion to an Euler angle representation.
+        Calculate the distances to another pose.
 
         Parameters
         ----------
-        quaternion : np.ndarray
-            A quaternion in the order of x, y, z, w.
+        pose : Pose
+            The target pose.
 
         Returns
         -------
         np.ndarray
-            The Euler angle, in the order of pitch, roll, yaw.
+            An (N,) array of the distances to the target pose.
 
         """
-        # noinspection PyUnresolvedReferences
-        return tf.transformations.euler_from_quaternion(quaternion,
-                                                        EULER_CONVENTION)
+        return norm(pose.position - self.positions, axis=1)
 
-    @staticmethod
-    def to_axis(quaternion):
+    def __len__(self):
+        return len(self.stamps)
+
+
+class SpatialGrid(object):
+    """
+    A uniform grid over positions, for finding the rows near a point.
+
+    Parameters
+    ----------
+    cell_size : float
+        The side of each cubic cell, in metres.
+
+    Attributes
+    ----------
+    cell_size : float
+        The side of each cubic cell, in metres.
+
+    """
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self._cells = {}  # Cell -> rows
+        self._row_cells = {}  # Row -> cell
+        self._cell_list = None
+        self._cell_array = None
+
+    def insert(self, row, position):
         """
-        Change a quaternion to an axis-angle representation.
+        Add a row to the grid, moving it if it was already present.
 
         Parameters
         ----------
-        quaternion : np.ndarray
-            A quaternion in the order of x, y, z, w.
+        row : int
+            The row of the frame.
+        position : np.ndarray
+            The x, y, and z coordinates of the frame.
 
-        Notes
-        -----
-        θ is in degrees rather than radians, for ease of integration in OpenGL.
+        """
+        cell = tuple(np.floor(position / self.cell_size).astype(int))
+        old_cell = self._row_cells.get(row)
+        if old_cell == cell:
+            return
+
+        if old_cell is not None:
+            rows = self._cells[old_cell]
+            rows.discard(row)
+            if not rows:
+                del self._cells[old_cell]
+                self._cell_list = None
+
+        if cell not in self._cells:
+            self._cells[cell] = set()
+            self._cell_list = None
+        self._cells[cell].add(row)
+        self._row_cells[row] = cell
+
+    def query(self, position, min_distance, max_distance):
+        """
+        Find the rows which may lie within a spherical shell.
+
+        Every row within the shell is returned, along with some rows just
+        outside it.
+
+        Parameters
+        ----------
+        position : np.ndarray
+            The x, y, and z coordinates of the centre of the shell.
+        min_distance : float
+            The inner radius of the shell.
+        max_distance : float
+            The outer radius of the shell.
 
         Returns
         -------
-        tuple
-            The angle in axis-angle representation, with the order of θ, x, y,
-            z. θ is in degrees.
+        np.ndarray
+            The rows found.
 
         """
-        x, y, z, w = unit_vector(quaternion)
-        angle = r2d(2 * np.arccos(w))
+        if self._cell_list is None:
+            self._cell_list = list(self._cells)
+            self._cell_array = np.array(self._cell_list).reshape(-1, 3)
 
-        if angle == 0:
-            axis_x = 1
-            axis_y = axis_z = 0
-        elif angle % 180 == 0:
-            axis_x, axis_y, axis_z = x, y, z
-        else:
-            axis_x = x / np.sqrt(1 - w**2)
-            axis_y = y / np.sqrt(1 - w**2)
-            axis_z = z / np.sqrt(1 - w**2)
+        lower = self._cell_array * self.cell_size
+        upper = lower + self.cell_size
+        nearest = np.maximum(0, np.maximum(lower - position, position - upper))
+        farthest = np.maximum(np.abs(position - lower), np.abs(position - upper))
+        in_shell = ((norm(nearest, axis=1) <= max_distance)
+                    & (norm(farthest, axis=1) >= min_distance))
 
-        return angle, axis_x, axis_y, axis_z
+        rows = [row for i in np.flatnonzero(in_shell)
+                for row in self._cells[self._cell_list[i]]]
+        return np.array(rows, dtype=int)
 
-    @staticmethod
-    def product(a, b):
+    def __len__(self):
+        return len(self._row_cells)
+
+
+class ImageArena(object):
+    """
+    A fixed number of image slots, backed by one contiguous pixel buffer.
+
+    Only the pixel data and a few fields of each image message are kept. The
+    size of a slot is set by the first image stored, and is increased if a
+    larger image arrives.
+
+    Every stored image is tagged with a generation, so that an image which
+    has since been overwritten is never returned in place of another.
+
+    Parameters
+    ----------
+    capacity : int
+        The number of slots.
+    filename : Optional[str]
+        A file in which to map the buffer. Default is to keep it in memory.
+
+    Attributes
+    ----------
+    capacity : int
+        The number of slots.
+    slot_size : int
+        The number of bytes in each slot.
+    filename : str | None
+        The file in which the buffer is mapped.
+    nbytes
+
+    """
+    def __init__(self, capacity, filename=None):
+        self.capacity = capacity
+        self.slot_size = 0
+        self.filename = filename
+
+        self._pixels = np.empty((capacity, 0), dtype=np.uint8)
+        self._lengths = np.zeros(capacity, dtype=int)
+        self._generations = np.full(capacity, -1, dtype=int)
+        self._fields = np.empty(capacity, dtype=object)
+        self._message = (None, None, None)  # Slot, generation, and message.
+
+    def _allocate(self, capacity, slot_size):
         """
-        Find the product of two quaternions.
+        Reallocate the buffer, keeping the stored images.
 
         Parameters
         ----------
-        a : Sequence[float]
-            A quaternion, in the order of x, y, z, w
-        b : Sequence[float]
-            A quaternion, in the order of x, y, z, w
+        capacity : int
+            The new number of slots.
+        slot_size : int
+            The new number of bytes in each slot.
 
-        Returns
-        -------
-        np.ndarray
-            A quaternion, in the order of x, y, z, w
+        """
+        n = min(capacity, self.capacity)
+        if self.filename is None or not capacity * slot_size:
+            pixels = np.empty((capacity, slot_size), dtype=np.uint8)
+            pixels[:n, :self.slot_size] = self._pixels[:n]
+        else:
+            # Mapping the file again overwrites it, so copy the images first.
+            old_pixels = np.array(self._pixels[:n])
+            pixels = np.memmap(self.filename, dtype=np.uint8, mode="w+",
+                               shape=(capacity, slot_size))
+            pixels[:n, :self.slot_size] = old_pixels
+        self._pixels = pixels
+
+        def resize(array, fill):
+            new_array = np.full(capacity, fill, dtype=array.dtype)
+            new_array[:n] = array[:n]
+            return new_array
+
+        self._lengths = resize(self._lengths, 0)
+        self._generations = resize(self._generations, -1)
+        self._fields = resize(self._fields, None)
+        self.capacity = capacity
+        self.slot_size = slot_size
+
+    def resize(self, capacity):
+        """
+        Change the number of slots, keeping the stored images.
+
+        Parameters
+        ----------
+        capacity : int
+            The new number of slots.
 
         """
-        imaginary_part = a[3] * b[:3] + b[3] * a[:3] + np.cross(a[:3], b[:3])
-        real_part = a[3] * b[3] - np.dot(a[:3], b[:3])
-        return np.append(imaginary_part, real_part)
+        self._allocate(capacity, self.slot_size)
 
-    @staticmethod
-    def inverse(quaternion):
+    def store(self, slot, image, generation=0):
         """
-        Return the inverse of a quaternion
+        Copy an image into a slot.
 
         Parameters
         ----------
-        quaternion : Sequence[float]
-            A quaternion, in the order of x, y, z, w
+        slot : int
+            The slot in which to store the image.
+        image : Image
+            The image message.
+        generation : Optional[int]
+            The generation of the image. Default is 0.
+
+        """
+        data = np.frombuffer(image.data, dtype=np.uint8)
+        if data.size > self.slot_size:
+            self._allocate(self.capacity, data.size)
+
+        self._pixels[slot, :data.size] = data
+        self._lengths[slot] = data.size
+        self._generations[slot] = generation
+        self._fields[slot] = (image.header, image.height, image.width,
+                              image.encoding, image.is_bigendian, image.step)
+        if self._message[0] == slot:
+            self._message = (None, None, None)
+
+    def generation(self, slot):
+        """
+        Get the generation of the image in a slot.
+
+        Parameters
+        ----------
+        slot : int
+            The slot of the image.
 
         Returns
         -------
-        np.ndarray
-            The inverse of the quaternion.
+        int
+            The generation of the image, or -1 if the slot is empty.
 
         """
-        return (quaternion * np.array([-1, -1, -1, 1])
-                / np.linalg.norm(quaternion)**2)
+        return self._generations[slot]
 
-    @staticmethod
-    def rel_rotation(a, b):
+    def pixels(self, slot, generation=None):
         """
-        Find the quaternion which produces a rotation from `a` to `b`.
+        Get the pixel data of an image, without copying it.
+
+        The data is only valid until the slot is overwritten.
 
         Parameters
         ----------
-        a : Sequence[float]
-            A quaternion, in the order of x, y, z, w
-        b : Sequence[float]
-            A quaternion, in the order of x, y, z, w
+        slot : int
+            The slot of the image.
+        generation : Optional[int]
+            The generation of the image. Default is whichever image is in
+            the slot.
 
         Returns
         -------
-        np.ndarray
-            A quaternion, in the order of x, y, z, w
+        np.ndarray | None
+            The pixel data, or None if the image has been overwritten.
 
         """
-        return Quat.product(unit_vector(a), Quat.inverse(unit_vector(b)))
+        if generation is not None and self._generations[slot] != generation:
+            return None
+        return self._pixels[slot, :self._lengths[slot]]
 
-    @staticmethod
-    def rotation_matrix(quaternion):
+    def image(self, slot, generation=None):
         """
-        Create the rotation matrix of a quaternion.
+        Get an image as a message.
+
+        The message of the last image requested is reused, so that the pixel
+        data is only copied when a different image is requested.
 
         Parameters
         ----------
-        quaternion : np.ndarray
-            A quaternion in the order of x, y, z, w.
+        slot : int
+            The slot of the image.
+        generation : Optional[int]
+            The generation of the image. Default is whichever image is in
+            the slot.
 
         Returns
         -------
-        np.ndarray
-            A 3x3 rotation matrix representing the quaternion.
+        Image | None
+            The image, or None if the image has been overwritten.
 
-        References
-        ----------
-        .. [1] Wikipedia, Rotation Matrix.
-               https://en.wikipedia.org/wiki/Rotation_matrix#Quaternion
+        """
+        if generation is None:
+            generation = self._generations[slot]
+        if self._message[:2] == (slot, generation):
+            return self._message[2]
+
+        pixels = self.pixels(slot, generation)
+        if pixels is None:
+            return None
+        header, height, width, encoding, is_bigendian, step = \
+            self._fields[slot]
+        image = Image(header=header, height=height, width=width,
+                      encoding=encoding, is_bigendian=is_bigendian, step=step,
+                      data=pixels.tobytes())
+        self._message = (slot, generation, image)
+        return image
+
+    @property
+    def nbytes(self):
+        """
+        The size of the pixel buffer.
+
+        Returns
+        -------
+        int
+            The number of bytes allocated for pixel data.
 
         """
-        x, y, z, w = quaternion
-        n = sum(quaternion**2)
+        return self._pixels.nbytes
 
-        if n == 0:
-            return np.identity(3)
 
-        s = 2 / n
+class CompressedImageStore(object):
+    """
+    A fixed number of image slots, holding images encoded as JPEG or PNG.
 
-        wx = s * w * x
-        wy = s * w * y
-        wz = s * w * z
+    Images are encoded on a background thread, and are served as they are
+    until they have been encoded. Images are only decoded when requested, and
+    the few most recently decoded images are cached.
 
-        xx = s * x * x
-        xy = s * x * y
-        xz = s * x * z
+    Every stored image is tagged with a generation, so that an image which
+    has since been overwritten is never returned in place of another.
 
-        yy = s * y * y
-        yz = s * y * z
-        zz = s * z * z
+    Parameters
+    ----------
+    capacity : int
+        The number of slots.
+    image_format : Optional[str]
+        The file extension of the encoding, such as ".jpg" or ".png". Default
+        is ".jpg".
+    cache_size : Optional[int]
+        The number of decoded images to keep. Default is 2.
 
-        return np.array([[1 - (yy + zz), xy - wz, wy],
-                         [wz, 1 - (xx + zz), yz - wx],
-                         [xz - wy, yz + wx, 1 - (xx + yy)]])
+    Attributes
+    ----------
+    capacity : int
+        The number of slots.
+    image_format : str
+        The file extension of the encoding.
+    cache_size : int
+        The number of decoded images to keep.
+    nbytes
+
+    Raises
+    ------
+    ImportError
+        If OpenCV is not available.
+
+    """
+    def __init__(self, capacity, image_format=".jpg", cache_size=2):
+        if cv2 is None:
+            raise ImportError("Compressed image storage requires OpenCV.")
+        self.capacity = capacity
+        self.image_format = image_format
+        self.cache_size = cache_size
+
+        self._encoded = np.empty(capacity, dtype=object)
+        self._pending = np.empty(capacity, dtype=object)
+        self._generations = np.full(capacity, -1, dtype=int)
+        self._fields = np.empty(capacity, dtype=object)
+        self._decoded = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._queue = Queue()
+        encoding_thread = threading.Thread(target=self._encoding_loop,
+                                           name="image_encoding")
+        encoding_thread.daemon = True
+        encoding_thread.start()
+
+    def resize(self, capacity):
+        """
+        Change the number of slots, keeping the stored images.
+
+        Parameters
+        ----------
+        capacity : int
+            The new number of slots.
+
+        """
+        def resize(array, fill):
+            new_array = np.full(capacity, fill, dtype=array.dtype)
+            n = min(capacity, self.capacity)
+            new_array[:n] = array[:n]
+            return new_array
+
+        with self._lock:
+            self._encoded = resize(self._encoded, None)
+            self._pending = resize(self._pending, None)
+            self._generations = resize(self._generations, -1)
+            self._fields = resize(self._fields, None)
+            self.capacity = capacity
+
+    def store(self, slot, image, generation=0):
+        """
+        Store an image in a slot, and queue it for encoding.
+
+        Parameters
+        ----------
+        slot : int
+            The slot in which to store the image.
+        image : Image
+            The image message.
+        generation : Optional[int]
+            The generation of the image. Default is 0.
+
+        """
+        with self._lock:
+            self._encoded[slot] = None
+            self._pending[slot] = image
+            self._generations[slot] = generation
+            self._fields[slot] = (image.header, image.encoding,
+                                  image.is_bigendian)
+        self._queue.put((slot, generation, image))
+
+    def generation(self, slot):
+        """
+        Get the generation of the image in a slot.
+
+        Parameters
+        ----------
+        slot : int
+            The slot of the image.
+
+        Returns
+        -------
+        int
+            The generation of the image, or -1 if the slot is empty.
+
+        """
+        return self._generations[slot]
+
+    def image(self, slot, generation=None):
+        """
+        Get an image as a message, decoding it if needed.
+
+        Parameters
+        ----------
+        slot : int
+            The slot of the image.
+        generation : Optional[int]
+            The generation of the image. Default is whichever image is in
+            the slot.
+
+        Returns
+        -------
+        Image | None
+            The image, or None if the image has been overwritten.
+
+        """
+        with self._lock:
+            if generation is None:
+                generation = self._generations[slot]
+            elif self._generations[slot] != generation:
+                return None
+            if self._pending[slot] is not None:
+                return self._pending[slot]
+
+            key = (slot, generation)
+            if key in self._decoded:
+                image = self._decoded.pop(key)
+                self._decoded[key] = image
+                return image
+            encoded = self._encoded[slot]
+            header, encoding, is_bigendian = self._fields[slot]
+
+        pixels = cv2.imdecode(encoded, cv2.IMREAD_UNCHANGED)
+        height, width = pixels.shape[:2]
+        image = Image(header=header, height=height, width=width,
+                      encoding=encoding, is_bigendian=is_bigendian,
+                      step=pixels.strides[0], data=pixels.tobytes())
+
+        with self._lock:
+            self._decoded[key] = image
+            while len(self._decoded) > self.cache_size:
+                self._decoded.popitem(last=False)
+        return image
+
+    def flush(self):
+        """
+        Wait until every stored image has been encoded.
+
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Stop encoding images, once the queued images have been encoded.
+
+        """
+        self._queue.put(None)
+        self._queue.join()
+
+    def _encoding_loop(self):
+        """
+        Encode the stored images in order.
+
+        Images which cannot be encoded are kept as they are.
+
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            slot, generation, image = item
+            try:
+                encoded = self._encode(image)
+                with self._lock:
+                    if (encoded is not None
+                            and self._generations[slot] == generation):
+                        self._encoded[slot] = encoded
+                        self._pending[slot] = None
+            finally:
+                self._queue.task_done()
+
+    def _encode(self, image):
+        """
+        Encode an image with 8-bit channels.
+
+        Parameters
+        ----------
+        image : Image
+            The image message.
+
+        Returns
+        -------
+        np.ndarray | None
+            The encoded image, or None if it could not be encoded.
+
+        """
+        data = np.frombuffer(image.data, dtype=np.uint8)
+        if not image.width or data.size != image.height * image.step:
+            return None
+        channels, remainder = divmod(image.step, image.width)
+        if channels not in (1, 3, 4) or remainder:
+            return None
+
+        pixels = data.reshape(image.height, image.width, channels)
+        try:
+            success, encoded = cv2.imencode(self.image_format, pixels)
+        except cv2.error:
+            return None
+        return encoded if success else None
+
+    @property
+    def nbytes(self):
+        """
+        The size of the stored images.
+
+        Returns
+        -------
+        int
+            The number of bytes of encoded images and of images which have
+            not been encoded yet.
+
+        """
+        with self._lock:
+            return (sum(encoded.nbytes for encoded in self._encoded
+                        if encoded is not None)
+                    + sum(len(image.data) for image in self._pending
+                          if image is not None))
+
+
+class ImageDecoder(object):
+    """
+    Convert images to RGB on a worker thread, keeping only the newest one.
+
+    Images are submitted from any thread, and replace any image which has not
+    been converted yet. The converted image is taken by the thread using it,
+    and replaces any converted image which has not been taken yet. Images
+    which are replaced are dropped, so only the newest image is converted.
+
+    Images are converted into a small pool of reusable buffers, so that no
+    memory is allocated per image. Tightly packed rgb8 images are used as
+    they are, without copying.
+
+    Parameters
+    ----------
+    fallback : Optional[callable]
+        Converts an image message with another encoding to a (height, width,
+        3) RGB array. Default is to drop such images.
+    callback : Optional[callable]
+        Called without arguments from the worker thread whenever an image has
+        been converted, such as to request a redraw.
+
+    Attributes
+    ----------
+    n_decoded : int
+        The number of images converted.
+    n_dropped : int
+        The number of images replaced before being converted, or before being
+        taken.
+    n_allocated : int
+        The number of buffers allocated.
+
+    """
+    # The number of channels, and the RGB channels, of each 8-bit encoding.
+    encodings = {
+        "rgb8": (3, slice(None)),
+        "bgr8": (3, slice(2, None, -1)),
+        "rgba8": (4, slice(3)),
+        "bgra8": (4, slice(2, None, -1)),
+        "mono8": (1, slice(None)),
+    }
+
+    def __init__(self, fallback=None, callback=None):
+        self.fallback = fallback
+        self.callback = callback
+        self.n_decoded = 0
+        self.n_dropped = 0
+        self.n_allocated = 0
+
+        self._pending = None
+        self._decoded = None
+        self._taken = None
+        self._free = []
+        self._busy = False
+        self._closed = False
+        self._condition = threading.Condition()
+
+        decoding_thread = threading.Thread(target=self._decoding_loop,
+                                           name="image_decoding")
+        decoding_thread.daemon = True
+        decoding_thread.start()
+
+    def submit(self, image):
+        """
+        Queue an image for conversion, replacing any image still queued.
+
+        Parameters
+        ----------
+        image : Image
+            The image message.
+
+        """
+        with self._condition:
+            if self._pending is not None:
+                self.n_dropped += 1
+            self._pending = image
+            self._condition.notify()
+
+    def take(self):
+        """
+        Take the newest converted image.
+
+        The pixels stay valid until the next call.
+
+        Returns
+        -------
+        tuple[np.ndarray, int, int] | None
+            The (height, width, 3) RGB pixels, starting from the top row, the
+            width, and the height. None if no image has been converted since
+            the last call.
+
+        """
+        with self._condition:
+            self._release(self._taken)
+            self._taken = None
+            if self._decoded is None:
+                return None
+            pixels, width, height, self._taken = self._decoded
+            self._decoded = None
+        return pixels, width, height
+
+    def wait(self, timeout=None):
+        """
+        Wait until every submitted image has been converted or dropped.
+
+        Parameters
+        ----------
+        timeout : Optional[float]
+            The longest time to wait, in seconds. Default is to wait
+            indefinitely.
+
+        Returns
+        -------
+        bool
+            False if the wait timed out.
+
+        """
+        deadline = (None if timeout is None
+                    else timeit.default_timer() + timeout)
+        with self._condition:
+            while self._pending is not None or self._busy:
+                if deadline is None:
+                    self._condition.wait()
+                    continue
+                remaining = deadline - timeit.default_timer()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def close(self):
+        """
+        Stop converting images.
+
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def _decoding_loop(self):
+        """
+        Convert the newest image whenever one is submitted, until closed.
+
+        """
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                image, self._pending = self._pending, None
+                self._busy = True
+
+            try:
+                pixels, buffer = self._convert(image)
+            except Exception as e:
+                rospy.logwarn("Cannot convert image: {}".format(e))
+                pixels = buffer = None
+
+            with self._condition:
+                self._busy = False
+                if pixels is None:
+                    self.n_dropped += 1
+                else:
+                    if self._decoded is not None:
+                        self._release(self._decoded[3])
+                        self.n_dropped += 1
+                    self._decoded = (pixels, image.width, image.height, buffer)
+                    self.n_decoded += 1
+                self._condition.notify_all()
+            if pixels is not None and self.callback is not None:
+                self.callback()
+
+    def _convert(self, image):
+        """
+        Convert an image message to RGB.
+
+        Parameters
+        ----------
+        image : Image
+            The image message.
+
+        Returns
+        -------
+        np.ndarray | None
+            The (height, width, 3) RGB pixels. None if the encoding is not
+            supported.
+        np.ndarray | None
+            The buffer from the pool which holds the pixels, or None if the
+            pixels are a view of the message.
+
+        """
+        width, height = image.width, image.height
+        try:
+            channels, rgb = self.encodings[image.encoding]
+        except KeyError:
+            if self.fallback is None:
+                return None, None
+            pixels, rgb = self.fallback(image), slice(None)
+        else:
+            rows = np.frombuffer(image.data, dtype=np.uint8).reshape(height,
+                                                                     -1)
+            pixels = rows[:, :width * channels].reshape(height, width,
+                                                        channels)
+            if image.encoding == "rgb8" and image.step == 3 * width:
+                return pixels, None
+
+        with self._condition:
+            buffer = self._acquire(height, width)
+        try:
+            np.copyto(buffer, pixels[..., rgb])
+        except Exception:
+            with self._condition:
+                self._release(buffer)
+            raise
+        return buffer, buffer
+
+    def _acquire(self, height, width):
+        """
+        Get a free buffer, allocating one if needed.
+
+        Buffers of another size are discarded. The lock must be held.
+
+        """
+        shape = (height, width, 3)
+        self._free = [buffer for buffer in self._free if buffer.shape == shape]
+        if self._free:
+            return self._free.pop()
+        self.n_allocated += 1
+        return np.empty(shape, dtype=np.uint8)
+
+    def _release(self, buffer):
+        """
+        Return a buffer to the pool. The lock must be held.
+
+        """
+        if buffer is not None:
+            self._free.append(buffer)
+
+
+def image_sharpness(image, decimation=4):
+    """
+    Score how sharp an image is.
+
+    The score is the variance of the Laplacian of the green channel, on the
+    image downsampled by `decimation`. Blurred images, and the flat smears
+    left by dropped video packets, have little high-frequency content and
+    score low.
+
+    Parameters
+    ----------
+    image : Image
+        An image message with 8-bit channels.
+    decimation : Optional[int]
+        The step between the pixels used, in both directions. Default is 4.
+
+    Returns
+    -------
+    float | None
+        The score, or None if the encoding is not supported or the image data
+        is truncated.
+
+    """
+    try:
+        channels, _ = ImageDecoder.encodings[image.encoding]
+    except KeyError:
+        return None
+    size = image.height * image.step
+    if len(image.data) < size or image.step < image.width * channels:
+        return None
+    rows = np.frombuffer(image.data, dtype=np.uint8,
+                         count=size).reshape(image.height, image.step)
+    green = 1 if channels > 1 else 0
+    pixels = rows[::decimation,
+                  green:image.width * channels:channels * decimation]
+    if min(pixels.shape) < 3:
+        return None
+    pixels = pixels.astype(np.float32)
+    laplacian = (4 * pixels[1:-1, 1:-1]
+                 - pixels[:-2, 1:-1] - pixels[2:, 1:-1]
+                 - pixels[1:-1, :-2] - pixels[1:-1, 2:])
+    return float(laplacian.var())
+
+
+class FrameStore(object):
+    """
+    A chronological store of frames, backed by preallocated arrays.
+
+    The pose data of every frame is kept in contiguous arrays, which are used
+    directly for vectorized evaluation. Frames are stored in a ring buffer, so
+    that appending is O(1) and the oldest frame is overwritten once the store
+    is full. `Frame` objects are only created when a frame is accessed.
+
+    Rows of the arrays are in storage order, which is only chronological until
+    the store is full. Indexing and iterating over the store are always
+    chronological.
+
+    Parameters
+    ----------
+    maxlen : Optional[int]
+        The maximum number of frames to keep. Default is to keep all frames.
+    capacity : Optional[int]
+        The number of frames for which space is initially allocated if
+        `maxlen` is not set. Default is 64. The capacity is doubled as needed.
+    cell_size : Optional[float]
+        The cell size of a spatial index over the frame positions, in metres.
+        Default is not to keep an index.
+    image_storage : Optional[str]
+        How images are kept. "message" keeps the image messages, "arena"
+        copies their pixel data into an `ImageArena`, and "compressed"
+        encodes them in a `CompressedImageStore`, with one slot per row.
+        Default is "message".
+    image_file : Optional[str]
+        A file in which to map the image arena. Requires `maxlen`. Default is
+        to keep the arena in memory.
+    image_format : Optional[str]
+        The encoding of compressed images, such as ".jpg" or ".png". Default
+        is ".jpg".
+
+    Attributes
+    ----------
+    maxlen : int | None
+        The maximum number of frames to keep.
+    capacity : int
+        The number of frames for which space is allocated.
+    version : int
+        A counter which is incremented whenever a frame is added.
+    index : SpatialGrid | None
+        The spatial index over the frame positions, if any.
+    images : ImageArena | CompressedImageStore | None
+        The image slots, unless image messages are kept.
+
+    Raises
+    ------
+    ValueError
+        If `maxlen` is not positive, or the image storage is not known.
+
+    """
+    def __init__(self, maxlen=None, capacity=64, cell_size=None,
+                 image_storage="message", image_file=None,
+                 image_format=".jpg"):
+        if maxlen is not None:
+            if maxlen < 1:
+                raise ValueError("The maximum length must be positive.")
+            capacity = maxlen
+
+        self.maxlen = maxlen
+        self.index = SpatialGrid(cell_size) if cell_size else None
+        if image_storage == "message":
+            self.images = None
+        elif image_storage == "arena":
+            if image_file is not None and maxlen is None:
+                raise ValueError("A mapped image arena needs a maximum length.")
+            self.images = ImageArena(0, filename=image_file)
+        elif image_storage == "compressed":
+            self.images = CompressedImageStore(0, image_format=image_format)
+        else:
+            raise ValueError("Unknown image storage: {}".format(image_storage))
+        self.capacity = 0
+        self.version = 0
+        self._size = 0
+        self._head = 0  # The row of the oldest frame.
+
+        self._positions = np.empty((0, 3))
+        self._orientations = np.empty((0, 4))
+        self._rotation_matrices = np.empty((0, 3, 3))
+        self._stamps = np.empty(0)
+        self._pose_stampeds = np.empty(0, dtype=object)
+        self._images = np.empty(0, dtype=object)
+        self._frames = np.empty(0, dtype=object)
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        """
+        Reallocate the arrays, keeping the stored frames.
+
+        Only used before the buffer wraps around, so that the order of the rows
+        is kept.
+
+        Parameters
+        ----------
+        capacity : int
+            The new number of frames for which space is allocated.
+
+        """
+        def resize(array):
+            new_array = np.empty((capacity,) + array.shape[1:],
+                                 dtype=array.dtype)
+            new_array[:self._size] = array[:self._size]
+            return new_array
+
+        self._positions = resize(self._positions)
+        self._orientations = resize(self._orientations)
+        self._rotation_matrices = resize(self._rotation_matrices)
+        self._stamps = resize(self._stamps)
+        self._pose_stampeds = resize(self._pose_stampeds)
+        self._images = resize(self._images)
+        self._frames = resize(self._frames)
+        if self.images is not None:
+            self.images.resize(capacity)
+        self.capacity = capacity
+
+    def append(self, pose_stamped, image):
+        """
+        Add a frame, overwriting the oldest frame if the store is full.
+
+        Parameters
+        ----------
+        pose_stamped : PoseStamped
+            The pose of the drone when the image was taken.
+        image : Image
+            The image that was taken.
+
+        Returns
+        -------
+        int
+            The row in which the frame was stored.
+
+        """
+        if self._size < self.capacity:
+            row = (self._head + self._size) % self.capacity
+            self._size += 1
+        elif self.maxlen is None:
+            self._allocate(2 * self.capacity)
+            row = self._size
+            self._size += 1
+        else:
+            row = self._head
+            self._head = (self._head + 1) % self.capacity
+
+        position, orientation = Pose._components(pose_stamped)
+        self._positions[row] = position
+        self._orientations[row] = orientation
+        self._rotation_matrices[row] = Quat.rotation_matrix(orientation)
+        self._stamps[row] = pose_stamped.header.stamp.to_sec()
+        self._pose_stampeds[row] = pose_stamped
+        self._frames[row] = None
+        if self.images is None:
+            self._images[row] = image
+        else:
+            self.images.store(row, image, generation=self.version)
+        if self.index is not None:
+            self.index.insert(row, position)
+        self.version += 1
+        return row
+
+    def view(self, rows=None):
+        """
+        Get the pose data of the stored frames.
+
+        If `rows` is not given, the data is not copied, and the views are only
+        valid until the next frame is added.
+
+        Parameters
+        ----------
+        rows : Optional[np.ndarray]
+            The rows to select. Default is all the stored frames.
+
+        Returns
+        -------
+        FrameArrays
+            The pose data, in storage order.
+
+        """
+        if rows is None:
+            rows = slice(0, self._size)
+        return FrameArrays(self._positions[rows], self._orientations[rows],
+                           self._rotation_matrices[rows], self._stamps[rows])
+
+    def rows(self, start=0, stop=None):
+        """
+        Find the rows in which a chronological range of frames is stored.
+
+        Parameters
+        ----------
+        start : Optional[int]
+            The chronological index of the first frame. Default is the oldest
+            frame.
+        stop : Optional[int]
+            The chronological index after the last frame. Default is after the
+            newest frame.
+
+        Returns
+        -------
+        np.ndarray
+            The rows of the frames.
+
+        """
+        if stop is None:
+            stop = self._size
+        return (self._head + np.arange(start, stop)) % max(self.capacity, 1)
+
+    def frame(self, row):
+        """
+        Get the frame stored in a given row.
+
+        Parameters
+        ----------
+        row : int
+            The row of the frame, in storage order.
+
+        Returns
+        -------
+        Frame
+            The frame.
+
+        """
+        frame = self._frames[row]
+        if frame is None:
+            if self.images is None:
+                frame = Frame(self._pose_stampeds[row], self._images[row])
+            else:
+                load_image = partial(self.images.image, row,
+                                     self.images.generation(row))
+                frame = Frame(self._pose_stampeds[row], load_image=load_image)
+            self._frames[row] = frame
+        return frame
+
+    def argmin(self, scores, rows=None):
+        """
+        Find the oldest frame with the lowest score.
+
+        Parameters
+        ----------
+        scores : np.ndarray
+            The score of each frame.
+        rows : Optional[np.ndarray]
+            The rows of the scored frames. Default is every row, in storage
+            order.
+
+        Returns
+        -------
+        int
+            The row of the frame with the lowest score.
+
+        """
+        if rows is None:
+            rows = np.arange(len(scores))
+        rows = rows[scores == scores.min()]
+        return rows[np.argmin((rows - self._head) % self.capacity)]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("FrameStore index out of range")
+        return self.frame((self._head + index) % self.capacity)
+
+    def __contains__(self, frame):
+        # Frames are cached in their rows until they are overwritten, so a
+        # frame is stored if and only if it is still cached.
+        return any(cached is frame for cached in self._frames[:self._size])
+
+    def __iter__(self):
+        version = self.version
+        for index in range(self._size):
+            if self.version != version:
+                raise RuntimeError("FrameStore mutated during iteration")
+            yield self[index]
+
+    def close(self):
+        """
+        Release the image storage.
+
+        """
+        if hasattr(self.images, "close"):
+            self.images.close()
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return "<FrameStore({n}/{maxlen})>".format(n=self._size,
+                                                    maxlen=self.maxlen)
+
+
+class PoseBuffer(object):
+    """
+    The most recent poses, for finding the pose at any recent time.
+
+    Poses are kept in preallocated arrays used as a ring buffer, so that
+    appending is O(1) at mocap rates. Poses are looked up by binary search,
+    and are interpolated linearly in position, and with slerp in orientation.
+
+    The buffer must hold poses for longer than images can be delayed. The
+    default holds 5 s of poses at 240 Hz.
+
+    Parameters
+    ----------
+    capacity : Optional[int]
+        The number of poses kept. Default is 1200.
+
+    Attributes
+    ----------
+    capacity : int
+        The number of poses kept.
+
+    """
+    def __init__(self, capacity=1200):
+        self.capacity = capacity
+        self._stamps = np.empty(capacity)
+        self._positions = np.empty((capacity, 3))
+        self._orientations = np.empty((capacity, 4))
+        self._seqs = np.empty(capacity, dtype=np.int64)
+        self._frame_ids = np.empty(capacity, dtype=object)
+        self._start = 0
+        self._length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._length
+
+    def append(self, pose_stamped):
+        """
+        Add a pose, replacing the oldest one if the buffer is full.
+
+        Poses must be appended in chronological order.
+
+        Parameters
+        ----------
+        pose_stamped : PoseStamped
+            The pose.
+
+        """
+        position = pose_stamped.pose.position
+        orientation = pose_stamped.pose.orientation
+        with self._lock:
+            if self._length < self.capacity:
+                index = (self._start + self._length) % self.capacity
+                self._length += 1
+            else:
+                index = self._start
+                self._start = (self._start + 1) % self.capacity
+            self._stamps[index] = pose_stamped.header.stamp.to_sec()
+            self._positions[index] = position.x, position.y, position.z
+            self._orientations[index] = (orientation.x, orientation.y,
+                                         orientation.z, orientation.w)
+            self._seqs[index] = pose_stamped.header.seq
+            self._frame_ids[index] = pose_stamped.header.frame_id
+
+    def interpolate_batch(self, stamps):
+        """
+        Find the poses at several times.
+
+        Times outside of the buffered poses get the nearest pose.
+
+        Parameters
+        ----------
+        stamps : np.ndarray
+            An (N,) array of times, in seconds.
+
+        Returns
+        -------
+        np.ndarray
+            An (N, 3) array of the x, y, and z coordinates of each pose.
+        np.ndarray
+            An (N, 4) array of the x, y, z, and w quaternion of each pose.
+
+        Raises
+        ------
+        IndexError
+            If the buffer is empty.
+
+        """
+        positions, orientations, _, _ = self._interpolate(stamps)
+        return positions, orientations
+
+    def _interpolate(self, stamps):
+        """
+        Find the poses at several times, and the headers of the nearest
+        buffered poses.
+
+        Parameters
+        ----------
+        stamps : np.ndarray
+            An (N,) array of times, in seconds.
+
+        Returns
+        -------
+        np.ndarray
+            An (N, 3) array of the x, y, and z coordinates of each pose.
+        np.ndarray
+            An (N, 4) array of the x, y, z, and w quaternion of each pose.
+        np.ndarray
+            An (N,) array of the sequence number of the nearest buffered pose
+            to each time.
+        np.ndarray
+            An (N,) array of the frame of the nearest buffered pose to each
+            time.
+
+        Raises
+        ------
+        IndexError
+            If the buffer is empty.
+
+        """
+        with self._lock:
+            if not self._length:
+                raise IndexError("No poses to interpolate")
+            order = (self._start + np.arange(self._length)) % self.capacity
+            times = self._stamps[order]
+            positions = self._positions[order]
+            orientations = self._orientations[order]
+            seqs = self._seqs[order]
+            frame_ids = self._frame_ids[order]
+
+        stamps = np.asarray(stamps, dtype=float)
+        after = np.clip(np.searchsorted(times, stamps), 1, len(times) - 1)
+        before = after - 1
+        if len(times) == 1:
+            after = before = np.zeros_like(after)
+        span = times[after] - times[before]
+        fractions = np.zeros_like(stamps)
+        np.divide(stamps - times[before], span, out=fractions, where=span > 0)
+        fractions = np.clip(fractions, 0, 1)
+
+        positions = (positions[before]
+                     + fractions[:, np.newaxis]
+                     * (positions[after] - positions[before]))
+        orientations = Quat.slerp_batch(orientations[before],
+                                        orientations[after], fractions)
+        nearest = np.where(fractions < 0.5, before, after)
+        return positions, orientations, seqs[nearest], frame_ids[nearest]
+
+    def interpolate(self, stamp):
+        """
+        Find the pose at a given time.
+
+        Parameters
+        ----------
+        stamp : rospy.Time
+            The time.
+
+        Returns
+        -------
+        PoseStamped | None
+            The pose, stamped with `stamp`, or None if the buffer is empty.
+            The sequence number and frame are those of the nearest buffered
+            pose.
+
+        """
+        try:
+            positions, orientations, seqs, frame_ids = self._interpolate(
+                [stamp.to_sec()])
+        except IndexError:
+            return None
+        pose_stamped = Pose.generate_stamped(positions[0], orientations[0],
+                                             int(seqs[0]))
+        pose_stamped.header.stamp = stamp
+        pose_stamped.header.frame_id = frame_ids[0]
+        return pose_stamped
+
+
+class RenderScheduler(object):
+    """
+    Decide when to redraw, based on the arrival of new data.
+
+    Producers call `request` whenever new data arrives, and the render loop
+    calls `wait` before drawing each frame. Requests which arrive while a
+    redraw is already pending are coalesced into it.
+
+    Parameters
+    ----------
+    max_fps : Optional[float]
+        The maximum number of frames per second. Default is not to limit the
+        frame rate.
+
+    Attributes
+    ----------
+    max_fps : float | None
+        The maximum number of frames per second.
+    n_requests : int
+        The number of redraws requested.
+    n_coalesced : int
+        The number of requests which were merged into a pending redraw.
+    n_frames : int
+        The number of redraws which were started.
+
+    """
+    def __init__(self, max_fps=None):
+        self.max_fps = max_fps
+        self.n_requests = 0
+        self.n_coalesced = 0
+        self.n_frames = 0
+        self._pending = False
+        self._last_frame = None
+        self._condition = threading.Condition()
+
+    def request(self):
+        """
+        Ask for a redraw.
+
+        """
+        with self._condition:
+            self.n_requests += 1
+            if self._pending:
+                self.n_coalesced += 1
+            self._pending = True
+            self._condition.notify()
+
+    def wait(self, timeout=None):
+        """
+        Wait until a redraw is requested, and the frame rate allows it.
+
+        Parameters
+        ----------
+        timeout : Optional[float]
+            The longest time to wait for a request, in seconds. Default is to
+            wait indefinitely.
+
+        Returns
+        -------
+        bool
+            Whether a redraw should be done. False if the wait timed out. The
+            call always lasts `timeout` in that case, even if the frame rate
+            is what held it back, so that render loops do not spin.
+
+        """
+        if self.max_fps and self._last_frame is not None:
+            delay = self._last_frame + 1 / self.max_fps - timeit.default_timer()
+            if timeout is not None and delay > timeout:
+                sleep(timeout)
+                return False
+            if delay > 0:
+                sleep(delay)
+                if timeout is not None:
+                    timeout -= delay
+
+        with self._condition:
+            if not self._pending:
+                self._condition.wait(timeout)
+            if not self._pending:
+                return False
+            self._pending = False
+            self.n_frames += 1
+
+        self._last_frame = timeit.default_timer()
+        return True
+
+    def __repr__(self):
+        return ("<RenderScheduler({frames} frames, {coalesced}/{requests} "
+                "requests coalesced)>".format(frames=self.n_frames,
+                                              coalesced=self.n_coalesced,
+                                              requests=self.n_requests))
+
+
+class LatencyTracer(object):
+    """
+    Keep rolling statistics of the latency of each stage of a pipeline.
+
+    A stage is either measured from the stamp of the message which started
+    the pipeline, using `since`, or as the duration of some work, using
+    `timed`. Only the most recent samples of each stage are kept.
+
+    Parameters
+    ----------
+    window : Optional[int]
+        The number of samples to keep for each stage. Default is 1000.
+
+    Attributes
+    ----------
+    window : int
+        The number of samples to keep for each stage.
+    stages : list of str
+        The stages, in the order in which they were first recorded.
+
+    """
+    histogram_edges = (0, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, np.inf)  # s
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.stages = []
+        self._samples = {}
+
+    def record(self, stage, latency):
+        """
+        Record a latency.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage.
+        latency : float
+            The latency, in seconds.
+
+        """
+        try:
+            self._samples[stage].append(latency)
+        except KeyError:
+            self._samples[stage] = deque([latency], maxlen=self.window)
+            self.stages.append(stage)
+
+    def since(self, stage, stamp):
+        """
+        Record the time elapsed since a message was stamped.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage.
+        stamp : rospy.rostime.Time
+            The stamp of the message.
+
+        Returns
+        -------
+        float
+            The latency, in seconds.
+
+        """
+        latency = (rospy.Time.now() - stamp).to_sec()
+        self.record(stage, latency)
+        return latency
+
+    @contextmanager
+    def timed(self, stage):
+        """
+        Context manager for recording how long some work takes.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage.
+
+        """
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            self.record(stage, timeit.default_timer() - start)
+
+    def samples(self, stage):
+        """
+        Get the recent latencies of a stage.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage.
+
+        Returns
+        -------
+        np.ndarray
+            The latencies, in seconds.
+
+        """
+        return np.array(self._samples.get(stage, ()))
+
+    def histogram(self, stage):
+        """
+        Count the recent latencies of a stage between `histogram_edges`.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage.
+
+        Returns
+        -------
+        np.ndarray
+            The number of latencies in each bin.
+
+        """
+        return np.histogram(self.samples(stage), self.histogram_edges)[0]
+
+    def summary(self):
+        """
+        Summarize the recent latencies of each stage.
+
+        Returns
+        -------
+        OrderedDict
+            The number of samples, and the mean, median, 90th and 99th
+            percentiles, and maximum latency in seconds, of each stage.
+
+        """
+        summary = OrderedDict()
+        for stage in list(self.stages):
+            samples = self.samples(stage)
+            p50, p90, p99 = np.percentile(samples, (50, 90, 99))
+            summary[stage] = OrderedDict([
+                ("n", len(samples)), ("mean", samples.mean()), ("p50", p50),
+                ("p90", p90), ("p99", p99), ("max", samples.max())])
+        return summary
+
+    def diagnostics(self, name):
+        """
+        Describe the recent latencies as diagnostic statuses.
+
+        Parameters
+        ----------
+        name : str
+            The name of the pipeline.
+
+        Returns
+        -------
+        list of DiagnosticStatus
+            One status per stage, with its statistics in milliseconds, and
+            its histogram.
+
+        """
+        edges = ["{:g}".format(1000 * edge) for edge in self.histogram_edges]
+        statuses = []
+        for stage, statistics in self.summary().items():
+            values = [KeyValue(key, "{:.3f}".format(1000 * value)
+                               if key != "n" else str(value))
+                      for key, value in statistics.items()]
+            values.extend(
+                KeyValue("{}-{} ms".format(low, high), str(count))
+                for low, high, count in zip(edges[:-1], edges[1:],
+                                            self.histogram(stage)))
+            statuses.append(DiagnosticStatus(
+                level=DiagnosticStatus.OK,
+                name="{}: {} latency".format(name, stage),
+                message="p50 {:.1f} ms, p99 {:.1f} ms".format(
+                    1000 * statistics["p50"], 1000 * statistics["p99"]),
+                values=values))
+        return statuses
+
+
+def report_latency(tracer, name, period=5):
+    """
+    Regularly publish latency statistics on /diagnostics, and log them.
+
+    Parameters
+    ----------
+    tracer : LatencyTracer
+        The tracer to report.
+    name : str
+        The name of the pipeline.
+    period : Optional[float]
+        The time between reports, in seconds. Default is 5.
+
+    Returns
+    -------
+    rospy.Timer
+        The timer which triggers the reports.
+
+    """
+    publisher = rospy.Publisher("/diagnostics", DiagnosticArray,
+                                queue_size=1)
+
+    def report(event):
+        statuses = tracer.diagnostics(name)
+        if not statuses:
+            return
+        array = DiagnosticArray(status=statuses)
+        array.header.stamp = rospy.Time.now()
+        publisher.publish(array)
+        rospy.loginfo("Latency: " + "; ".join(
+            "{stage} {message}".format(stage=stage, message=status.message)
+            for stage, status in zip(tracer.stages, statuses)))
+
+    return rospy.Timer(rospy.Duration(period), report)
+
+
+class Fov(object):
+    """
+    Field of view methods.
+
+    """
+    @staticmethod
+    def d2v(fov_diagonal, aspect_ratio=4 / 3):
+        """
+        Convert a diagonal field of view to vertical.
+
+        Parameters
+        ----------
+        fov_diagonal : float
+            The diagonal field of view.
+        aspect_ratio: Optional[float]
+            The aspect ratio of the display. Default is 4:3.
+
+        Returns
+        -------
+        float
+            The vertical field of view.
+
+        """
+        ratio_diagonal = np.sqrt(1 + aspect_ratio**2)
+        return 2 * r2d(np.arctan(np.tan(d2r(fov_diagonal) / 2)
+                                 / ratio_diagonal))
+
+    @staticmethod
+    def v2h(fov_vertical, aspect_ratio=4 / 3):
+        """
+        Convert a vertical field of view to horizontal.
+
+        Parameters
+        ----------
+        fov_vertical : float
+            The vertical field of view.
+        aspect_ratio: Optional[float]
+            The aspect ratio of the display. Default is 4:3.
+
+        Returns
+        -------
+        float
+            The horizontal field of view.
+
+        """
+        return 2 * r2d(np.arctan(np.tan(d2r(fov_vertical) / 2) * aspect_ratio))
+
+
+class Quat(object):
+    """
+    Quaternion methods.
+
+    """
+    @staticmethod
+    def to_euler(quaternion):
+        """
+        Change a quaternion to an Euler angle representation.
+
+        Parameters
+        ----------
+        quaternion : np.ndarray
+            A quaternion in the order of x, y, z, w.
+
+        Returns
+        -------
+        np.ndarray
+            The Euler angle, in the order of pitch, roll, yaw.
+
+        See Also
+        --------
+        to_euler_batch
+
+        """
+        # The same closed form as `to_euler_batch`, on floats, which is much
+        # faster for a single quaternion.
+        x, y, z, w = (float(i) for i in quaternion)
+        n = x * x + y * y + z * z + w * w
+        if n < _EPS:
+            return np.zeros(3)  # Identity rotation
+        s = 2 / n
+
+        m00 = 1 - s * (y * y + z * z)
+        m01 = s * (x * y - z * w)
+        m02 = s * (x * z + y * w)
+        m10 = s * (x * y + z * w)
+        m11 = 1 - s * (x * x + z * z)
+        m12 = s * (y * z - x * w)
+        m22 = 1 - s * (x * x + y * y)
+
+        cy = math.sqrt(m22 * m22 + m12 * m12)
+        if cy > _EPS:
+            return np.array([-math.atan2(m12, m22), -math.atan2(-m02, cy),
+                             -math.atan2(m01, m00)])
+        return np.array([0, -math.atan2(-m02, cy), -math.atan2(-m10, m11)])
+
+    @staticmethod
+    def to_euler_batch(quaternions):
+        """
+        Change quaternions to an Euler angle representation.
+
+        The angles are found in closed form from the elements of the rotation
+        matrix, and are the same as those given by
+        ``tf.transformations.euler_from_quaternion`` with `EULER_CONVENTION`
+        (``rxyz``).
+
+        Parameters
+        ----------
+        quaternions : np.ndarray
+            An (N, 4) array of quaternions in the order of x, y, z, w.
+
+        Returns
+        -------
+        np.ndarray
+            An (N, 3) array of Euler angles, in the order of pitch, roll, yaw.
+
+        """
+        q = np.array(quaternions, dtype=np.float64, ndmin=2)
+        n = np.einsum("ij,ij->i", q, q)
+        valid = n >= _EPS
+        q[valid] *= np.sqrt(2 / n[valid])[:, np.newaxis]
+        q[~valid] = 0  # Identity rotation
+        x, y, z, w = q.T
+
+        m00 = 1 - y * y - z * z
+        m01 = x * y - z * w
+        m02 = x * z + y * w
+        m10 = x * y + z * w
+        m11 = 1 - x * x - z * z
+        m12 = y * z - x * w
+        m22 = 1 - x * x - y * y
+
+        cy = np.sqrt(m22 * m22 + m12 * m12)
+        regular = cy > _EPS
+        euler = np.empty((len(q), 3))
+        euler[:, 0] = np.where(regular, -np.arctan2(m12, m22), 0)
+        euler[:, 1] = -np.arctan2(-m02, cy)
+        euler[:, 2] = np.where(regular, -np.arctan2(m01, m00),
+                               -np.arctan2(-m10, m11))
+        return euler
+
+    @staticmethod
+    def to_axis(quaternion):
+        """
+        Change a quaternion to an axis-angle representation.
+
+        Parameters
+        ----------
+        quaternion : np.ndarray
+            A quaternion in the order of x, y, z, w.
+
+        Notes
+        -----
+        θ is in degrees rather than radians, for ease of integration in OpenGL.
+
+        Returns
+        -------
+        tuple
+            The angle in axis-angle representation, with the order of θ, x, y,
+            z. θ is in degrees.
+
+        """
+        x, y, z, w = unit_vector(quaternion)
+        angle = r2d(2 * np.arccos(w))
+
+        if angle == 0:
+            axis_x = 1
+            axis_y = axis_z = 0
+        elif angle % 180 == 0:
+            axis_x, axis_y, axis_z = x, y, z
+        else:
+            axis_x = x / np.sqrt(1 - w**2)
+            axis_y = y / np.sqrt(1 - w**2)
+            axis_z = z / np.sqrt(1 - w**2)
+
+        return angle, axis_x, axis_y, axis_z
+
+    @staticmethod
+    def product(a, b):
+        """
+        Find the product of two quaternions.
+
+        Parameters
+        ----------
+        a : Sequence[float]
+            A quaternion, in the order of x, y, z, w
+        b : Sequence[float]
+            A quaternion, in the order of x, y, z, w
+
+        Returns
+        -------
+        np.ndarray
+            A quaternion, in the order of x, y, z, w
+
+        """
+        ax, ay, az, aw = a
+        bx, by, bz, bw = b
+        return np.array([aw * bx + bw * ax + ay * bz - az * by,
+                         aw * by + bw * ay + az * bx - ax * bz,
+                         aw * bz + bw * az + ax * by - ay * bx,
+                         aw * bw - ax * bx - ay * by - az * bz])
+
+    @staticmethod
+    def inverse(quaternion):
+        """
+        Return the inverse of a quaternion
+
+        Parameters
+        ----------
+        quaternion : Sequence[float]
+            A quaternion, in the order of x, y, z, w
+
+        Returns
+        -------
+        np.ndarray
+            The inverse of the quaternion.
+
+        """
+        return (quaternion * np.array([-1, -1, -1, 1])
+                / np.linalg.norm(quaternion)**2)
+
+    @staticmethod
+    def rel_rotation(a, b):
+        """
+        Find the quaternion which produces a rotation from `a` to `b`.
+
+        Parameters
+        ----------
+        a : Sequence[float]
+            A quaternion, in the order of x, y, z, w
+        b : Sequence[float]
+            A quaternion, in the order of x, y, z, w
+
+        Returns
+        -------
+        np.ndarray
+            A quaternion, in the order of x, y, z, w
+
+        """
+        return Quat.product(unit_vector(a), Quat.inverse(unit_vector(b)))
+
+    @staticmethod
+    def product_batch(a, b):
+        """
+        Find the products of two sets of quaternions.
+
+        The inputs are broadcast against each other.
+
+        Parameters
+        ----------
+        a : np.ndarray
+            An (N, 4) or (4,) array of quaternions, in the order of x, y, z, w.
+        b : np.ndarray
+            An (N, 4) or (4,) array of quaternions, in the order of x, y, z, w.
+
+        Returns
+        -------
+        np.ndarray
+            An (N, 4) array of quaternions, in the order of x, y, z, w.
+
+        """
+        a = np.asarray(a, dtype=float)
+        b = np.asarray(b, dtype=float)
+        imaginary_part = (a[..., 3:] * b[..., :3] + b[..., 3:] * a[..., :3]
+                          + np.cross(a[..., :3], b[..., :3]))
+        real_part = (a[..., 3] * b[..., 3]
+                     - np.sum(a[..., :3] * b[..., :3], axis=-1))
+        return np.concatenate((imaginary_part, real_part[..., np.newaxis]),
+                              axis=-1)
+
+    @staticmethod
+    def inverse_batch(quaternions):
+        """
+        Return the inverses of a set of quaternions.
+
+        Parameters
+        ----------
+        quaternions : np.ndarray
+            An (N, 4) array of quaternions, in the order of x, y, z, w.
+
+        Returns
+        -------
+        np.ndarray
+            An (N, 4) array of the inverses of the quaternions.
+
+        """
+        quaternions = np.asarray(quaternions, dtype=float)
+        norms = np.linalg.norm(quaternions, axis=-1)[..., np.newaxis]
+        return quaternions * np.array([-1, -1, -1, 1]) / norms**2
+
+    @staticmethod
+    def rel_rotation_batch(a, b):
+        """
+        Find the quaternions which produce a rotation from `a` to `b`.
+
+        The inputs are broadcast against each other.
+
+        Parameters
+        ----------
+        a : np.ndarray
+            An (N, 4) or (4,) array of quaternions, in the order of x, y, z, w.
+        b : np.ndarray
+            An (N, 4) or (4,) array of quaternions, in the order of x, y, z, w.
+
+        Returns
+        -------
+        np.ndarray
+            An (N, 4) array of quaternions, in the order of x, y, z, w.
+
+        """
+        return Quat.product_batch(unit_vectors(a),
+                                  Quat.inverse_batch(unit_vectors(b)))
+
+    @staticmethod
+    def rotation_matrix(quaternion):
+        """
+        Create the rotation matrix of a quaternion.
+
+        Parameters
+        ----------
+        quaternion : np.ndarray
+            A quaternion in the order of x, y, z, w.
+
+        Returns
+        -------
+        np.ndarray
+            A 3x3 rotation matrix representing the quaternion.
+
+        References
+        ----------
+        .. [1] Wikipedia, Rotation Matrix.
+               https://en.wikipedia.org/wiki/Rotation_matrix#Quaternion
+
+        """
+        x, y, z, w = quaternion
+        n = sum(quaternion**2)
+
+        if n == 0:
+            return np.identity(3)
+
+        s = 2 / n
+
+        wx = s * w * x
+        wy = s * w * y
+        wz = s * w * z
+
+        xx = s * x * x
+        xy = s * x * y
+        xz = s * x * z
+
+        yy = s * y * y
+        yz = s * y * z
+        zz = s * z * z
+
+        return np.array([[1 - (yy + zz), xy - wz, wy],
+                         [wz, 1 - (xx + zz), yz - wx],
+                         [xz - wy, yz + wx, 1 - (xx + yy)]])
+
+    @staticmethod
+    def rotation_matrix_batch(quaternions):
+        """
+        Create the rotation matrices of a set of quaternions.
+
+        This is a vectorized equivalent of `rotation_matrix`, and gives the
+        same results element for element.
+
+        Parameters
+        ----------
+        quaternions : np.ndarray
+            An (N, 4) array of quaternions in the order of x, y, z, w.
+
+        Returns
+        -------
+        np.ndarray
+            An (N, 3, 3) array of the rotation matrices of the quaternions.
+
+        """
+        quaternions = np.array(quaternions, dtype=float, ndmin=2)
+        n = np.sum(quaternions**2, axis=1)
+        s = np.zeros_like(n)
+        np.divide(2, n, out=s, where=n != 0)
+
+        x, y, z, w = quaternions.T
+        wx, wy, wz = s * w * x, s * w * y, s * w * z
+        xx, xy, xz = s * x * x, s * x * y, s * x * z
+        yy, yz, zz = s * y * y, s * y * z, s * z * z
+
+        matrices = np.empty((len(quaternions), 3, 3))
+        matrices[:, 0, 0] = 1 - (yy + zz)
+        matrices[:, 0, 1] = xy - wz
+        matrices[:, 0, 2] = wy
+        matrices[:, 1, 0] = wz
+        matrices[:, 1, 1] = 1 - (xx + zz)
+        matrices[:, 1, 2] = yz - wx
+        matrices[:, 2, 0] = xz - wy
+        matrices[:, 2, 1] = yz + wx
+        matrices[:, 2, 2] = 1 - (xx + yy)
+        return matrices
+
+    @staticmethod
+    def slerp_batch(a, b, fractions):
+        """
+        Interpolate between two sets of quaternions, at constant angular
+        velocity.
+
+        The shorter of the two arcs is followed. Quaternions which are nearly
+        identical are interpolated linearly instead.
+
+        Parameters
+        ----------
+        a : np.ndarray
+            An (N, 4) array of quaternions at the start, in the order of x, y,
+            z, w.
+        b : np.ndarray
+            An (N, 4) array of quaternions at the end, in the order of x, y,
+            z, w.
+        fractions : np.ndarray
+            An (N,) array of the fraction of the way from `a` to `b`.
+
+        Returns
+        -------
+        np.ndarray
+            An (N, 4) array of unit quaternions, in the order of x, y, z, w.
+
+        References
+        ----------
+        .. [1] Wikipedia, Slerp.
+               https://en.wikipedia.org/wiki/Slerp
+
+        """
+        a = unit_vectors(np.array(a, dtype=float, ndmin=2))
+        b = unit_vectors(np.array(b, dtype=float, ndmin=2))
+        fractions = np.asarray(fractions, dtype=float)[:, np.newaxis]
+
+        dot = np.sum(a * b, axis=1, keepdims=True)
+        b = np.where(dot < 0, -b, b)
+        dot = np.clip(np.abs(dot), 0, 1)
+
+        angle = np.arccos(dot)
+        sin_angle = np.sin(angle)
+        close = sin_angle < 1e-6
+        sin_angle[close] = 1
+        weight_a = np.where(close, 1 - fractions,
+                            np.sin((1 - fractions) * angle) / sin_angle)
+        weight_b = np.where(close, fractions,
+                            np.sin(fractions * angle) / sin_angle)
+        return unit_vectors(weight_a * a + weight_b * b)
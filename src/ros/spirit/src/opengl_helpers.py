@@ -3,12 +3,16 @@
 Helper functions for use with OpenGL.
 
 """
+from collections import OrderedDict
 from contextlib import contextmanager
+import ctypes
+import os
 
 import numpy as np
 from OpenGL import GL as gl
 from OpenGL import GLU as glu
 from OpenGL import GLUT as glut
+import pygame as pg
 
 from helpers import Quat
 
@@ -71,6 +75,19 @@ def gl_font(name, height):
         return getattr(glut, "GLUT_BITMAP_HELVETICA_{}".format(height))
 
 
+# The closest system fonts to each bitmapped OpenGL font, and their sizes. The
+# fonts are pointers, which cannot be hashed.
+_SYSTEM_FONTS = (
+    (glut.GLUT_BITMAP_8_BY_13, ("dejavusansmono,monospace", 13)),
+    (glut.GLUT_BITMAP_9_BY_15, ("dejavusansmono,monospace", 15)),
+    (glut.GLUT_BITMAP_TIMES_ROMAN_10, ("timesnewroman,times,serif", 10)),
+    (glut.GLUT_BITMAP_TIMES_ROMAN_24, ("timesnewroman,times,serif", 24)),
+    (glut.GLUT_BITMAP_HELVETICA_10, ("helvetica,arial,sans", 10)),
+    (glut.GLUT_BITMAP_HELVETICA_12, ("helvetica,arial,sans", 12)),
+    (glut.GLUT_BITMAP_HELVETICA_18, ("helvetica,arial,sans", 18)),
+)
+
+
 @contextmanager
 def gl_flag(gl_type):
     """
@@ -162,6 +179,454 @@ def new_matrix(mode_start=None, mode_end=None):
         gl.glMatrixMode(mode_end)
 
 
+def gl_read_pixels(width, height):
+    """
+    Read the pixels of the framebuffer which is bound for reading.
+
+    Parameters
+    ----------
+    width : int
+        The width of the framebuffer, in pixels.
+    height : int
+        The height of the framebuffer, in pixels.
+
+    Returns
+    -------
+    np.ndarray
+        A (height, width, 3) array of RGB values, starting from the top row.
+
+    """
+    gl.glPixelStorei(gl.GL_PACK_ALIGNMENT, 1)
+    data = gl.glReadPixels(0, 0, width, height, gl.GL_RGB, gl.GL_UNSIGNED_BYTE)
+    pixels = np.frombuffer(data, dtype=np.uint8)
+    return pixels.reshape(height, width, 3)[::-1]
+
+
+class StreamingTexture(object):
+    """
+    An RGB texture which is updated often, such as with video frames.
+
+    Pixels are copied once into a mapped pixel buffer object, from which the
+    texture is updated asynchronously. Buffers are used in turn, so that
+    writing a frame does not wait for the previous one to be transferred. If
+    pixel buffer objects are not supported, the texture is updated directly.
+
+    Outside the texture coordinates from 0 to 1, the texture is black.
+
+    The texture must be created and updated while an OpenGL context is
+    current.
+
+    Parameters
+    ----------
+    width : int
+        The width of the texture, in pixels.
+    height : int
+        The height of the texture, in pixels.
+    n_buffers : Optional[int]
+        The number of pixel buffer objects. Default is 2.
+
+    Attributes
+    ----------
+    texture : gl.GLuint
+        The texture.
+    width : int
+        The width of the texture, in pixels.
+    height : int
+        The height of the texture, in pixels.
+    nbytes : int
+        The size of each frame, in bytes.
+    buffers : Sequence[gl.GLuint]
+        The pixel buffer objects. Empty if they are not supported.
+
+    """
+    def __init__(self, width, height, n_buffers=2):
+        self.width = width
+        self.height = height
+        self.nbytes = width * height * 3
+
+        self.texture = gl.glGenTextures(1)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        gl.glTexParameter(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER,
+                          gl.GL_LINEAR)
+        for wrap in (gl.GL_TEXTURE_WRAP_S, gl.GL_TEXTURE_WRAP_T):
+            gl.glTexParameter(gl.GL_TEXTURE_2D, wrap, gl.GL_CLAMP_TO_BORDER)
+        gl.glTexParameterfv(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_BORDER_COLOR,
+                            (0, 0, 0, 1))
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGB, width, height, 0,
+                        gl.GL_RGB, gl.GL_UNSIGNED_BYTE, None)
+
+        if gl.glGenBuffers and gl.glMapBuffer:
+            self.buffers = np.atleast_1d(gl.glGenBuffers(n_buffers))
+            for buffer in self.buffers:
+                gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, buffer)
+                gl.glBufferData(gl.GL_PIXEL_UNPACK_BUFFER, self.nbytes, None,
+                                gl.GL_STREAM_DRAW)
+            gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, 0)
+        else:
+            self.buffers = ()
+        self._next_buffer = 0
+
+    def upload(self, pixels):
+        """
+        Update the texture.
+
+        Parameters
+        ----------
+        pixels : np.ndarray
+            A (height, width, 3) array of RGB values, starting from the top
+            row. It does not need to be contiguous.
+
+        """
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        if not len(self.buffers):
+            gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, 0, 0, self.width,
+                               self.height, gl.GL_RGB, gl.GL_UNSIGNED_BYTE,
+                               np.ascontiguousarray(pixels))
+            return
+
+        buffer = self.buffers[self._next_buffer]
+        self._next_buffer = (self._next_buffer + 1) % len(self.buffers)
+        gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, buffer)
+        try:
+            # Orphan the old storage, so that mapping does not have to wait
+            # for a transfer which is still using it.
+            gl.glBufferData(gl.GL_PIXEL_UNPACK_BUFFER, self.nbytes, None,
+                            gl.GL_STREAM_DRAW)
+            address = gl.glMapBuffer(gl.GL_PIXEL_UNPACK_BUFFER,
+                                     gl.GL_WRITE_ONLY)
+            if not address:
+                return
+            mapped = (ctypes.c_ubyte * self.nbytes).from_address(address)
+            np.copyto(np.frombuffer(mapped, dtype=np.uint8).reshape(
+                self.height, self.width, 3), pixels)
+            gl.glUnmapBuffer(gl.GL_PIXEL_UNPACK_BUFFER)
+
+            # Implementation does not accept kwargs. With a buffer bound, the
+            # pixels are an offset into it.
+            gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, 0, 0, self.width,
+                               self.height, gl.GL_RGB, gl.GL_UNSIGNED_BYTE,
+                               ctypes.c_void_p(0))
+        finally:
+            gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, 0)
+
+    def delete(self):
+        """
+        Release the texture and the buffers.
+
+        """
+        if len(self.buffers):
+            gl.glDeleteBuffers(len(self.buffers), self.buffers)
+        gl.glDeleteTextures([self.texture])
+
+
+class OffscreenContext(object):
+    """
+    An OpenGL context which draws into an offscreen buffer, without a window.
+
+    PyOpenGL chooses its platform from the ``PYOPENGL_PLATFORM`` environment
+    variable, which must be set to "egl" or "osmesa" before OpenGL is first
+    imported. Without a display server, Mesa's EGL also needs
+    ``EGL_PLATFORM=surfaceless``.
+
+    The context is made current on creation.
+
+    Parameters
+    ----------
+    width : int
+        The width of the buffer, in pixels.
+    height : int
+        The height of the buffer, in pixels.
+
+    Attributes
+    ----------
+    width : int
+        The width of the buffer, in pixels.
+    height : int
+        The height of the buffer, in pixels.
+    platform : str
+        The platform used, either "egl" or "osmesa".
+
+    Raises
+    ------
+    RuntimeError
+        If PyOpenGL is not using an offscreen platform.
+
+    """
+    def __init__(self, width, height):
+        self.width = int(width)
+        self.height = int(height)
+        self.platform = os.environ.get("PYOPENGL_PLATFORM")
+        if self.platform == "egl":
+            self._make_egl_context()
+        elif self.platform == "osmesa":
+            self._make_osmesa_context()
+        else:
+            raise RuntimeError("PYOPENGL_PLATFORM must be egl or osmesa to "
+                               "render offscreen.")
+
+    def _make_egl_context(self):
+        """
+        Create a context drawing into an EGL pixel buffer surface.
+
+        """
+        # Only importable when PyOpenGL uses the same platform.
+        from OpenGL import EGL as egl
+
+        display = egl.eglGetDisplay(egl.EGL_DEFAULT_DISPLAY)
+        major, minor = egl.EGLint(), egl.EGLint()
+        egl.eglInitialize(display, ctypes.pointer(major), ctypes.pointer(minor))
+
+        attributes = [egl.EGL_SURFACE_TYPE, egl.EGL_PBUFFER_BIT,
+                      egl.EGL_RED_SIZE, 8,
+                      egl.EGL_GREEN_SIZE, 8,
+                      egl.EGL_BLUE_SIZE, 8,
+                      egl.EGL_DEPTH_SIZE, 24,
+                      egl.EGL_RENDERABLE_TYPE, egl.EGL_OPENGL_BIT,
+                      egl.EGL_NONE]
+        config = egl.EGLConfig()
+        n_configs = egl.EGLint()
+        egl.eglChooseConfig(display,
+                            (egl.EGLint * len(attributes))(*attributes),
+                            ctypes.pointer(config), 1,
+                            ctypes.pointer(n_configs))
+        if not n_configs.value:
+            raise RuntimeError("No EGL configuration can render offscreen.")
+
+        size = [egl.EGL_WIDTH, self.width, egl.EGL_HEIGHT, self.height,
+                egl.EGL_NONE]
+        surface = egl.eglCreatePbufferSurface(
+            display, config, (egl.EGLint * len(size))(*size))
+        egl.eglBindAPI(egl.EGL_OPENGL_API)
+        context = egl.eglCreateContext(display, config, egl.EGL_NO_CONTEXT,
+                                       None)
+        egl.eglMakeCurrent(display, surface, surface, context)
+
+        def destroy():
+            egl.eglMakeCurrent(display, egl.EGL_NO_SURFACE,
+                               egl.EGL_NO_SURFACE, egl.EGL_NO_CONTEXT)
+            egl.eglDestroySurface(display, surface)
+            egl.eglDestroyContext(display, context)
+            egl.eglTerminate(display)
+
+        self._destroy = destroy
+
+    def _make_osmesa_context(self):
+        """
+        Create a context drawing into an OSMesa buffer in main memory.
+
+        """
+        # Only importable when PyOpenGL uses the same platform.
+        from OpenGL import arrays, osmesa
+
+        context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24, 0, 0,
+                                                None)
+        self._buffer = arrays.GLubyteArray.zeros((self.height, self.width, 4))
+        if not osmesa.OSMesaMakeCurrent(context, self._buffer,
+                                        gl.GL_UNSIGNED_BYTE, self.width,
+                                        self.height):
+            raise RuntimeError("Could not make the OSMesa context current.")
+
+        def destroy():
+            osmesa.OSMesaDestroyContext(context)
+
+        self._destroy = destroy
+
+    def read_pixels(self):
+        """
+        Read what has been drawn.
+
+        Returns
+        -------
+        np.ndarray
+            A (height, width, 3) array of RGB values, starting from the top
+            row.
+
+        """
+        return gl_read_pixels(self.width, self.height)
+
+    def destroy(self):
+        """
+        Release the context and its buffer.
+
+        """
+        self._destroy()
+
+
+class TextCache(object):
+    """
+    Draw text from textures which are only rendered once.
+
+    Each combination of text, font, and colour is rasterized to a texture
+    when it is first drawn. Later draws are a single textured quad. The least
+    recently used textures are deleted once there are more than `maxsize`.
+
+    If fonts cannot be rendered, the text is drawn with the bitmapped
+    font instead.
+
+    Parameters
+    ----------
+    maxsize : Optional[int]
+        The maximum number of textures to keep. Default is 64.
+
+    Attributes
+    ----------
+    maxsize : int
+        The maximum number of textures to keep.
+    hits : int
+        The number of draws which used a cached texture.
+    misses : int
+        The number of draws which needed a new texture.
+
+    """
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._textures = OrderedDict()
+        self._fonts = {}
+
+    def draw(self, text, x, y, font, colour):
+        """
+        Draw text in the current orthographic projection.
+
+        Parameters
+        ----------
+        text : str
+            The text to write.
+        x : float
+            The horizontal position of the start of the text.
+        y : float
+            The vertical position of the baseline of the first line of text.
+        font : ctypes.c_void_p
+            A bitmapped font, as returned by `gl_font`.
+        colour : Sequence[float]
+            The text colour, as RGB values between 0 and 1.
+
+        """
+        key = (text, id(font), tuple(colour))
+        try:
+            entry = self._textures.pop(key)
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            entry = self._render(text, font, colour)
+            while len(self._textures) >= self.maxsize:
+                old_texture = self._textures.popitem(last=False)[1][0]
+                if old_texture is not None:
+                    gl.glDeleteTextures([old_texture])
+        self._textures[key] = entry
+
+        texture, width, height, ascent = entry
+        if texture is None:
+            with new_state():
+                gl.glColor3fv(colour)
+                gl.glRasterPos2f(x, y)
+                glut.glutBitmapString(font, text)
+            return
+
+        top = y + ascent
+        with new_state():
+            gl.glColor4f(1, 1, 1, 1)
+            with gl_flag(gl.GL_TEXTURE_2D), gl_flag(gl.GL_BLEND):
+                gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+                gl.glBindTexture(gl.GL_TEXTURE_2D, texture)
+                with gl_primitive(gl.GL_QUADS):
+                    for u, v in ((0, 0), (0, 1), (1, 1), (1, 0)):
+                        gl.glTexCoord2f(u, v)
+                        gl.glVertex(x + u * width, top - (1 - v) * height, 0)
+
+    def _render(self, text, font, colour):
+        """
+        Rasterize text to a new texture.
+
+        Parameters
+        ----------
+        text : str
+            The text to write. It may contain several lines.
+        font : ctypes.c_void_p
+            A bitmapped font, as returned by `gl_font`.
+        colour : Sequence[float]
+            The text colour, as RGB values between 0 and 1.
+
+        Returns
+        -------
+        texture : gl.GLuint | None
+            The texture, or None if the text could not be rendered.
+        width : int
+            The width of the texture, in pixels.
+        height : int
+            The height of the texture, in pixels.
+        ascent : int
+            The height of the first line above its baseline, in pixels.
+
+        """
+        try:
+            system_font = self._system_font(font)
+            lines = [system_font.render(line, True,
+                                        [int(255 * c) for c in colour])
+                     for line in text.split("\n")]
+        except (StopIteration, NotImplementedError, pg.error):
+            return None, 0, 0, 0
+
+        line_height = system_font.get_linesize()
+        surface = pg.Surface((max(line.get_width() for line in lines),
+                              line_height * len(lines)), pg.SRCALPHA)
+        for i, line in enumerate(lines):
+            surface.blit(line, (0, i * line_height))
+        width, height = surface.get_size()
+
+        texture = gl.glGenTextures(1)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, texture)
+        gl.glTexParameter(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER,
+                          gl.GL_NEAREST)
+        gl.glTexParameter(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER,
+                          gl.GL_NEAREST)
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGBA, width, height, 0,
+                        gl.GL_RGBA, gl.GL_UNSIGNED_BYTE,
+                        pg.image.tostring(surface, "RGBA", True))
+        return texture, width, height, system_font.get_ascent()
+
+    def _system_font(self, font):
+        """
+        Load the system font closest to a bitmapped font.
+
+        Parameters
+        ----------
+        font : ctypes.c_void_p
+            A bitmapped font, as returned by `gl_font`.
+
+        Returns
+        -------
+        pygame.font.Font
+            The system font.
+
+        Raises
+        ------
+        StopIteration
+            If the font is not known.
+
+        """
+        if id(font) not in self._fonts:
+            name, size = next(system_font for bitmap_font, system_font
+                              in _SYSTEM_FONTS if bitmap_font is font)
+            if not pg.font.get_init():
+                pg.font.init()
+            self._fonts[id(font)] = pg.font.SysFont(name, size)
+        return self._fonts[id(font)]
+
+    def clear(self):
+        """
+        Delete all the textures.
+
+        """
+        for texture, _, _, _ in self._textures.values():
+            if texture is not None:
+                gl.glDeleteTextures([texture])
+        self._textures.clear()
+
+
 class Shape(object):
     """
     A drawable shape made out of polygons.
@@ -192,12 +657,19 @@ class Shape(object):
         A sequence of the list of indices of vertices forming a surface,
         in order.
 
+    Notes
+    -----
+    The geometry is compiled into a display list the first time it is drawn
+    with a given edge colour, so the shape must not be changed afterwards.
+    Display lists belong to the OpenGL context in which they were compiled.
+
     """
     def __init__(self, vertices, colours, edges, surfaces):
         self.vertices = vertices
         self.colours = colours
         self.edges = edges
         self.surfaces = surfaces
+        self._display_lists = {}
 
     def draw(self, quaternion=(0, 0, 0, 1), edge_colour=(1, 1, 1)):
         """
@@ -214,8 +686,57 @@ class Shape(object):
         """
         with new_matrix():
             gl.glRotate(*Quat.to_axis(quaternion))
-            self._draw_components(self.vertices, self.colours, self.edges,
-                                  self.surfaces, edge_colour)
+            gl.glCallList(self._display_list(edge_colour))
+
+    def _display_list(self, edge_colour):
+        """
+        Get the display list of the geometry, compiling it if needed.
+
+        Parameters
+        ----------
+        edge_colour : Sequence[float]
+            The colour to draw the edges in, as RGB values between 0 and 1.
+
+        Returns
+        -------
+        gl.GLuint
+            The display list.
+
+        """
+        edge_colour = tuple(edge_colour)
+        try:
+            return self._display_lists[edge_colour]
+        except KeyError:
+            display_list = gl.glGenLists(1)
+            gl.glNewList(display_list, gl.GL_COMPILE)
+            try:
+                self._draw_geometry(edge_colour)
+            finally:
+                gl.glEndList()
+            self._display_lists[edge_colour] = display_list
+            return display_list
+
+    def _draw_geometry(self, edge_colour):
+        """
+        Draw every part of the shape, without any transformation.
+
+        Parameters
+        ----------
+        edge_colour : Sequence[float]
+            The colour to draw the edges in, as RGB values between 0 and 1.
+
+        """
+        self._draw_components(self.vertices, self.colours, self.edges,
+                              self.surfaces, edge_colour)
+
+    def delete(self):
+        """
+        Release the compiled geometry.
+
+        """
+        for display_list in self._display_lists.values():
+            gl.glDeleteLists(display_list, 1)
+        self._display_lists.clear()
 
     @staticmethod
     def _draw_components(vertices, colours, edges, surfaces, edge_colour):
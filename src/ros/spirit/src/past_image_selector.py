@@ -6,18 +6,18 @@ Select the best image for SPIRIT.
 """
 from __future__ import division
 from collections import deque, OrderedDict
-import os
+import threading
 
-import yaml
+import numpy as np
 
-import rospkg
 import rospy
 from geometry_msgs.msg import PoseStamped
 from sensor_msgs.msg import Image
-from std_msgs.msg import Bool
+from std_msgs.msg import Bool, Empty
 
-from evaluators import get_evaluator
-from helpers import Pose, Frame
+from evaluators import get_components, get_evaluator, STATE_INPUTS
+from helpers import (memoize, image_sharpness, FrameStore, LatencyTracer,
+                     Pose, PoseBuffer, report_latency)
 
 
 class Selector(object):
@@ -27,15 +27,61 @@ class Selector(object):
     The evaluation function is determined by a rosparam which must be set before
     launch.
 
+    The coefficients and parameters of the evaluation function are read from
+    rosparams when the selector starts, and are compiled by the evaluator.
+    After changing them, publish on ``~reload_params`` to reload them.
+
+    Unless `threaded` is False, evaluation runs on a dedicated thread. Poses
+    which arrive while an evaluation is running are coalesced, and only the
+    newest one is evaluated next.
+
+    Unless `interpolate_poses` is False, each image is stored with the pose
+    of the drone at the time the image was stamped, interpolated from the
+    last `pose_buffer_length` poses, rather than with the newest pose.
+
+    If `min_quality` is set, the sharpness of each image is scored before it
+    is stored, and images which score lower are rejected, so that blurred or
+    corrupted images do not take up the image queue. Unless `threaded` is
+    False, scoring runs on another dedicated thread, and only the newest
+    image waiting to be scored is kept.
+
     Attributes
     ----------
     can_make_frame
+    eval_coeffs : OrderedDict
+        The non-zero coefficient of each component of the evaluation
+        function, by name.
     current_frame : Frame
         The current frame which is being shown.
-    frames : list of Frame
-        A chronological list of frames.
+    frames : FrameStore
+        A chronological store of frames.
+    poses : PoseBuffer | None
+        The recent poses, if poses are interpolated.
     past_image_pub : rospy.Publisher
         The publisher for the past images.
+    n_poses : int
+        The number of poses received.
+    n_coalesced : int
+        The number of poses which were replaced by a newer pose before being
+        evaluated.
+    min_quality : float | None
+        The lowest sharpness score of images which are stored. None if images
+        are not scored.
+    quality_scores : deque of float
+        The sharpness scores of the most recently scored images.
+    n_rejected : int
+        The number of images rejected for scoring below `min_quality`.
+    n_images_coalesced : int
+        The number of images which were replaced by a newer image before
+        being scored.
+    staleness : float | None
+        The age of the last evaluated pose when its result was ready, in
+        seconds.
+    tracer : LatencyTracer
+        The latency of each stage, from the stamp of the pose. "receive" is
+        when the pose arrived, "select" is how long the selection took, and
+        "publish" is when the result was ready, and published if it changed.
+        "quality" is how long scoring an image took.
 
     Raises
     ------
@@ -43,49 +89,112 @@ class Selector(object):
         If the rosparam has not been set.
 
     """
-    def __init__(self, image_queue_length=None, eval_method=None, debug=False):
+    optional_params = {"thresh_distance": None, "thresh_yaw": None,
+                       "switch_margin": 0, "min_dwell": 0}
+
+    def __init__(self, image_queue_length=None, eval_method=None,
+                 eval_coeffs=None, batch_evaluation=None, index_cell_size=None,
+                 image_storage=None, image_format=None, min_quality=None,
+                 interpolate_poses=None, pose_buffer_length=None, debug=False,
+                 threaded=True):
         if image_queue_length is None:
             image_queue_length = rospy.get_param("~image_queue_length")
             if image_queue_length == "None":
                 image_queue_length = None
         if eval_method is None:
             eval_method = rospy.get_param("~eval_method")
+        if batch_evaluation is None:
+            batch_evaluation = rospy.get_param("~batch_evaluation", True)
+        if index_cell_size is None:
+            index_cell_size = rospy.get_param("~index_cell_size", None)
+            if index_cell_size == "None":
+                index_cell_size = None
+        if image_storage is None:
+            image_storage = rospy.get_param("~image_storage", "message")
+        if image_format is None:
+            image_format = rospy.get_param("~image_format", ".jpg")
+        if min_quality is None:
+            min_quality = rospy.get_param("~min_quality", None)
+            if min_quality == "None":
+                min_quality = None
+        if interpolate_poses is None:
+            interpolate_poses = rospy.get_param("~interpolate_poses", True)
+        if pose_buffer_length is None:
+            pose_buffer_length = rospy.get_param("~pose_buffer_length", 1200)
 
         self.clear()
 
-        self.frames = deque([], image_queue_length)
+        self.frames = FrameStore(image_queue_length,
+                                 cell_size=index_cell_size,
+                                 image_storage=image_storage,
+                                 image_format=image_format)
 
+        self.poses = (PoseBuffer(pose_buffer_length) if interpolate_poses
+                      else None)
         self.image = None
         self.pose = None
         self.current_frame = None
         self.tracked = None
         self.debug = debug
-
-        self.evaluator = get_evaluator(eval_method, parent=self)
-
-        with open(os.path.join(rospkg.RosPack().get_path("spirit"),
-                               "config", "launch_params.yaml")) as fin:
-            params = yaml.load(fin)
-        self.eval_method_params = params["past_image"][eval_method].keys()
-        self.eval_coeffs = OrderedDict()
-        for param, coefficient in params["past_image"][eval_method].items():
-            if param.startswith("coeff_") and coefficient != 0:
-                component = param.split("coeff_", 1)[1]
-                self.eval_coeffs[component] = coefficient
+        self.threaded = threaded
+
+        self.n_poses = 0
+        self.n_coalesced = 0
+        self.staleness = None
+        self.tracer = LatencyTracer()
+        self._frames_lock = threading.Lock()
+        self._pose_ready = threading.Condition()
+        self._pending_pose = None
+
+        self.min_quality = min_quality
+        self.quality_scores = deque(maxlen=100)
+        self.n_rejected = 0
+        self.n_images_coalesced = 0
+        self._image_ready = threading.Condition()
+        self._pending_image = None
+
+        self.eval_method = eval_method
+        components = get_components(eval_method)
+        self.eval_method_params = set(self.optional_params)
+        for component, inputs in components.items():
+            self.eval_method_params.add("coeff_{}".format(component))
+            self.eval_method_params.update(
+                param for param in inputs if param not in STATE_INPUTS)
+        if eval_coeffs is None:
+            eval_coeffs = self._load_coeffs()
+        self.eval_coeffs = OrderedDict(eval_coeffs)
+        self.evaluator = get_evaluator(eval_method, parent=self,
+                                       batch=batch_evaluation)
 
         rospy.Subscriber("/ardrone/slow_image_raw", Image, self.image_callback)
         rospy.Subscriber("/ardrone/pose", PoseStamped, self.pose_callback)
         rospy.Subscriber("/ardrone/tracked", Bool, self.tracked_callback)
+        rospy.Subscriber("~reload_params", Empty, self.reload_params)
 
         self.past_image_pub = rospy.Publisher("/ardrone/past_image", Image,
-                                              queue_size=1)
+                                              queue_size=1, latch=True)
         self.past_pose_pub = rospy.Publisher("/ardrone/past_pose", PoseStamped,
-                                             queue_size=1)
+                                             queue_size=1, latch=True)
+
+        self._stopped = threading.Event()
+        self._threads = []
+        if self.threaded:
+            self._threads.append(threading.Thread(
+                target=self._evaluation_loop, name="past_image_evaluation"))
+        if self.threaded and self.min_quality is not None:
+            self._threads.append(threading.Thread(target=self._quality_loop,
+                                                  name="image_quality"))
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
 
     def image_callback(self, image):
         """
         Update `image`, and store frames if all the data is available.
 
+        If images are scored, the frame is only stored once its image has
+        been scored high enough.
+
         Parameters
         ----------
         image : Image
@@ -94,17 +203,113 @@ class Selector(object):
         """
         rospy.logdebug("New image")
         self.image = image
-        if self.can_make_frame and (self.moved or not self.frames):
-            rospy.logdebug("Adding frames to queue")
-            frame = Frame(self._pose_stamped, self.image)
-            self.frames.append(frame)
+        with self._frames_lock:
+            if not (self.can_make_frame and (self.moved or not self.frames)):
+                return
+            pose_stamped = self._pose_at(image.header.stamp)
             self.clear()
+            if self.min_quality is None:
+                rospy.logdebug("Adding frames to queue")
+                self.frames.append(pose_stamped, image)
+                return
+
+        if not self.threaded:
+            self.assess(pose_stamped, image)
+            return
+
+        with self._image_ready:
+            if self._pending_image is not None:
+                self.n_images_coalesced += 1
+            self._pending_image = (pose_stamped, image)
+            self._image_ready.notify()
+
+    def assess(self, pose_stamped, image):
+        """
+        Score the sharpness of an image, and store its frame unless it scores
+        below `min_quality`.
+
+        Images whose encoding cannot be scored are stored. Images with
+        truncated data are rejected.
+
+        Parameters
+        ----------
+        pose_stamped : PoseStamped
+            The pose of the drone when the image arrived.
+        image : Image
+            The image.
+
+        Returns
+        -------
+        bool
+            Whether the frame was stored.
+
+        """
+        if len(image.data) < image.height * image.step:
+            self.n_rejected += 1
+            rospy.logwarn("Rejected truncated image ({size} of {expected} "
+                          "bytes)".format(size=len(image.data),
+                                          expected=image.height * image.step))
+            return False
+
+        with self.tracer.timed("quality"):
+            quality = image_sharpness(image)
+        if quality is not None:
+            self.quality_scores.append(quality)
+            if quality < self.min_quality:
+                self.n_rejected += 1
+                rospy.logdebug("Rejected image with quality {quality:.1f}"
+                               .format(quality=quality))
+                return False
+
+        with self._frames_lock:
+            rospy.logdebug("Adding frames to queue")
+            self.frames.append(pose_stamped, image)
+        return True
+
+    def _pose_at(self, stamp):
+        """
+        Find the pose of the drone at a given time.
+
+        Parameters
+        ----------
+        stamp : rospy.Time
+            The time.
+
+        Returns
+        -------
+        PoseStamped
+            The interpolated pose. If poses are not interpolated, or the time
+            is not set, the newest pose.
+
+        """
+        if self.poses is None or not stamp.to_sec():
+            return self._pose_stamped
+        return self.poses.interpolate(stamp)
+
+    def _quality_loop(self):
+        """
+        Score the newest image whenever one arrives, until shutdown or
+        `stop`.
+
+        """
+        while not (rospy.is_shutdown() or self._stopped.is_set()):
+            with self._image_ready:
+                if self._pending_image is None:
+                    self._image_ready.wait(0.1)
+                item, self._pending_image = self._pending_image, None
+            if item is None:
+                continue
+            try:
+                self.assess(*item)
+            except Exception as e:
+                rospy.logerr("Cannot assess image: {}".format(e))
 
     def pose_callback(self, pose_stamped):
         """
         Update `pose`, and select the best past image.
 
-        Short circuits if an evaluation function is still being run.
+        If evaluation is threaded, the pose is handed over to the evaluation
+        thread, replacing any pose which has not been evaluated yet.
 
         Parameters
         ----------
@@ -113,18 +318,90 @@ class Selector(object):
 
         """
         rospy.logdebug("New pose")
+        self.tracer.since("receive", pose_stamped.header.stamp)
         self._pose_stamped = pose_stamped
         self.pose = Pose(pose_stamped)
+        self.n_poses += 1
+        if self.poses is not None:
+            self.poses.append(pose_stamped)
 
-        if self.evaluator.is_busy:
+        if not self.threaded:
+            self.evaluate(self.pose)
             return
 
-        best_frame = self.evaluator.select_best_frame()
-        if best_frame is not None:
-            self.current_frame = best_frame
+        with self._pose_ready:
+            if self._pending_pose is not None:
+                self.n_coalesced += 1
+            self._pending_pose = self.pose
+            self._pose_ready.notify()
+
+    def evaluate(self, pose):
+        """
+        Select the best past image for a pose, and publish it if it has
+        changed.
+
+        The staleness and the "publish" latency are recorded for every pose
+        evaluated, whether or not the past image changed.
+
+        The frames cannot be changed during the evaluation, or before the
+        image of the best frame has been retrieved. The past image and pose
+        are latched, so subscribers which connect later still receive them.
+
+        Parameters
+        ----------
+        pose : Pose
+            The pose to be evaluated.
+
+        """
+        with self._frames_lock:
+            with self.tracer.timed("select"):
+                best_frame = self.evaluator.select_best_frame(pose)
+            if best_frame is None:
+                return
+            changed = best_frame is not self.current_frame
+            if changed:
+                self.current_frame = best_frame
+                image = best_frame.image
+
+        if changed:
             if not self.debug:
-                self.past_image_pub.publish(best_frame.image)
+                self.past_image_pub.publish(image)
             self.past_pose_pub.publish(best_frame.pose_stamped)
+        self.staleness = self.tracer.since("publish", pose.header.stamp)
+        rospy.logdebug("Selected past image {staleness:.3f} s after the pose"
+                       .format(staleness=self.staleness))
+
+    def _evaluation_loop(self):
+        """
+        Evaluate the newest pose whenever one arrives, until shutdown or
+        `stop`.
+
+        """
+        while not (rospy.is_shutdown() or self._stopped.is_set()):
+            with self._pose_ready:
+                if self._pending_pose is None:
+                    self._pose_ready.wait(0.1)
+                pose, self._pending_pose = self._pending_pose, None
+            if pose is not None:
+                self.evaluate(pose)
+
+    def stop(self, timeout=None):
+        """
+        Stop the evaluation and scoring threads, and wait for them to finish.
+
+        Parameters
+        ----------
+        timeout : Optional[float]
+            The longest time to wait for each thread, in seconds. Default is
+            to wait until they finish.
+
+        """
+        self._stopped.set()
+        for condition in (self._pose_ready, self._image_ready):
+            with condition:
+                condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
 
     def tracked_callback(self, tracked):
         """
@@ -180,6 +457,45 @@ class Selector(object):
 
         return False
 
+    def _load_coeffs(self):
+        """
+        Read the coefficients of the evaluation method.
+
+        Returns
+        -------
+        OrderedDict
+            The non-zero coefficient of each component, by name.
+
+        """
+        coeffs = OrderedDict()
+        for component in get_components(self.eval_method):
+            coeff = rospy.get_param("~coeff_{}".format(component), 0)
+            if coeff != 0:
+                coeffs[component] = coeff
+        return coeffs
+
+    def reload_params(self, message=None):
+        """
+        Reload the coefficients and parameters of the evaluation method.
+
+        This is called when a message is published on ``~reload_params``,
+        after the parameters have been changed. The evaluator is recompiled
+        between evaluations.
+
+        Parameters
+        ----------
+        message : Optional[Empty]
+            (Unused) The message requesting the reload.
+
+        """
+        with self._frames_lock:
+            for name in self.eval_method_params:
+                self.__dict__.pop(name, None)
+            self.eval_coeffs = self._load_coeffs()
+            self.evaluator.compile()
+        rospy.loginfo("Reloaded coefficients: {coeffs}".format(
+            coeffs=dict(self.eval_coeffs)))
+
     def clear(self):
         """
         Reset status attributes to default values.
@@ -209,18 +525,66 @@ class Selector(object):
             If the ros parameter has not been defined.
 
         """
-        if name in self.eval_method_params:
+        if name in self.optional_params:
+            self.__setattr__(name, rospy.get_param("~{n}".format(n=name),
+                                                   self.optional_params[name]))
+        elif name in self.eval_method_params:
             self.__setattr__(name, rospy.get_param("~{n}".format(n=name)))
         return self.__getattribute__(name)
 
 
+def log_statistics(selector):
+    """
+    Log the number of coalesced poses, how often the frame was switched, the
+    image quality, and the cache statistics.
+
+    Parameters
+    ----------
+    selector : Selector
+        The selector used.
+
+    """
+    rospy.loginfo("{coalesced}/{poses} poses were coalesced".format(
+        coalesced=selector.n_coalesced, poses=selector.n_poses))
+    rospy.loginfo("Switched frames {switches} times, and held the current "
+                  "frame {held} times".format(
+                      switches=selector.evaluator.n_switches,
+                      held=selector.evaluator.n_held))
+    if selector.quality_scores:
+        rospy.loginfo("{rejected} images were rejected. Recent quality: "
+                      "min {min:.1f}, median {median:.1f}, max {max:.1f}"
+                      .format(rejected=selector.n_rejected,
+                              min=min(selector.quality_scores),
+                              median=np.median(selector.quality_scores),
+                              max=max(selector.quality_scores)))
+    log_cache_info()
+
+
+def log_cache_info():
+    """
+    Log the cache statistics of the memoized methods.
+
+    """
+    for name, info in sorted(memoize.cache_infos().items()):
+        calls = info.hits + info.misses
+        rospy.loginfo("{name}: {hits}/{calls} cache hits ({rate:.0%})".format(
+            name=name, hits=info.hits, calls=calls,
+            rate=info.hits / calls if calls else 0))
+
+
 def main():
     """
     Main entry point for script.
 
     """
     rospy.init_node("past_image_selector", log_level=rospy.INFO)
-    Selector()
+    selector = Selector()
+    rospy.on_shutdown(lambda: log_statistics(selector))
+    rospy.on_shutdown(selector.stop)
+    rospy.on_shutdown(selector.frames.close)
+    period = rospy.get_param("~latency_report_period", 5)
+    if period not in (None, "None"):
+        report_latency(selector.tracer, "past_image_selector", period)
     rospy.loginfo("Started the past image selector")
     rospy.spin()
 
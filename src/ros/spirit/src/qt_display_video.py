@@ -7,6 +7,7 @@ Displays a video feed, and can also show the drone state and connection problems
 in the status bar.
 
 """
+from __future__ import division
 import sys
 from threading import Lock
 
@@ -22,6 +23,53 @@ from drone_state import DroneState
 
 CONNECTION_CHECK_PERIOD = 250  # ms
 GUI_UPDATE_PERIOD = 20  # ms
+DISPLAY_RATE_PERIOD = 1000  # ms
+
+
+class ImageBox(QtWidgets.QWidget):
+    """
+    A widget which paints an image directly, without converting it to a
+    pixmap first.
+
+    Attributes
+    ----------
+    image : QtGui.QImage | None
+        The image shown.
+
+    """
+    def __init__(self, parent=None):
+        super(ImageBox, self).__init__(parent)
+        self.image = None
+        self.setAttribute(QtCore.Qt.WA_OpaquePaintEvent)
+
+    def set_image(self, image):
+        """
+        Show an image, resizing the widget only if the size has changed.
+
+        Parameters
+        ----------
+        image : QtGui.QImage
+            The image to show.
+
+        Returns
+        -------
+        bool
+            Whether the widget was resized.
+
+        """
+        resized = self.image is None or image.size() != self.image.size()
+        if resized:
+            self.setFixedSize(image.size())
+        self.image = image
+        self.update()
+        return resized
+
+    def paintEvent(self, event):
+        if self.image is None:
+            return
+        painter = QtGui.QPainter(self)
+        painter.drawImage(0, 0, self.image)
+        painter.end()
 
 
 class DroneVideoDisplay(QtWidgets.QMainWindow):
@@ -40,15 +88,20 @@ class DroneVideoDisplay(QtWidgets.QMainWindow):
     msg_disconnected = "Disconnected"
     msg_unknown = "Unknown State"
     msg_status_template = "{state} (Battery: {battery:.0f}%){tracked}"
+    msg_rate_template = "{status} | {rate:.1f} fps"
+
+    # Emitted from the ROS thread. Connected slots run on the GUI thread.
+    image_received = QtCore.pyqtSignal()
 
     def __init__(self):
         super(DroneVideoDisplay, self).__init__()
 
-        # Setup GUI - a label which fills the whole window and holds our image.
+        # Setup GUI - a widget which fills the whole window and holds our image.
         self.setWindowTitle(rospy.get_param("~window_name",
                                             "AR.Drone Video Feed"))
-        self.image_box = QtWidgets.QLabel(self)
+        self.image_box = ImageBox(self)
         self.setCentralWidget(self.image_box)
+        self.image_received.connect(self.cbk_show_image)
 
         rospy.Subscriber("/ardrone/navdata", Navdata, self.cbk_navdata)
         rospy.Subscriber("/ardrone/tracked", Bool, self.cbk_tracked,
@@ -58,10 +111,18 @@ class DroneVideoDisplay(QtWidgets.QMainWindow):
         # Holds drone tracking status.
         self.tracked = False
 
-        # Holds image frame received from drone for processing by GUI.
+        # Holds the image being shown, which owns the pixels of the QImage.
         self.image = None
+        # Holds the newest image which has not been shown yet.
+        self._pending_image = None
         self._image_lock = Lock()
 
+        # Count the images shown, and those replaced before being shown.
+        self.n_shown = 0
+        self.n_dropped = 0
+        self.display_rate = 0
+        self._n_shown_at_last_rate = 0
+
         # Holds the status message to be displayed on the next GUI update.
         self.msg_status_bar = ""
 
@@ -73,11 +134,16 @@ class DroneVideoDisplay(QtWidgets.QMainWindow):
         self.timer_connection.timeout.connect(self.cbk_connection)
         self.timer_connection.start(CONNECTION_CHECK_PERIOD)
 
-        # A timer to redraw the GUI.
+        # A timer to update the status bar. Images are shown when they arrive.
         self.timer_redraw = QtCore.QTimer(self)
         self.timer_redraw.timeout.connect(self.cbk_redraw)
         self.timer_redraw.start(GUI_UPDATE_PERIOD)
 
+        # A timer to measure the display rate.
+        self.timer_rate = QtCore.QTimer(self)
+        self.timer_rate.timeout.connect(self.cbk_rate)
+        self.timer_rate.start(DISPLAY_RATE_PERIOD)
+
     @property
     def is_connected(self):
         return self._comm_since_timer
@@ -94,27 +160,53 @@ class DroneVideoDisplay(QtWidgets.QMainWindow):
         self._comm_since_timer = False
 
     def cbk_redraw(self):
-        if self.image is not None:
-            with self._image_lock:
-                # Convert the ROS image into a QImage which we can display.
-                image = QtGui.QPixmap.fromImage(
-                    QtGui.QImage(self.image.data, self.image.width,
-                                 self.image.height, QtGui.QImage.Format_RGB888))
+        # Update the status bar.
+        self.statusBar().showMessage(self.msg_rate_template.format(
+            status=(self.msg_status_bar if self.is_connected
+                    else self.msg_disconnected),
+            rate=self.display_rate))
 
-            # Further processing can be done here.
-            self.resize(image.width(), image.height())
-            self.image_box.setPixmap(image)
+    def cbk_show_image(self):
+        """
+        Show the newest image, if it has not been shown yet.
 
-        # Update the status bar.
-        self.statusBar().showMessage(
-            self.msg_status_bar if self.is_connected
-            else self.msg_disconnected)
+        Several signals may be queued while the GUI is busy, but only the
+        newest image is converted.
+
+        """
+        with self._image_lock:
+            image, self._pending_image = self._pending_image, None
+        if image is None:
+            return
+
+        # Wrap the ROS image without copying it. The QImage does not own the
+        # pixels, so the message is kept for as long as it is shown.
+        self.image = image
+        if self.image_box.set_image(
+                QtGui.QImage(image.data, image.width, image.height, image.step,
+                             QtGui.QImage.Format_RGB888)):
+            self.adjustSize()
+        self.n_shown += 1
+
+    def cbk_rate(self):
+        """
+        Called every DISPLAY_RATE_PERIOD.
+
+        Measure how many images were shown per second.
+
+        """
+        self.display_rate = ((self.n_shown - self._n_shown_at_last_rate)
+                             / (DISPLAY_RATE_PERIOD / 1000))
+        self._n_shown_at_last_rate = self.n_shown
 
     def cbk_image(self, data):
         self._comm_since_timer = True
 
         with self._image_lock:
-            self.image = data  # Save ros image for display thread processing.
+            if self._pending_image is not None:
+                self.n_dropped += 1
+            self._pending_image = data
+        self.image_received.emit()
 
     def cbk_navdata(self, navdata):
         self._comm_since_timer = True
@@ -137,6 +229,8 @@ def main():
     display = DroneVideoDisplay()
     display.show()
     app.exec_()
+    rospy.loginfo("Showed {shown} images. {dropped} images were dropped."
+                  .format(shown=display.n_shown, dropped=display.n_dropped))
     rospy.spin()
 
 
@@ -7,23 +7,110 @@ Reduce /ardrone/image_color framerate from 30 Hz to 2 Hz.
 from __future__ import division
 
 import rospy
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
+from geometry_msgs.msg import PoseStamped
 from sensor_msgs.msg import Image
 
+from helpers import Pose
+
 
 class FramerateReducer(object):
     """
-    Reduces the framerate of a video feed to one fifteenth of the original.
+    Reduces the framerate of a video feed.
+
+    Frames are decimated in one of several modes:
+
+    - "count" publishes every `slowdown`-th frame. The output rate follows
+      the input rate.
+    - "rate" publishes frames at `output_rate` on average, however fast they
+      arrive.
+    - "interval" publishes frames at least `interval` apart.
+    - "pose" publishes a frame only if the drone has moved by more than
+      `thresh_distance` or turned by more than `thresh_yaw` since the last
+      frame published, so that every frame adds a new viewpoint. If neither
+      threshold is set, every frame with a known pose is published.
+
+    Times are taken from the stamps of the frames, or from the ROS clock if
+    the frames are not stamped.
+
+    Parameters
+    ----------
+    mode : Optional[str]
+        The decimation mode. Default is "count".
+    slowdown : Optional[int]
+        The number of frames received for each frame published, in "count"
+        mode. Default is 15.
+    output_rate : Optional[float]
+        The target output rate in "rate" mode, in Hz. Default is 2.
+    interval : Optional[float]
+        The shortest time between frames in "interval" mode, in seconds.
+        Default is 0.5.
+    thresh_distance : Optional[float]
+        The distance to move in "pose" mode, in metres. Default is None.
+    thresh_yaw : Optional[float]
+        The yaw to turn in "pose" mode, in radians. Default is None.
+
+    Attributes
+    ----------
+    mode : str
+        The decimation mode.
+    n_received : int
+        The number of frames received.
+    n_published : int
+        The number of frames published.
+
+    Raises
+    ------
+    ValueError
+        If the mode is unknown.
 
     """
-    def __init__(self):
+    modes = ("count", "rate", "interval", "pose")
+
+    def __init__(self, mode=None, slowdown=None, output_rate=None,
+                 interval=None, thresh_distance=None, thresh_yaw=None):
+        if mode is None:
+            mode = rospy.get_param("~mode", "count")
+        if slowdown is None:
+            slowdown = rospy.get_param("~slowdown", 15)  # times
+        if output_rate is None:
+            output_rate = rospy.get_param("~output_rate", 2)  # Hz
+        if interval is None:
+            interval = rospy.get_param("~interval", 0.5)  # s
+        if thresh_distance is None:
+            thresh_distance = rospy.get_param("~thresh_distance", None)  # m
+            if thresh_distance == "None":
+                thresh_distance = None
+        if thresh_yaw is None:
+            thresh_yaw = rospy.get_param("~thresh_yaw", None)  # rad
+            if thresh_yaw == "None":
+                thresh_yaw = None
+        if mode not in self.modes:
+            raise ValueError("Unknown decimation mode: {}".format(mode))
+
+        self.mode = mode
+        self.period = slowdown
+        self.interval = 1 / output_rate if mode == "rate" else interval
+        self.thresh_distance = thresh_distance
+        self.thresh_yaw = thresh_yaw
+
+        self.count = 0
+        self.n_received = 0
+        self.n_published = 0
+        self.pose = None
+        self._published_pose = None
+        self._next_time = None
+        self._last_report = None
+
         self.image_subscriber = rospy.Subscriber("/ardrone/image_color",
                                                  Image, self.frame_callback,
                                                  queue_size=1)
+        if mode == "pose":
+            rospy.Subscriber("/ardrone/pose", PoseStamped, self.pose_callback,
+                             queue_size=1)
         self.image_publisher = rospy.Publisher("/ardrone/slow_image_raw",
                                                Image, queue_size=1)
         rospy.logdebug("Subscribed to /ardrone/image_color")
-        self.period = rospy.get_param("slowdown", 15)  # times
-        self.count = 0
 
     def frame_callback(self, frame):
         """
@@ -35,10 +122,170 @@ class FramerateReducer(object):
             A newly arrived image.
 
         """
-        # Publish at the reduced rate.
-        if not self.count % self.period:
+        self.n_received += 1
+        if self.mode == "count":
+            publish = not self.count % self.period
+            self.count += 1
+        elif self.mode == "pose":
+            publish = self.moved
+        else:
+            publish = self._is_due(self._stamp(frame))
+
+        if publish:
             self.image_publisher.publish(frame)
-        self.count += 1
+            self.n_published += 1
+            self._published_pose = self.pose
+
+    def pose_callback(self, pose_stamped):
+        """
+        Update `pose`.
+
+        Parameters
+        ----------
+        pose_stamped : PoseStamped
+            A pose message.
+
+        """
+        self.pose = Pose(pose_stamped)
+
+    @property
+    def moved(self):
+        """
+        Check if the drone has moved significantly since the last frame was
+        published.
+
+        If there are no thresholds, return True once a pose is known.
+
+        Returns
+        -------
+        bool
+            Whether the drone has moved.
+
+        """
+        if self.pose is None:
+            return False
+        if self._published_pose is None:
+            return True
+        if (self.thresh_distance is None) and (self.thresh_yaw is None):
+            return True
+
+        if self.thresh_distance is not None:
+            if self._published_pose.distance(self.pose) > self.thresh_distance:
+                return True
+        if self.thresh_yaw is not None:
+            yaw = self._published_pose.rel_euler(self.pose)[2]
+            if abs(yaw) > self.thresh_yaw:
+                return True
+        return False
+
+    def _is_due(self, now):
+        """
+        Check whether a frame should be published at a given time.
+
+        In "rate" mode, the times at which frames are due are spaced evenly,
+        so that jitter in the input does not lower the output rate. After a
+        gap in the input, the next frame is published immediately, without a
+        burst to catch up.
+
+        Parameters
+        ----------
+        now : float
+            The time of the frame, in seconds.
+
+        Returns
+        -------
+        bool
+            Whether the frame should be published.
+
+        """
+        if self._next_time is not None and now < self._next_time:
+            return False
+        if self.mode == "rate" and self._next_time is not None:
+            self._next_time = max(self._next_time + self.interval, now)
+        else:
+            self._next_time = now + self.interval
+        return True
+
+    @staticmethod
+    def _stamp(frame):
+        """
+        Get the time of a frame.
+
+        Parameters
+        ----------
+        frame : Image
+            The image.
+
+        Returns
+        -------
+        float
+            The stamp of the frame, or the current time if it is not stamped,
+            in seconds.
+
+        """
+        stamp = frame.header.stamp.to_sec()
+        return stamp if stamp else rospy.Time.now().to_sec()
+
+    def rates(self):
+        """
+        Measure the input and output rates since the last measurement.
+
+        Returns
+        -------
+        tuple[float, float] | None
+            The input and output rates, in Hz. None for the first
+            measurement, which only starts the count.
+
+        """
+        now = rospy.Time.now().to_sec()
+        last, self._last_report = (self._last_report,
+                                   (now, self.n_received, self.n_published))
+        if last is None or now <= last[0]:
+            return None
+        elapsed = now - last[0]
+        return ((self.n_received - last[1]) / elapsed,
+                (self.n_published - last[2]) / elapsed)
+
+    def report_rates(self, period=5):
+        """
+        Regularly publish the input and output rates on /diagnostics, and log
+        them.
+
+        Parameters
+        ----------
+        period : Optional[float]
+            The time between reports, in seconds. Default is 5.
+
+        Returns
+        -------
+        rospy.Timer
+            The timer which triggers the reports.
+
+        """
+        publisher = rospy.Publisher("/diagnostics", DiagnosticArray,
+                                    queue_size=1)
+        self.rates()
+
+        def report(event):
+            rates = self.rates()
+            if rates is None:
+                return
+            message = "input {:.1f} Hz, output {:.1f} Hz".format(*rates)
+            status = DiagnosticStatus(
+                level=DiagnosticStatus.OK,
+                name="framerate_reducer: rates",
+                message=message,
+                values=[KeyValue("mode", self.mode),
+                        KeyValue("input_hz", "{:.3f}".format(rates[0])),
+                        KeyValue("output_hz", "{:.3f}".format(rates[1])),
+                        KeyValue("received", str(self.n_received)),
+                        KeyValue("published", str(self.n_published))])
+            array = DiagnosticArray(status=[status])
+            array.header.stamp = rospy.Time.now()
+            publisher.publish(array)
+            rospy.loginfo("Frame rates: " + message)
+
+        return rospy.Timer(rospy.Duration(period), report)
 
 
 def main():
@@ -47,9 +294,15 @@ def main():
 
     """
     rospy.init_node("framerate_reducer", anonymous=True)
-    FramerateReducer()
-    rospy.loginfo("Reducing framerate")
+    reducer = FramerateReducer()
+    period = rospy.get_param("~rate_report_period", 5)
+    if period not in (None, "None"):
+        reducer.report_rates(period)
+    rospy.loginfo("Reducing framerate ({mode} mode)".format(mode=reducer.mode))
     rospy.spin()
+    rospy.loginfo("Published {published} of {received} frames."
+                  .format(published=reducer.n_published,
+                          received=reducer.n_received))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,1435 @@
+# -*- coding: utf-8 -*-
+"""
+Render the drone over past images for SPIRIT.
+
+The scene is drawn by `Screen`, which does not depend on the window used.
+Each window backend is a subclass which only creates the OpenGL context,
+handles window events, and presents the frames:
+
+- `PygameScreen` shows the scene in a pygame window.
+- `QtScreen` shows the scene in a Qt widget.
+- `OffscreenScreen` draws into an offscreen buffer, without a display.
+
+The visualizer scripts choose a backend from `BACKENDS`.
+
+"""
+from __future__ import division
+
+from collections import deque
+import os
+import sys
+import time
+import timeit
+import threading
+
+from cv_bridge import CvBridge
+import numpy as np
+from OpenGL import GL, GLU, GLUT
+
+import pygame as pg
+
+try:
+    from PyQt5 import QtCore, QtGui, QtWidgets
+except ImportError:
+    QtWidgets = None
+
+import rospkg
+import rospy
+from geometry_msgs.msg import PoseStamped
+from sensor_msgs.msg import Image
+from std_msgs.msg import Bool
+
+from helpers import (Pose, Fov, Quat, ImageDecoder, LatencyTracer,
+                     RenderScheduler, d2r, report_latency, unit_vector)
+from opengl_helpers import (gl_font, gl_flag, gl_ortho, gl_primitive,
+                            gl_read_pixels, new_matrix, OffscreenContext,
+                            Shape, StreamingTexture, TextCache)
+
+
+os.chdir(rospkg.RosPack().get_path("spirit"))
+
+# Convenience
+gl = GL
+glu = GLU
+glut = GLUT
+
+
+class Drone(Shape):
+    """
+    A shape representing the drone.
+
+    This assumes that the drone is square-shaped, with a set height. An arrow is
+    drawn at the top of the drone, and coloured with navigation lights. (i.e.
+    there is a red light on the left, and a green light on the right.)
+
+    Parameters
+    ----------
+    size : Optional[float]
+        The side of each of the drone's square sides. Default is 50 cm.
+    height : Optional[float]
+        The height of the drone. Default is 15 cm.
+
+    Attributes
+    ----------
+    vertices
+    colours
+    edges
+    surfaces
+    arrow_vertices : Sequence[Sequence[float]]
+        A sequence of 3D coordinates representing the vertices on the arrow.
+    arrow_colours_l : Sequence[Sequence[float]]
+        A sequence of RGB values between 0 and 1, assigned to vertices of the
+        left half of the arrow.
+    arrow_edges_l : Sequence[Sequence[int]]
+        A sequence of 2-tuple representing the indices of the vertices of the
+        left side of the arrow to be joined.
+    arrow_surfaces_l : Sequence[Sequence[int]]
+        A sequence of the list of indices of vertices forming the left side of
+        the arrow, in order.
+    arrow_colours_r : Sequence[Sequence[float]]
+        A sequence of RGB values between 0 and 1, assigned to vertices of the
+        right half of the arrow.
+    arrow_edges_r : Sequence[Sequence[int]]
+        A sequence of 2-tuple representing the indices of the vertices of the
+        right side of the arrow to be joined.
+    arrow_surfaces_r : Sequence[Sequence[int]]
+        A sequence of the list of indices of vertices forming the right side of
+        the arrow, in order.
+
+    See Also
+    --------
+    Shape
+
+    """
+    def __init__(self, size=0.3, height=0.13):
+        offset = [0, 0, size]
+
+        self.vertices = np.array([
+            (1, -1, -1), (1, 1, -1),
+            (-1, 1, -1), (-1, -1, -1),
+            (1, -1, 1), (1, 1, 1),
+            (-1, -1, 1), (-1, 1, 1),
+        ]) * size
+        self.vertices += offset
+        self.vertices[:, 1] *= height
+
+        colours = (
+            (0.5, 0.5, 0.5),
+        )
+
+        edges = (
+            (0, 1), (0, 3), (0, 4),
+            (2, 1), (2, 3), (2, 7),
+            (6, 3), (6, 4), (6, 7),
+            (5, 1), (5, 4), (5, 7),
+        )
+
+        surfaces = (
+            # (0, 1, 2, 3),
+            # (3, 2, 7, 6),
+            # (6, 7, 5, 4),
+            # (4, 5, 1, 0),
+            # (1, 5, 7, 2),
+            # (4, 0, 3, 6),
+        )
+
+        super(Drone, self).__init__(self.vertices, colours, edges, surfaces)
+
+        self.arrow_vertices = np.array([
+            (-1, 1, 1), (0, 1, -1), (1, 1, 1), (0, 1, 0),
+            (-1, -1, 1), (0, -1, -1), (1, -1, 1), (0, -1, 0),
+        ]) * size
+        self.arrow_vertices += offset
+        self.arrow_vertices[:, 1] *= height
+
+        self.arrow_colours = (
+            (
+                (1, 0, 0),  # Red on left
+                (1, 1, 1),  # White in front
+                (0.7, 0, 0),  # Dark red in back
+            ),
+            (
+                (0, 1, 0),  # Green on right
+                (1, 1, 1),  # White in front
+                (0, 0.7, 0),  # Dark green in back
+            ),
+        )
+        self.arrow_edges = (
+            (
+                (1, 0),
+                (0, 3),
+            ),
+            (
+                (1, 2),
+                (2, 3),
+            ),
+        )
+        self.arrow_surfaces = (
+            (
+                (0, 1, 3, 0),
+            ),
+            (
+                (2, 1, 3, 2),
+            ),
+        )
+
+        self.surf_colours = (
+            (
+                (0.9, 0, 0),
+                (1, 0, 0),
+                (0.7, 0, 0),
+                (0.7, 0, 0),
+            ),
+            (
+                (0, 0.7, 0),
+                (0, 0.7, 0),
+                (0, 1, 0),
+                (0, 0.9, 0),
+            ),
+        )
+
+        self.surf_surfaces = (
+            # (0, 1, 2, 3),
+            ((3, 2, 7, 6),),
+            ((4, 5, 1, 0),),
+        )
+
+    def _draw_geometry(self, edge_colour):
+        """
+        Draw the body and the arrow of the drone.
+
+        Parameters
+        ----------
+        edge_colour : Sequence[float]
+            The colour to draw the edges in.
+
+        """
+        super(Drone, self)._draw_geometry(edge_colour)
+
+        # Draw arrow
+        for colour, surface in zip(self.surf_colours, self.surf_surfaces):
+            self._draw_components(self.vertices, colour,
+                                  (), surface, edge_colour)
+        for colours, edges, surfaces in zip(self.arrow_colours,
+                                            self.arrow_edges,
+                                            self.arrow_surfaces):
+            self._draw_components(self.arrow_vertices, colours,
+                                  edges, surfaces,
+                                  edge_colour)
+
+
+class TexturesBase(object):
+    """
+    Implements methods which allow usage of textures.
+
+    Image data starts from the top row, and is flipped when it is drawn
+    instead of when it is loaded. Image messages are converted by `decoder`,
+    on its own thread, so that neither ROS callbacks nor drawing wait for
+    them.
+
+    Attributes
+    ----------
+    textures : Sequence[gl.GLuint]
+        A list of usable textures.
+    decoder : ImageDecoder
+        Converts the newest image message.
+    n_dropped
+
+    """
+    def setup_textures(self, decoded_callback=None):
+        """
+        Set up texture variables.
+
+        Parameters
+        ----------
+        decoded_callback : Optional[callable]
+            Called without arguments from the decoding thread whenever an
+            image message has been converted.
+
+        """
+        self.textures = deque(maxlen=2)
+        self._bridge = CvBridge()
+        self.decoder = ImageDecoder(fallback=self._convert_with_bridge,
+                                    callback=decoded_callback)
+        self._latest_texture = deque(maxlen=1)
+        self._n_dropped_files = 0
+        self._stream = None
+
+    @property
+    def n_dropped(self):
+        """
+        The number of images which were replaced by a newer image before being
+        used.
+
+        Returns
+        -------
+        int
+            The number of images dropped.
+
+        """
+        return self._n_dropped_files + self.decoder.n_dropped
+
+    def add_textures(self, *images):
+        """
+        Add images to the list of usable textures.
+
+        Files are loaded immediately. Image messages are converted in the
+        background, and only the newest one is used.
+
+        Parameters
+        ----------
+        images : Sequence[str | Image]
+            A list of filenames or images to load.
+
+        Raises
+        ------
+        pygame.error
+            If the image cannot be loaded, or if the image format is not
+            supported.
+        TypeError
+            If the input type is unsupported.
+
+        """
+        for image in images:
+            if isinstance(image, Image):
+                self.decoder.submit(image)
+                continue
+            for texture in self.load_images([image]):
+                if self._latest_texture:
+                    self._n_dropped_files += 1
+                self._latest_texture.append(texture)
+
+    def take_texture(self):
+        """
+        Take the newest image which has not been used yet.
+
+        Returns
+        -------
+        tuple[np.ndarray, int, int] | None
+            The image data, the width, and the height of the image. None if
+            there is no new image.
+
+        """
+        texture = self.decoder.take()
+        if texture is not None:
+            self._latest_texture.clear()
+            return texture
+        try:
+            return self._latest_texture.pop()
+        except IndexError:
+            return None
+
+    def select_texture(self, texture_number=1):
+        """
+        Bind a known texture for use.
+
+        Parameters
+        ----------
+        texture_number : Optional[int]
+            The number of the texture, by the order it was added. Default is the
+            latest texture.
+
+        Raises
+        ------
+        IndexError
+            If `texture_number` is larger than the number of available textures.
+
+        """
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.textures[texture_number])
+
+    def init_texture(self, texture_data, width, height, texture_number=1):
+        """
+        Initialize a texture for first use.
+
+        Parameters
+        ----------
+        texture_data : Sequence
+            The image data.
+        width : int
+            The width of the image.
+        height : int
+            The height of the image.
+        texture_number : Optional[int]
+            The number of the texture, by the order it was added. Default is the
+            latest texture.
+
+        Raises
+        ------
+        IndexError
+            If `texture_number` is larger than the number of available textures.
+
+        """
+        self.textures.append(gl.glGenTextures(1))
+        self.select_texture(texture_number)
+        gl.glTexParameter(target=gl.GL_TEXTURE_2D,
+                          pname=gl.GL_TEXTURE_MIN_FILTER,
+                          parameter=gl.GL_LINEAR)
+        # Implementation does not accept kwargs. Order is target, level,
+        # internalFormat, width, height, border, format, type, and pixels.
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGB, width, height, 0,
+                        gl.GL_RGB, gl.GL_UNSIGNED_BYTE, texture_data)
+
+    def update_texture(self, texture_data, width, height, texture_number=1):
+        """
+        Update the streaming texture, creating it if needed.
+
+        The texture is recreated if the size of the image changes.
+
+        Parameters
+        ----------
+        texture_data : np.ndarray
+            The image data.
+        width : int
+            The width of the image.
+        height : int
+            The height of the image.
+        texture_number : Optional[int]
+            The number of the texture, by the order it was added. Default is the
+            latest texture.
+
+        """
+        stream = self._stream
+        if stream is None or (stream.width, stream.height) != (width, height):
+            if stream is not None:
+                stream.delete()
+            stream = self._stream = StreamingTexture(width, height)
+            if texture_number < len(self.textures):
+                self.textures[texture_number] = stream.texture
+            else:
+                self.textures.append(stream.texture)
+        stream.upload(texture_data)
+
+    def load_images(self, images):
+        """
+        Load images.
+
+        Parameters
+        ----------
+        images : Sequence[str | Image]
+            A list of filenames or images to load.
+
+        Yields
+        ------
+        np.ndarray
+            The image data.
+        int
+            The width of the image.
+        int
+            The height of the image.
+
+        Raises
+        ------
+        pygame.error
+            If the image cannot be loaded, or if the image format is not
+            supported.
+        TypeError
+            If the input type is unsupported.
+
+        """
+        for image in images:
+            if isinstance(image, str):
+                yield self._load_image_from_file(image)
+            elif isinstance(image, Image):
+                yield self._load_image_from_ros(image)
+            else:
+                raise TypeError("Cannot load image.")
+
+    @staticmethod
+    def _load_image_from_file(filename):
+        """
+        Load image from file.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the file to be loaded.
+
+        Returns
+        -------
+        np.ndarray
+            The image data.
+        int
+            The width of the image.
+        int
+            The height of the image.
+
+        Raises
+        ------
+        pygame.error
+            If the image cannot be loaded, or if the image format is not
+            supported.
+
+        """
+        img = pg.image.load(filename)
+        width, height = img.get_width(), img.get_height()
+        texture_data = np.frombuffer(pg.image.tostring(img, "RGB"),
+                                     dtype=np.uint8).reshape(height, width, 3)
+        return texture_data, width, height
+
+    def _load_image_from_ros(self, image):
+        """
+        Load image from a ROS topic.
+
+        Parameters
+        ----------
+        image : Image
+            The Image to be loaded.
+
+        Returns
+        -------
+        np.ndarray
+            The image data.
+        int
+            The width of the image.
+        int
+            The height of the image.
+
+        """
+        return self._convert_with_bridge(image), image.width, image.height
+
+    def _convert_with_bridge(self, image):
+        """
+        Convert an image message to RGB with cv_bridge.
+
+        Parameters
+        ----------
+        image : Image
+            The image to be converted.
+
+        Returns
+        -------
+        np.ndarray
+            The image data.
+
+        """
+        return self._bridge.imgmsg_to_cv2(image, "rgb8")
+
+
+class RendererBase(TexturesBase):
+    """
+    Implements methods which enable rendering the scene.
+
+    Attributes
+    ----------
+    textures
+    size : np.ndarray[int]
+        The width and height of the display, in pixels.
+    width : int
+        The width of the display, in pixels.
+    height : int
+        The height of the display, in pixels.
+    model : Shape
+        The model to draw.
+    distance : float | None
+        The distance at which to draw. If provided, the visualization can be
+        zoomed in or out.
+    fov_x : float
+        The horizontal field of view, in degrees.
+    fov_y : float
+        The vertical field of view, in degrees.
+
+    """
+    def setup_renderer(self, size, model, distance,
+                       fov_diagonal=None, fov_vertical=None):
+        """
+        Set up rendering parameters.
+
+        `fov_vertical` and `fov_diagonal` are mutually exclusive. If neither is
+        specified, the default vertical field of view is set to 45 degrees.
+
+        Parameters
+        ----------
+        size : Sequence[int]
+            The width and height of the display, in pixels.
+        model : Shape
+            The model to be drawn.
+        distance : float | None
+            The distance at which to draw. If provided, the visualization can be
+            zoomed in or out.
+        fov_vertical : Optional[float]
+            The vertical size of the field of view, in degrees.
+        fov_diagonal : Optional[float]
+            The diagonal size of the field of view, in degrees.
+
+        Raises
+        ------
+        TypeError
+            If both `fov_vertical` and `fov_diagonal` are provided.
+
+        """
+        if fov_diagonal and fov_vertical:
+            raise TypeError("Enter only one value for field of view size.")
+
+        self.size = self.width, self.height = np.asarray(size)
+        self.aspect_ratio = self.width / self.height
+        self.model = model
+        self.distance = distance
+
+        self.text = {}
+        self._text_cache = TextCache()
+        self._background_list = None
+
+        self.pose_cam = self.pose_drone = None
+
+        if fov_vertical is not None:
+            self.fov_y = fov_vertical
+        elif fov_diagonal is not None:
+            self.fov_y = Fov.d2v(fov_diagonal, self.aspect_ratio)
+        else:
+            self.fov_y = 45
+        self.fov_x = Fov.v2h(self.fov_y, self.aspect_ratio)
+        self._image_distance = self.height / (2 * np.tan(d2r(self.fov_y) / 2))
+
+    @staticmethod
+    def _glize_angle(quaternion):
+        """
+        Change a quaternion to OpenGL format.
+
+        Parameters
+        ----------
+        quaternion : Sequence[float]
+            A quaternion in x, y, z, w format.
+
+        Returns
+        -------
+        Sequence[float]
+            The quaternion in OpenGL format.
+
+        """
+        quaternion = quaternion.copy()
+        quaternion[0] *= -1
+        quaternion[1], quaternion[2] = quaternion[2], quaternion[1]
+        return quaternion
+
+    def render(self, pose_cam, pose_drone):
+        """
+        Render the scene.
+
+        Parameters
+        ----------
+        pose_cam : Pose
+            The pose of the drone when the background image was taken.
+        pose_drone : Pose
+            The current pose of the drone.
+
+        """
+        rel_pos = pose_cam.position - pose_drone.position
+        rot_cam = self._glize_angle(pose_cam.orientation)
+        rot_drone = self._glize_angle(pose_drone.orientation)
+        rot_cam[:3] *= -1  # z-axis is with respect to origin, not camera.
+
+        # Draw the drone at a constant distance, and zoom the background to
+        # match.
+        if self.distance:
+            scale = np.linalg.norm(rel_pos) / self.distance
+            rel_pos = unit_vector(rel_pos) * self.distance
+        else:
+            scale = 1
+
+        # Convert position to OpenGL coordinate frame.
+        translation = np.array([rel_pos[0], -rel_pos[2], -rel_pos[1]])
+        centre = self._find_drone_on_image(self._rotate(rot_cam, translation))
+
+        with new_matrix():
+            # Set camera orientation.
+            gl.glRotate(*Quat.to_axis(rot_cam))
+
+            # Set camera position.
+            gl.glTranslate(*translation)
+
+            self.draw_background(scale=scale, centre=centre)
+            self.model.draw(rot_drone)
+
+    def draw_background(self, texture_number=1, scale=1, centre=None,
+                        rotation=0):
+        """
+        Draw the background image.
+
+        The image is drawn on a fixed quad covering the screen. Zoom is applied
+        by the texture matrix, so no vertices are recomputed. When zoomed out,
+        the image is surrounded by its black border.
+
+        Parameters
+        ----------
+        texture_number : Optional[int]
+            The number of the texture, by the order it was added. Default is
+            the latest texture added.
+        scale : Optional[float]
+            The amount of zoom applied to the image. Default is no zoom.
+        centre : Optional[Sequence[float]]
+            The point which stays in place when zooming, in pixels from the
+            bottom left corner of the screen. Default is the centre of the
+            screen.
+        rotation : Optional[float]
+            The amount of clockwise rotation, in degrees. Default is no
+            rotation.
+
+        """
+        # Clear background
+        if texture_number != 0:
+            self.draw_background(texture_number=0)
+
+        try:
+            self.select_texture(texture_number)
+            if "no_texture" in self.text:
+                del self.text["no_texture"]
+        except IndexError:
+            self.text["no_texture"] = ("No textures yet", None, None, (1, 0, 0))
+            return
+
+        if centre is None:
+            centre = self.size / 2
+        centre_u, centre_v = np.asarray(centre) / self.size
+
+        with gl_flag(gl.GL_TEXTURE_2D):
+            # The texture matrix maps the screen to the image, so it is the
+            # inverse of the zoom.
+            with new_matrix(gl.GL_TEXTURE, gl.GL_MODELVIEW):
+                gl.glLoadIdentity()
+                gl.glTranslate(0, 1, 0)  # Images start at the top.
+                gl.glScale(1, -1, 1)
+                gl.glTranslate(centre_u, centre_v, 0)
+                gl.glScale(1 / scale, 1 / scale, 1)
+                gl.glTranslate(-centre_u, -centre_v, 0)
+
+                gl.glMatrixMode(gl.GL_MODELVIEW)
+                with gl_ortho(self.width, self.height):
+                    gl.glRotate(rotation, 0, 0, 1)
+                    gl.glCallList(self._background_quad())
+                gl.glMatrixMode(gl.GL_TEXTURE)
+
+    def _background_quad(self):
+        """
+        Compile the quad covering the screen, the first time it is needed.
+
+        Returns
+        -------
+        int
+            The display list of the quad.
+
+        """
+        if self._background_list is None:
+            self._background_list = gl.glGenLists(1)
+            gl.glNewList(self._background_list, gl.GL_COMPILE)
+            with gl_primitive(gl.GL_QUADS):
+                for x, y in ((0, 0), (0, 1), (1, 1), (1, 0)):
+                    gl.glTexCoord2f(x, y)
+                    gl.glVertex((x - 0.5) * self.width,
+                                (y - 0.5) * self.height, 0)
+            gl.glEndList()
+        return self._background_list
+
+    def write_text(self, text, position=None, font=gl_font("fixed", 13),
+                   colour=(0, 1, 0)):
+        """
+        Write text on the screen.
+
+        The text is rasterized the first time it is written in a given font
+        and colour, and the texture is reused afterwards.
+
+        Parameters
+        ----------
+        text : str
+            The text to write.
+        position : Optional[Sequence[int]]
+            A sequence containing the horizontal and vertical positions, in
+            pixels, of the lower left pixel of the first line of the text.
+            Default is 40% of the screen right of centre, and 80% of the screen
+            above centre.
+        font : Optional[ctypes.c_void_p]
+            The font to use. Default is 13-point Fixed.
+        colour : Optional[Sequence[float]]
+            The text colour, as RGB values between 0 and 1. Default is green.
+
+        """
+        if position is None:
+            x = self.width * 0.2
+            y = self.height * 0.4
+        else:
+            x, y = position
+        with gl_ortho(self.width, self.height):
+            self._text_cache.draw(text, x, y, font, colour)
+
+    @staticmethod
+    def _rotate(quaternion, vector):
+        """
+        Rotate a vector by a quaternion, as `glRotate` would.
+
+        Parameters
+        ----------
+        quaternion : np.ndarray
+            A quaternion in x, y, z, w format.
+        vector : np.ndarray
+            The vector to rotate.
+
+        Returns
+        -------
+        np.ndarray
+            The rotated vector.
+
+        """
+        quaternion = unit_vector(quaternion)
+        axis, w = quaternion[:3], quaternion[3]
+        cross = np.cross(axis, vector)
+        return vector + 2 * (w * cross + np.cross(axis, cross))
+
+    def _find_drone_on_image(self, position):
+        """
+        Find the location of the drone on the image.
+
+        The drone is projected with the field of view of the screen.
+
+        Parameters
+        ----------
+        position : np.ndarray
+            A 3-array with the x, y, and z positions of the drone relative to
+            the camera, in the OpenGL camera frame.
+
+        Returns
+        -------
+        centre_x : float
+            The horizontal location of the drone, in pixels from the left.
+        centre_y : float
+            The vertical location of the drone, in pixels from the bottom.
+            If the drone is behind the camera, the centre of the image is
+            returned.
+
+        """
+        x, y, z = position
+        if z >= 0:
+            return self.width / 2, self.height / 2
+        centre_x = self.width / 2 + self._image_distance * x / -z
+        centre_y = self.height / 2 + self._image_distance * y / -z
+        return centre_x, centre_y
+
+
+class Screen(RendererBase):
+    """
+    Base class for showing the scene, independently of the window used.
+
+    Subclasses create the OpenGL context in `start`, and present the frames
+    drawn by `draw_frame`.
+
+    `fov_vertical` and `fov_diagonal` are mutually exclusive. If neither is
+    specified, the default vertical field of view is set to 45 degrees.
+
+
+    Parameters
+    ----------
+    size : Sequence[int]
+        The width and height of the display, in pixels.
+    model : Shape
+        The model to be drawn.
+    fov_vertical : Optional[float]
+        The vertical size of the field of view, in degrees.
+    fov_diagonal : Optional[float]
+        The diagonal size of the field of view, in degrees.
+    wait : Optional[int]
+        The longest time to wait for new data before handling window events,
+        in milliseconds. Default is 100.
+    distance : Optional[float]
+        The distance at which to draw. If provided, the visualization can be
+        zoomed in or out. Default is to have no zoom.
+    max_fps : Optional[float]
+        The maximum number of frames per second. Default is no limit.
+    vsync : Optional[bool]
+        Whether to synchronize buffer swaps with the display refresh, if
+        supported. Default is False.
+
+    Attributes
+    ----------
+    textures
+    size
+    width
+    height
+    model
+    distance
+    fov_x
+    fov_y
+    wait : int
+        The longest time to wait for new data before handling window events,
+        in milliseconds.
+    vsync : bool
+        Whether to synchronize buffer swaps with the display refresh.
+    scheduler : RenderScheduler
+        Decides when to redraw. Call ``scheduler.request()`` after changing
+        what is shown.
+    tracer : LatencyTracer
+        The latency of each stage. "receive" is when the drone pose arrived,
+        "upload" and "render" are how long they took, and "flip" is when the
+        frame showing the drone pose was displayed, from the stamp of the
+        pose.
+    is_active : bool
+        Whether the screen is still shown.
+
+    Raises
+    ------
+    TypeError
+        If both `fov_vertical` and `fov_diagonal` are provided.
+
+    """
+    def __init__(self, size, model, fov_vertical=None, fov_diagonal=None,
+                 wait=100, distance=None, max_fps=None, vsync=False):
+        self.scheduler = RenderScheduler(max_fps)
+        self.setup_textures(decoded_callback=self.scheduler.request)
+        self.setup_renderer(size, model, distance, fov_diagonal, fov_vertical)
+
+        self.wait = wait
+        self.vsync = vsync
+        self.tracer = LatencyTracer()
+        self.is_active = True
+
+    def start(self):
+        """
+        Create the OpenGL context, and set up the scene.
+
+        """
+        raise NotImplementedError
+
+    def run(self):
+        """
+        Show the screen, redrawing it when new data is available, until it is
+        closed or stopped.
+
+        """
+        raise NotImplementedError
+
+    def render_frame(self, read=False):
+        """
+        Draw and present one frame immediately, after `start`.
+
+        Parameters
+        ----------
+        read : Optional[bool]
+            Whether to read back the frame. Default is False.
+
+        Returns
+        -------
+        np.ndarray | None
+            If `read` is True, a (height, width, 3) array of RGB values,
+            starting from the top row.
+
+        """
+        raise NotImplementedError
+
+    def stop(self):
+        """
+        Stop running the screen. This can be called from any thread.
+
+        """
+        self.is_active = False
+
+    def close(self):
+        """
+        Release the textures and the model.
+
+        The OpenGL context must be current.
+
+        """
+        self.decoder.close()
+        if self._stream is not None:
+            self._stream.delete()
+            self._stream = None
+        self._text_cache.clear()
+        if self._background_list is not None:
+            gl.glDeleteLists(self._background_list, 1)
+            self._background_list = None
+        self.model.delete()
+        self.is_active = False
+
+    def setup_scene(self):
+        """
+        Set up the perspective and the blank background.
+
+        An OpenGL context must be current.
+
+        """
+        if not pg.font.get_init():
+            pg.font.init()
+        self.set_perspective()
+        self.add_textures("media/blank.png")
+        self.init_texture(*self._latest_texture.pop(), texture_number=0)
+        self.scheduler.request()
+
+    def draw_frame(self):
+        """
+        Upload the newest background, and draw the scene.
+
+        Nothing is displayed until the buffers are swapped.
+
+        Returns
+        -------
+        bool
+            Whether both poses were available. If not, a message is drawn
+            instead of the scene.
+
+        """
+        texture = self.take_texture()
+        if texture is not None:
+            with self.tracer.timed("upload"):
+                self.update_texture(*texture)
+
+        start = timeit.default_timer()
+        self.clear()
+        try:
+            self.render(self.pose_cam, self.pose_drone)
+        except AttributeError:
+            self.write_text("No data yet", colour=(1, 0, 0))
+            return False
+
+        for text, position, font, colour in self.text.values():
+            kwargs = {"text": text,
+                      "position": position,
+                      "font": font,
+                      "colour": colour}
+            self.write_text(**{k: v for k, v in kwargs.items()
+                               if v is not None})
+        self.tracer.record("render", timeit.default_timer() - start)
+        return True
+
+    def set_perspective(self, near=0.1, far=100):
+        """
+        Set up the perspective projection matrix.
+
+        Parameters
+        ----------
+        near : Optional[float]
+            The distance to the near clipping plane in the z-direction. Default
+            is 10 cm.
+        far : Optional[float]
+            The distance to the far clipping plane in the z-direction. Default
+            is 100 m.
+
+        """
+        glu.gluPerspective(self.fov_y, self.aspect_ratio, near, far)
+
+    @staticmethod
+    def clear():
+        """
+        Reset OpenGL buffers to preset values.
+
+        """
+        gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+
+
+class PygameScreen(Screen):
+    """
+    Show the scene in a pygame window.
+
+    """
+    def start(self):
+        """
+        Open the window, and set up the scene.
+
+        """
+        pg.init()
+        glut.glutInit()
+        pg.display.set_caption("Past Image Viewer")
+        if self.vsync and hasattr(pg, "GL_SWAP_CONTROL"):
+            pg.display.gl_set_attribute(pg.GL_SWAP_CONTROL, 1)
+        pg.display.set_mode(self.size, pg.OPENGL)
+        self.setup_scene()
+
+    def run(self):
+        """
+        Run the display.
+
+        The screen is only redrawn when new data is available, or when the
+        window needs it.
+
+        """
+        self.start()
+        while self.is_active:
+            redraw = self.scheduler.wait(self.wait / 1000)
+            try:
+                self.step(redraw)
+            except pg.error as e:
+                rospy.logerr("Display error: {}".format(e))
+                self.is_active = False
+        pg.quit()
+
+    def step(self, redraw=True):
+        """
+        Handle window events, and show one frame if needed.
+
+        Parameters
+        ----------
+        redraw : Optional[bool]
+            Whether new data needs to be shown. Default is True.
+
+        """
+        for event in pg.event.get():
+            if event.type == pg.QUIT:
+                self.is_active = False
+                return
+            elif event.type in (pg.VIDEOEXPOSE, pg.ACTIVEEVENT):
+                redraw = True
+
+        if not redraw:
+            return
+
+        drawn = self.draw_frame()
+        pg.display.flip()
+        if drawn:
+            self.tracer.since("flip", self.pose_drone.header.stamp)
+
+    def render_frame(self, read=False):
+        pg.event.pump()
+        self.draw_frame()
+        pixels = gl_read_pixels(*self.size) if read else None
+        pg.display.flip()
+        return pixels
+
+    def close(self):
+        super(PygameScreen, self).close()
+        pg.quit()
+
+
+if QtWidgets is not None:
+    class _QtCanvas(QtWidgets.QOpenGLWidget):
+        """
+        A widget which draws a screen.
+
+        Parameters
+        ----------
+        screen : QtScreen
+            The screen to draw.
+
+        """
+        redraw_requested = QtCore.pyqtSignal()
+
+        def __init__(self, screen):
+            super(_QtCanvas, self).__init__()
+            self.screen = screen
+            self._drawn = False
+
+            surface_format = QtGui.QSurfaceFormat()
+            surface_format.setSwapInterval(1 if screen.vsync else 0)
+            self.setFormat(surface_format)
+            self.setFixedSize(*[int(i) for i in screen.size])
+            self.setWindowTitle("Past Image Viewer")
+
+            # Signals emitted from other threads are queued to this one.
+            self.redraw_requested.connect(self.update)
+            self.frameSwapped.connect(self._trace_flip)
+
+        def initializeGL(self):
+            self.screen.setup_scene()
+
+        def paintGL(self):
+            self._drawn = self.screen.draw_frame()
+
+        def closeEvent(self, event):
+            self.screen.is_active = False
+            super(_QtCanvas, self).closeEvent(event)
+
+        def _trace_flip(self):
+            if self._drawn:
+                self.screen.tracer.since("flip",
+                                         self.screen.pose_drone.header.stamp)
+
+
+class QtScreen(Screen):
+    """
+    Show the scene in a Qt widget.
+
+    The screen must be run from the main thread. Qt repaints the widget
+    itself when the window needs it.
+
+    Raises
+    ------
+    RuntimeError
+        If PyQt5 is not installed, or, on `start`, if the widget cannot
+        create an OpenGL context.
+
+    """
+    def __init__(self, size, model, **kwargs):
+        if QtWidgets is None:
+            raise RuntimeError("The Qt backend needs PyQt5.")
+        super(QtScreen, self).__init__(size, model, **kwargs)
+        self._app = None
+        self._canvas = None
+
+    def start(self):
+        """
+        Show the widget, and set up the scene.
+
+        """
+        self._app = (QtWidgets.QApplication.instance()
+                     or QtWidgets.QApplication(sys.argv))
+        self._canvas = _QtCanvas(self)
+        # Showing the widget resizes it, which sets up its context.
+        self._canvas.show()
+        self._app.processEvents()
+        if not self._canvas.isValid():
+            raise RuntimeError("The Qt widget cannot create an OpenGL "
+                               "context on the {} platform."
+                               .format(self._app.platformName()))
+
+    def run(self):
+        """
+        Run the display.
+
+        Requests for redraws are waited for on another thread, and the
+        widget is repainted on this one.
+
+        """
+        self.start()
+        redraw_thread = threading.Thread(target=self._request_redraws,
+                                         name="redraw_requests")
+        redraw_thread.daemon = True
+        redraw_thread.start()
+        self._app.exec_()
+        self.is_active = False
+
+    def _request_redraws(self):
+        """
+        Ask the widget to repaint whenever new data is available.
+
+        """
+        while self.is_active:
+            if self.scheduler.wait(self.wait / 1000):
+                self._canvas.redraw_requested.emit()
+
+    def render_frame(self, read=False):
+        # The frame is drawn into the framebuffer of the widget, which is only
+        # bound while its context is current. Qt shows it when the widget is
+        # next repainted.
+        self._canvas.makeCurrent()
+        try:
+            self._canvas.paintGL()
+            if read:
+                return gl_read_pixels(*self.size)
+            gl.glFinish()
+        finally:
+            self._canvas.doneCurrent()
+
+    def stop(self):
+        super(QtScreen, self).stop()
+        if self._app is not None:
+            QtCore.QMetaObject.invokeMethod(self._app, "quit",
+                                            QtCore.Qt.QueuedConnection)
+
+    def close(self):
+        self._canvas.makeCurrent()
+        super(QtScreen, self).close()
+        self._canvas.doneCurrent()
+        self._canvas.close()
+
+
+class OffscreenScreen(Screen):
+    """
+    Draw the scene into an offscreen buffer instead of a window.
+
+    This allows the scene to be rendered headless, for regression and
+    throughput tests. Frames are only drawn by `render_frame`. See
+    `OffscreenContext` for the environment variables which select the
+    platform.
+
+    Attributes
+    ----------
+    context : OffscreenContext | None
+        The context drawn into, once started.
+
+    """
+    def __init__(self, size, model, **kwargs):
+        super(OffscreenScreen, self).__init__(size, model, **kwargs)
+        self.context = None
+
+    def start(self):
+        """
+        Create the offscreen context, and set up the scene.
+
+        Raises
+        ------
+        RuntimeError
+            If PyOpenGL is not using an offscreen platform.
+
+        """
+        self.context = OffscreenContext(*self.size)
+        self.setup_scene()
+
+    def run(self):
+        """
+        Draw each requested frame until stopped, without showing it.
+
+        """
+        self.start()
+        while self.is_active:
+            if self.scheduler.wait(self.wait / 1000):
+                self.render_frame()
+
+    def render_frame(self, read=False):
+        self.draw_frame()
+        if read:
+            return self.context.read_pixels()
+        gl.glFinish()
+
+    def close(self):
+        if self.context is None:
+            return
+        super(OffscreenScreen, self).close()
+        self.context.destroy()
+        self.context = None
+
+
+BACKENDS = {
+    "pygame": PygameScreen,
+    "qt": QtScreen,
+    "offscreen": OffscreenScreen,
+}
+
+
+class VisualizerBase(object):
+    def bg_callback(self, background):
+        # A redraw is requested once the image has been converted.
+        self.screen.add_textures(background)
+
+    def pose_cam_callback(self, pose_cam):
+        self.screen.pose_cam = Pose(pose_cam)
+        self.screen.scheduler.request()
+
+    def pose_drone_callback(self, pose_drone):
+        self.screen.tracer.since("receive", pose_drone.header.stamp)
+        self.screen.pose_drone = Pose(pose_drone)
+        self.screen.scheduler.request()
+
+    def tracked_callback(self, tracked):
+        self.tracked = tracked.data
+        if not self.tracked:
+            self.screen.text["tracking"] = ("Tracking lost", None,
+                                            gl_font("helvetica", 18), (1, 0, 0))
+        elif "tracking" in self.screen.text:
+            del self.screen.text["tracking"]
+        else:
+            return
+        self.screen.scheduler.request()
+
+    def _make_screen(self, size, backend="pygame", **kwargs):
+        self.screen = BACKENDS[backend](size, model=Drone(), fov_diagonal=92,
+                                        **kwargs)
+
+    @property
+    def is_active(self):
+        return self.screen.is_active
+
+
+class Visualizer(VisualizerBase):
+    def __init__(self, size=(640, 480), **kwargs):
+        self._make_screen(size, **kwargs)
+        rospy.Subscriber("/ardrone/past_image", Image, self.bg_callback,
+                         queue_size=1)
+        rospy.Subscriber("/ardrone/past_pose", PoseStamped,
+                         self.pose_cam_callback, queue_size=1)
+        rospy.Subscriber("/ardrone/pose", PoseStamped, self.pose_drone_callback,
+                         queue_size=1)
+        rospy.Subscriber("/ardrone/tracked", Bool, self.tracked_callback,
+                         queue_size=1)
+
+
+class TestVisualizer(VisualizerBase):
+    def __init__(self, size=(640, 480), **kwargs):
+        self._make_screen(size, **kwargs)
+        rospy.Subscriber("/ardrone/image_raw", Image, self.bg_callback,
+                         queue_size=1)
+
+        pos_cam = [-1.5, -4, 4]
+        rot_cam = [-0, 0, 0, 1]
+        pos_drone = [-1.5, -1, 4]
+        rot_drone = [-0.3, 0, 0, 1]
+
+        self.pose_cam_callback(Pose.generate_stamped(pos_cam, rot_cam))
+        self.pose_drone_callback(Pose.generate_stamped(pos_drone, rot_drone))
+
+
+def test_offline(screen):
+    pos_cam = [0, 0, 0]
+    rot_cam = [0, 0, 0, 1]
+    pos_drone = [0, -1.5, 0]
+    rot_drone = [0.1, 0, 0, 1]
+    # pos_cam = [-0.5700, 0.08365, 0.0837]
+    # rot_cam = [0.0006, 0.0042, 0.0166, 0.9999]
+    # pos_drone = [-0.4767, 1.3597, 0.0770]
+    # rot_drone = [0.0078, 0.0087, 0.0059, 0.9999]
+    screen.pose_cam = Pose.from_components(pos_cam, rot_cam)
+    screen.pose_drone = Pose.from_components(pos_drone, rot_drone)
+
+    screen.scheduler.request()
+
+    time.sleep(3)
+    screen.add_textures("media/bird.jpg")
+    screen.scheduler.request()
+
+
+def log_statistics(screen):
+    """
+    Log how many updates were coalesced or dropped, and how many buffers
+    were needed to convert images.
+
+    Parameters
+    ----------
+    screen : Screen
+        The screen used.
+
+    """
+    scheduler = screen.scheduler
+    decoder = screen.decoder
+    rospy.loginfo("Drew {frames} frames for {requests} updates, of which "
+                  "{coalesced} were coalesced. {dropped} images were dropped."
+                  .format(frames=scheduler.n_frames,
+                          requests=scheduler.n_requests,
+                          coalesced=scheduler.n_coalesced,
+                          dropped=screen.n_dropped))
+    rospy.loginfo("Converted {decoded} images into {allocated} buffers."
+                  .format(decoded=decoder.n_decoded,
+                          allocated=decoder.n_allocated))
+
+
+def main(backend):
+    """
+    Run a visualizer node.
+
+    The screen runs on the main thread, which Qt needs.
+
+    Parameters
+    ----------
+    backend : str
+        The window backend, which is a key of `BACKENDS`.
+
+    """
+    rospy.init_node("visualizer", anonymous=True)
+    try:
+        debug = rospy.get_param("~debug")
+    except KeyError:
+        rospy.logwarn("Running offline test.")
+        debug = "offline"
+    max_fps = rospy.get_param("~max_fps", None)
+    if max_fps == "None":
+        max_fps = None
+    vsync = rospy.get_param("~vsync", False)
+    distance = rospy.get_param("~zoom_distance", None)
+    if distance == "None":
+        distance = None
+
+    if debug == "offline":
+        screen = BACKENDS[backend]((640, 480), model=Drone(), fov_diagonal=92,
+                                   distance=distance)
+        rospy.on_shutdown(screen.stop)
+        threading.Thread(target=test_offline, args=(screen,)).start()
+        screen.run()
+        return
+    elif debug == "online":
+        visualizer = TestVisualizer((640, 360), backend=backend,
+                                    max_fps=max_fps, vsync=vsync,
+                                    distance=distance)
+    else:
+        visualizer = Visualizer((640, 360), backend=backend, max_fps=max_fps,
+                                vsync=vsync, distance=distance)
+    rospy.on_shutdown(visualizer.screen.stop)
+    period = rospy.get_param("~latency_report_period", 5)
+    if period not in (None, "None"):
+        report_latency(visualizer.screen.tracer, "visualizer", period)
+    rospy.loginfo("Started visualizer")
+    visualizer.screen.run()
+    log_statistics(visualizer.screen)
+    rospy.signal_shutdown("Done!")
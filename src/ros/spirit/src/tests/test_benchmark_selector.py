@@ -0,0 +1,28 @@
+import pytest
+
+import rospy
+
+from benchmark_selector import coefficient_sets, load_params, run
+
+
+rospy.rostime.set_rostime_initialized(True)
+
+
+def test_coefficient_sets():
+    sets = coefficient_sets({"coeff_a": 1, "coeff_b": 0, "coeff_c": 2,
+                             "ref_distance": 1})
+    assert list(sets) == ["default", "a", "c"]
+    assert sets["default"] == {"a": 1, "c": 2}
+    assert sets["c"] == {"c": 2}
+
+
+@pytest.mark.parametrize("method", sorted(load_params()))
+def test_run(method):
+    params = load_params()[method]
+    coeffs = coefficient_sets(params)["default"]
+    result = run(method, params, coeffs, queue_length=30, n_poses=20,
+                 n_warmup=2, image_period=5)
+    assert result["n_frames"] == 30
+    assert result["pose_latency_ms"]["p50"] <= result["pose_latency_ms"]["max"]
+    assert result["image_latency_ms"] is not None
+    assert result["throughput_hz"] > 0
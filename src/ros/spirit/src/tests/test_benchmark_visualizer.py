@@ -0,0 +1,89 @@
+import os
+import subprocess
+import sys
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+pytest.importorskip("cv_bridge")
+pytest.importorskip("OpenGL")
+pytest.importorskip("pygame")
+
+import benchmark_visualizer
+from benchmark_visualizer import check, compare, pixel_diff, run
+from opengl_helpers import OffscreenContext
+
+
+@pytest.fixture
+def offscreen():
+    try:
+        context = OffscreenContext(16, 16)
+    except Exception as e:
+        pytest.skip("Cannot render offscreen: {}".format(e))
+    context.destroy()
+
+
+def test_pixel_diff():
+    a = np.zeros((4, 5, 3), dtype=np.uint8)
+    b = a.copy()
+    b[0, 0] = [0, 3, 1]
+    b[1, 1, 2] = 1
+    assert pixel_diff(a, a) == {"max": 0, "fraction": 0}
+    assert pixel_diff(a, b) == {"max": 3, "fraction": 0.1}
+    assert pixel_diff(a, b, tolerance=1) == {"max": 3, "fraction": 0.05}
+    assert pixel_diff(a, b[:2])["fraction"] == 1
+
+
+@pytest.mark.parametrize("distance", [None, 1])
+def test_run(offscreen, tmpdir, distance):
+    result = run(n_frames=20, n_warmup=2, size=(160, 90), image_period=5,
+                 distance=distance, dump_dir=str(tmpdir), dump_period=10)
+    assert result["n_dumped"] == 2
+    assert result["fps"] > 0
+    assert result["upload_ms"] is not None
+    assert result["render_ms"] is not None
+
+    differences = compare(str(tmpdir), str(tmpdir))
+    assert len(differences) == 2
+    assert all(d["fraction"] == 0 for d in differences.values())
+
+
+def test_check_without_frames():
+    assert not check({}, max_fraction=0)
+
+
+def test_run_without_frames(offscreen):
+    with mock.patch("renderer.OffscreenScreen.draw_frame",
+                    return_value=False):
+        with pytest.raises(RuntimeError, match="did not render"):
+            run(n_frames=5, n_warmup=0, size=(160, 90))
+
+
+def test_qt_matches_offscreen(tmpdir):
+    pytest.importorskip("PyQt5")
+    env = dict(os.environ)
+    # Each backend chooses its own platform.
+    env.pop("PYOPENGL_PLATFORM", None)
+    env.pop("EGL_PLATFORM", None)
+    if not (env.get("DISPLAY") or env.get("WAYLAND_DISPLAY")):
+        env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    process = subprocess.Popen(
+        [sys.executable, benchmark_visualizer.__file__,
+         "--backends", "offscreen", "qt", "--frames", "20",
+         "--size", "160", "90", "--image-period", "5",
+         "--dump", str(tmpdir), "--dump-period", "10",
+         "--tolerance", "2", "--max-fraction", "0.01"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+        universal_newlines=True)
+    stdout, stderr = process.communicate()
+    if "cannot create an OpenGL context" in stderr:
+        pytest.skip("Qt cannot render here")
+    assert process.returncode == 0, stderr
+    assert len(os.listdir(str(tmpdir.join("qt")))) == 2
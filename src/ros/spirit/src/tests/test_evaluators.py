@@ -0,0 +1,248 @@
+from __future__ import division
+from collections import OrderedDict
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import numpy as np
+import pytest
+
+import rospy
+
+from evaluators import get_components, get_evaluator
+from helpers import FrameStore, Pose
+
+
+PARAMS = {
+    "Spirit": {
+        "coeff_centrality": 0.1,
+        "coeff_centrality2": 4,
+        "coeff_direction": 2,
+        "coeff_distance": 8,
+        "coeff_direction_with_current": 2,
+        "coeff_distance_with_current": 1,
+        "ref_distance": 2.5,
+        "thresh_distance": 0.25,
+        "thresh_yaw": 0.17,
+    },
+    "ConstantDistance": {
+        "coeff_distance": 1,
+        "ref_distance": 1.5,
+    },
+    "ConstantTimeDelay": {
+        "coeff_time": 1,
+        "ref_delay": 2,
+    },
+    "Murata": {
+        "coeff_height": 2,
+        "coeff_direction": 0.4,
+        "coeff_elevation": 0.8,
+        "coeff_distance": 4,
+        "ref_height": 0.3,
+        "ref_distance": 1.5,
+    },
+}
+
+
+def random_pose_stamped(rng, sequence=0):
+    pose_stamped = Pose.generate_stamped(rng.uniform(-3, 3, 3),
+                                         rng.normal(size=4), sequence)
+    pose_stamped.header.stamp = rospy.Time.from_sec(sequence / 10)
+    return pose_stamped
+
+
+class MockSelector(object):
+    def __init__(self, eval_method, n_frames, rng, maxlen=None,
+                 cell_size=None):
+        params = PARAMS[eval_method]
+        self._params = params
+        self.eval_method_params = params.keys()
+        self.eval_coeffs = OrderedDict(
+            (param.split("coeff_", 1)[1], coeff)
+            for param, coeff in sorted(params.items())
+            if param.startswith("coeff_")
+        )
+        self.frames = FrameStore(maxlen, cell_size=cell_size)
+        for i in range(n_frames):
+            self.frames.append(random_pose_stamped(rng, i), None)
+        self.current_frame = self.frames[0]
+        self.pose = Pose(random_pose_stamped(rng, n_frames))
+
+    def __getattr__(self, name):
+        return self._params[name]
+
+
+@pytest.mark.parametrize("eval_method", sorted(PARAMS))
+def test_batch_matches_scalar(eval_method):
+    rng = np.random.RandomState(0)
+    selector = MockSelector(eval_method, n_frames=50, rng=rng, maxlen=40)
+    scalar = get_evaluator(eval_method, selector, batch=False)
+    batch = get_evaluator(eval_method, selector, batch=True)
+    assert batch.can_batch
+
+    for i in range(20):
+        if i % 3:
+            selector.frames.append(random_pose_stamped(rng, 50 + i), None)
+        selector.pose = Pose(random_pose_stamped(rng, 50 + i))
+        best_frame = scalar.select_best_frame()
+        assert batch.select_best_frame() is best_frame
+        selector.current_frame = best_frame
+
+
+@pytest.mark.parametrize("eval_method", ["ConstantDistance", "Murata", "Spirit"])
+def test_pruning_matches_exhaustive(eval_method):
+    rng = np.random.RandomState(1)
+    indexed = MockSelector(eval_method, n_frames=200,
+                           rng=np.random.RandomState(0), cell_size=0.5)
+    exhaustive = MockSelector(eval_method, n_frames=200,
+                              rng=np.random.RandomState(0))
+    pruning = get_evaluator(eval_method, indexed, batch=True)
+    reference = get_evaluator(eval_method, exhaustive, batch=True)
+    assert pruning.can_prune
+    assert not reference.can_prune
+
+    for i in range(20):
+        indexed.pose = exhaustive.pose = Pose(random_pose_stamped(rng, 200 + i))
+        rows, scores = pruning._score_within_shell(indexed.pose)
+        assert len(rows) < len(indexed.frames)
+
+        indexed.current_frame = pruning.select_best_frame()
+        exhaustive.current_frame = reference.select_best_frame()
+        assert (indexed.current_frame.pose_stamped.header.seq
+                == exhaustive.current_frame.pose_stamped.header.seq)
+
+
+def test_registry():
+    components = get_components("Spirit")
+    assert sorted(components) == sorted(
+        param.split("coeff_", 1)[1] for param in PARAMS["Spirit"]
+        if param.startswith("coeff_"))
+    assert components["distance"] == ("pose", "ref_distance")
+    assert "pose" not in components["direction_with_current"]
+
+
+def test_unknown_component():
+    selector = MockSelector("ConstantDistance", n_frames=1,
+                            rng=np.random.RandomState(0))
+    selector.eval_coeffs["height"] = 1
+    with pytest.raises(AttributeError):
+        get_evaluator("ConstantDistance", selector)
+
+
+def test_recompile():
+    rng = np.random.RandomState(0)
+    selector = MockSelector("ConstantDistance", n_frames=20, rng=rng)
+    evaluator = get_evaluator("ConstantDistance", selector)
+    distances = selector.frames.view().distance(selector.pose)
+
+    best_frame = evaluator.select_best_frame()
+    assert np.isclose(abs(best_frame.distance(selector.pose) - 1.5),
+                      np.abs(distances - 1.5).min())
+
+    selector._params = dict(selector._params, ref_distance=4)
+    evaluator.compile()
+    best_frame = evaluator.select_best_frame()
+    assert np.isclose(abs(best_frame.distance(selector.pose) - 4),
+                      np.abs(distances - 4).min())
+
+
+def switching_selector(switch_margin=0, min_dwell=0):
+    rng = np.random.RandomState(0)
+    selector = MockSelector("ConstantDistance", n_frames=20, rng=rng)
+    selector._params = dict(selector._params, switch_margin=switch_margin,
+                            min_dwell=min_dwell)
+    selector.pose = Pose(random_pose_stamped(rng, 20))
+    scores = np.abs(selector.frames.view().distance(selector.pose) - 1.5)
+    selector.current_frame = selector.frames[int(np.argsort(scores)[1])]
+    return selector, np.sort(scores)
+
+
+def test_switch_margin():
+    selector, scores = switching_selector()
+    margin = scores[1] - scores[0]
+
+    selector._params["switch_margin"] = 2 * margin
+    evaluator = get_evaluator("ConstantDistance", selector)
+    assert evaluator.select_best_frame() is selector.current_frame
+    assert (evaluator.n_switches, evaluator.n_held) == (0, 1)
+
+    selector._params["switch_margin"] = margin / 2
+    evaluator.compile()
+    assert evaluator.select_best_frame() is not selector.current_frame
+    assert evaluator.n_switches == 1
+
+
+def test_min_dwell():
+    selector, scores = switching_selector(min_dwell=1)
+    evaluator = get_evaluator("ConstantDistance", selector)
+    pose_stamped = selector.pose.pose_stamped
+    best_frame = evaluator.select_best_frame()
+    assert best_frame is not selector.current_frame
+    previous_frame, selector.current_frame = (selector.current_frame,
+                                              best_frame)
+
+    # Make the previous frame the best one again, shortly after switching.
+    selector.pose = Pose(Pose.generate_stamped(
+        previous_frame.pose.position + [1.5, 0, 0], [0, 0, 0, 1]))
+    selector.pose.header.stamp = rospy.Time.from_sec(
+        pose_stamped.header.stamp.to_sec() + 0.5)
+    assert evaluator.select_best_frame() is best_frame
+    assert evaluator.n_held == 1
+
+    selector.pose.header.stamp = rospy.Time.from_sec(
+        pose_stamped.header.stamp.to_sec() + 1.5)
+    assert evaluator.select_best_frame() is not best_frame
+    assert evaluator.n_switches == 2
+
+
+def test_min_dwell_unstamped():
+    selector, scores = switching_selector(min_dwell=1)
+    evaluator = get_evaluator("ConstantDistance", selector)
+    selector.pose.header.stamp = rospy.Time()
+    with mock.patch("timeit.default_timer", return_value=100.):
+        best_frame = evaluator.select_best_frame()
+    previous_frame, selector.current_frame = (selector.current_frame,
+                                              best_frame)
+
+    selector.pose = Pose(Pose.generate_stamped(
+        previous_frame.pose.position + [1.5, 0, 0], [0, 0, 0, 1]))
+    selector.pose.header.stamp = rospy.Time()
+    with mock.patch("timeit.default_timer", return_value=100.5):
+        assert evaluator.select_best_frame() is best_frame
+    with mock.patch("timeit.default_timer", return_value=101.5):
+        assert evaluator.select_best_frame() is not best_frame
+    assert (evaluator.n_switches, evaluator.n_held) == (2, 1)
+
+
+def test_min_dwell_after_time_reset():
+    selector, scores = switching_selector(min_dwell=1)
+    evaluator = get_evaluator("ConstantDistance", selector)
+    selector.pose.header.stamp = rospy.Time.from_sec(100)
+    best_frame = evaluator.select_best_frame()
+    previous_frame, selector.current_frame = (selector.current_frame,
+                                              best_frame)
+
+    # The bag loops back to its start.
+    selector.pose = Pose(Pose.generate_stamped(
+        previous_frame.pose.position + [1.5, 0, 0], [0, 0, 0, 1]))
+    selector.pose.header.stamp = rospy.Time.from_sec(1)
+    assert evaluator.select_best_frame() is not best_frame
+    assert (evaluator.n_switches, evaluator.n_held) == (2, 0)
+
+
+def test_evicted_frame_is_replaced():
+    rng = np.random.RandomState(0)
+    selector = MockSelector("ConstantDistance", n_frames=1, rng=rng, maxlen=3)
+    selector._params = dict(selector._params, switch_margin=100, min_dwell=0)
+    evicted = selector.current_frame
+    for i in range(3):
+        selector.frames.append(random_pose_stamped(rng), None)
+    assert evicted not in selector.frames
+    assert selector.frames[0] in selector.frames
+    assert selector.frames[0].stamp == evicted.stamp
+
+    evaluator = get_evaluator("ConstantDistance", selector)
+    assert evaluator.select_best_frame() is not evicted
+    assert (evaluator.n_switches, evaluator.n_held) == (1, 0)
@@ -1,8 +1,16 @@
 from __future__ import division
+import threading
+import timeit
 
 import numpy as np
+import pytest
 
-from helpers import unit_vector
+import rospy
+from sensor_msgs.msg import Image
+
+from helpers import (memoize, image_sharpness, CompressedImageStore,
+                     FrameStore, ImageArena, ImageDecoder, LatencyTracer, Pose,
+                     PoseBuffer, Quat, RenderScheduler, unit_vector)
 
 
 class TestUnitVector(object):
@@ -12,3 +20,516 @@ class TestUnitVector(object):
 
     def test_zero_vector(self):
         assert (unit_vector([0, 0, 0]) == np.zeros(3)).all()
+
+
+class TestFrameStore(object):
+    @staticmethod
+    def fill(store, n_frames):
+        for i in range(n_frames):
+            store.append(Pose.generate_stamped([i, 0, 0], [0, 0, 0, 1], i), i)
+
+    def test_bounded_store_evicts_oldest(self):
+        store = FrameStore(maxlen=5)
+        self.fill(store, 8)
+        assert len(store) == 5
+        assert store.capacity == 5
+        assert [frame.image for frame in store] == [3, 4, 5, 6, 7]
+        assert store[-1].image == 7
+
+    def test_unbounded_store_grows(self):
+        store = FrameStore(capacity=2)
+        self.fill(store, 9)
+        assert len(store) == 9
+        assert store.capacity == 16
+        assert (store.view().positions[:, 0] == np.arange(9)).all()
+
+    def test_view_is_not_a_copy(self):
+        store = FrameStore(maxlen=3)
+        self.fill(store, 3)
+        positions = store.view().positions
+        store.append(Pose.generate_stamped([10, 0, 0], [0, 0, 0, 1]), None)
+        assert positions[0, 0] == 10
+
+    def test_argmin_prefers_oldest_frame(self):
+        store = FrameStore(maxlen=4)
+        self.fill(store, 6)
+        # Rows hold images 4, 5, 2, 3.
+        assert store.frame(store.argmin(np.zeros(4))).image == 2
+
+    def test_frames_are_cached(self):
+        store = FrameStore(maxlen=3)
+        self.fill(store, 3)
+        assert store[0] is store[0]
+
+
+class Counter(object):
+    def __init__(self):
+        self.calls = 0
+
+    @memoize(maxsize=2)
+    def square(self, x):
+        self.calls += 1
+        return x**2
+
+
+class TestMemoize(object):
+    def test_cache_is_bounded(self):
+        counter = Counter()
+        for x in (1, 2, 3, 1):
+            counter.square(x)
+        assert counter.calls == 4  # 1 was evicted by 3.
+        assert len(counter.__cache__[Counter.square]) == 2
+
+    def test_least_recently_used_is_evicted(self):
+        counter = Counter()
+        for x in (1, 2, 1, 3, 1):
+            counter.square(x)
+        assert counter.calls == 3
+
+    def test_hits_and_misses_are_counted(self):
+        hits, misses, maxsize = Counter.__dict__["square"].cache_info()
+        counter = Counter()
+        for x in (1, 1, 2):
+            counter.square(x)
+        info = Counter.__dict__["square"].cache_info()
+        assert (info.hits - hits, info.misses - misses) == (1, 2)
+        assert info.maxsize == 2
+
+
+class TestQuat(object):
+    quaternions = np.array([
+        [0, 0, 0, 1],
+        [0, 0, np.sqrt(0.5), np.sqrt(0.5)],
+        [0, np.sqrt(0.5), 0, np.sqrt(0.5)],  # Gimbal lock
+        [0.1, -0.2, 0.3, 0.9],
+        [1, 2, 3, 4],
+        [0, 0, 0, 0],
+    ])
+
+    def test_euler_yaw(self):
+        assert np.allclose(Quat.to_euler([0, 0, np.sqrt(0.5), np.sqrt(0.5)]),
+                           [0, 0, np.pi / 2])
+
+    def test_euler_batch_matches_scalar(self):
+        euler = Quat.to_euler_batch(self.quaternions)
+        assert euler.shape == (len(self.quaternions), 3)
+        for quaternion, angles in zip(self.quaternions, euler):
+            assert np.allclose(Quat.to_euler(quaternion), angles)
+
+    def test_euler_random_batch_matches_scalar(self):
+        quaternions = np.random.RandomState(0).normal(size=(1000, 4))
+        euler = Quat.to_euler_batch(quaternions)
+        assert np.allclose([Quat.to_euler(quaternion)
+                            for quaternion in quaternions], euler)
+
+    def test_euler_of_zero_quaternion(self):
+        assert (Quat.to_euler([0, 0, 0, 0]) == 0).all()
+
+    def test_rotation_matrix_batch_matches_scalar(self):
+        matrices = Quat.rotation_matrix_batch(self.quaternions)
+        assert matrices.shape == (len(self.quaternions), 3, 3)
+        for quaternion, matrix in zip(self.quaternions, matrices):
+            assert np.allclose(Quat.rotation_matrix(quaternion), matrix)
+
+    def test_rel_rotation_batch_matches_scalar(self):
+        reference = self.quaternions[3]
+        rotations = Quat.rel_rotation_batch(self.quaternions[:-1], reference)
+        for quaternion, rotation in zip(self.quaternions, rotations):
+            assert np.allclose(Quat.rel_rotation(quaternion, reference),
+                               rotation)
+
+    def test_slerp_yaw(self):
+        yaws = np.array([0, np.pi / 2])
+        start = [0, 0, np.sin(yaws[0] / 2), np.cos(yaws[0] / 2)]
+        end = [0, 0, np.sin(yaws[1] / 2), np.cos(yaws[1] / 2)]
+        fractions = np.array([0, 0.25, 0.5, 1])
+        quaternions = Quat.slerp_batch([start] * 4, [end] * 4, fractions)
+        assert np.allclose(Quat.to_euler_batch(quaternions)[:, 2],
+                           fractions * np.pi / 2)
+
+    def test_slerp_takes_shorter_arc(self):
+        start = [0, 0, 0, 1]
+        end = -np.array([0, 0, np.sin(0.1), np.cos(0.1)])
+        quaternion = Quat.slerp_batch([start], [end], [0.5])[0]
+        assert np.isclose(Quat.to_euler(quaternion)[2], 0.1)
+
+    def test_slerp_identical(self):
+        quaternion = Quat.slerp_batch([[0, 0, 0, 2]], [[0, 0, 0, 2]], [0.3])
+        assert np.allclose(quaternion, [[0, 0, 0, 1]])
+
+
+class TestPoseBuffer(object):
+    @staticmethod
+    def pose_stamped(t, yaw=0):
+        pose_stamped = Pose.generate_stamped(
+            [t, 2 * t, 0], [0, 0, np.sin(yaw / 2), np.cos(yaw / 2)])
+        pose_stamped.header.stamp = rospy.Time.from_sec(t)
+        return pose_stamped
+
+    def test_interpolate(self):
+        poses = PoseBuffer()
+        poses.append(self.pose_stamped(1, 0))
+        poses.append(self.pose_stamped(2, 1))
+        pose_stamped = poses.interpolate(rospy.Time.from_sec(1.25))
+        pose = Pose(pose_stamped)
+        assert np.allclose(pose.position, [1.25, 2.5, 0])
+        assert np.isclose(Quat.to_euler(pose.orientation)[2], 0.25)
+        assert pose_stamped.header.stamp.to_sec() == 1.25
+
+    def test_header_of_nearest(self):
+        poses = PoseBuffer()
+        for t in [1, 2]:
+            pose_stamped = self.pose_stamped(t)
+            pose_stamped.header.seq = 10 * t
+            pose_stamped.header.frame_id = "frame_{}".format(t)
+            poses.append(pose_stamped)
+        for t, seq in [(1.25, 10), (1.75, 20), (3, 20)]:
+            header = poses.interpolate(rospy.Time.from_sec(t)).header
+            assert (header.seq, header.frame_id) == (seq,
+                                                     "frame_{}".format(seq // 10))
+
+    def test_outside_is_nearest(self):
+        poses = PoseBuffer()
+        assert poses.interpolate(rospy.Time.from_sec(1)) is None
+        poses.append(self.pose_stamped(1))
+        positions, _ = poses.interpolate_batch([0, 1, 2])
+        assert np.allclose(positions, [[1, 2, 0]] * 3)
+        poses.append(self.pose_stamped(2))
+        positions, _ = poses.interpolate_batch([0, 3])
+        assert np.allclose(positions, [[1, 2, 0], [2, 4, 0]])
+
+    def test_oldest_is_replaced(self):
+        poses = PoseBuffer(capacity=4)
+        for t in range(10):
+            poses.append(self.pose_stamped(t))
+        assert len(poses) == 4
+        positions, _ = poses.interpolate_batch([0, 6.5, 8.5, 10])
+        assert np.allclose(positions[:, 0], [6, 6.5, 8.5, 9])
+
+
+def make_image(value, size=12):
+    return Image(height=1, width=size // 3, encoding="rgb8", step=size,
+                 data=bytes(bytearray([value] * size)))
+
+
+class TestImageArena(object):
+    def test_round_trip(self):
+        arena = ImageArena(3)
+        arena.store(1, make_image(7), generation=5)
+        image = arena.image(1)
+        assert image.data == make_image(7).data
+        assert (image.width, image.encoding) == (4, "rgb8")
+        assert arena.image(1, 5) is image
+
+    def test_pixels_are_views(self):
+        arena = ImageArena(2)
+        arena.store(0, make_image(1))
+        pixels = arena.pixels(0)
+        arena.store(0, make_image(2))
+        assert (pixels == 2).all()
+
+    def test_overwritten_image(self):
+        arena = ImageArena(2)
+        arena.store(0, make_image(1), generation=0)
+        arena.store(0, make_image(2), generation=2)
+        assert arena.image(0, 0) is None
+        assert arena.pixels(0, 0) is None
+        assert arena.image(0, 2).data == make_image(2).data
+
+    def test_larger_image(self):
+        arena = ImageArena(2)
+        arena.store(0, make_image(1, size=6))
+        arena.store(1, make_image(2, size=12))
+        assert arena.slot_size == 12
+        assert arena.image(0).data == make_image(1, size=6).data
+        assert arena.image(1).data == make_image(2, size=12).data
+
+    def test_mapped(self, tmpdir):
+        arena = ImageArena(2, filename=str(tmpdir.join("images")))
+        arena.store(0, make_image(1))
+        arena.store(1, make_image(2, size=24))
+        assert arena.image(0).data == make_image(1).data
+        assert arena.nbytes == 48
+
+    def test_frame_store(self):
+        store = FrameStore(3, image_storage="arena")
+        for i in range(5):
+            store.append(Pose.generate_stamped([i, 0, 0], [0, 0, 0, 1], i),
+                         make_image(i))
+        assert store.images.nbytes == 3 * 12
+        assert [frame.image.data for frame in store] == [
+            make_image(i).data for i in range(2, 5)]
+
+        oldest = store[0]
+        store.append(Pose.generate_stamped([5, 0, 0], [0, 0, 0, 1], 5),
+                     make_image(5))
+        assert oldest.image is None
+
+    def test_growing_frame_store(self):
+        store = FrameStore(capacity=2, image_storage="arena")
+        for i in range(5):
+            store.append(Pose.generate_stamped([i, 0, 0], [0, 0, 0, 1], i),
+                         make_image(i))
+        assert [frame.image.data for frame in store] == [
+            make_image(i).data for i in range(5)]
+
+    def test_mapped_frame_store_needs_maxlen(self):
+        with pytest.raises(ValueError):
+            FrameStore(image_storage="arena", image_file="images")
+
+
+class TestCompressedImageStore(object):
+    @staticmethod
+    def gradient(value, height=8, width=8):
+        pixels = np.zeros((height, width, 3), dtype=np.uint8)
+        pixels[..., 0] = value
+        pixels[..., 1] = np.arange(width) * 16
+        return Image(height=height, width=width, encoding="rgb8",
+                     step=3 * width, data=pixels.tobytes())
+
+    @pytest.fixture
+    def store(self):
+        pytest.importorskip("cv2")
+        return CompressedImageStore(3, image_format=".png")
+
+    def test_lossless_round_trip(self, store):
+        store.store(0, self.gradient(10), generation=4)
+        store.flush()
+        assert store._pending[0] is None
+        image = store.image(0, 4)
+        assert image.data == self.gradient(10).data
+        assert (image.height, image.width, image.step) == (8, 8, 24)
+        assert store.image(0, 4) is image
+
+    def test_decoded_cache(self, store):
+        for slot in range(3):
+            store.store(slot, self.gradient(slot), generation=slot)
+        store.flush()
+        first = store.image(0)
+        store.image(1)
+        store.image(2)
+        assert len(store._decoded) == 2
+        assert store.image(0) is not first
+
+    def test_overwritten_image(self, store):
+        store.store(0, self.gradient(1), generation=0)
+        store.store(0, self.gradient(2), generation=3)
+        store.flush()
+        assert store.image(0, 0) is None
+        assert store.image(0, 3).data == self.gradient(2).data
+
+    def test_unsupported_image_is_kept(self, store):
+        image = Image(height=2, width=2, encoding="16UC1", step=4,
+                      data=b"\0" * 8)
+        store.store(0, image)
+        store.flush()
+        assert store.image(0) is image
+
+    def test_compresses(self, store):
+        image = Image(height=64, width=64, encoding="rgb8", step=192,
+                      data=b"\0" * 64 * 192)
+        store.store(0, image)
+        store.flush()
+        assert store.nbytes < len(image.data) / 10
+
+    def test_frame_store(self):
+        pytest.importorskip("cv2")
+        store = FrameStore(3, image_storage="compressed", image_format=".png")
+        for i in range(5):
+            store.append(Pose.generate_stamped([i, 0, 0], [0, 0, 0, 1], i),
+                         self.gradient(i))
+        store.images.flush()
+        assert [frame.image.data for frame in store] == [
+            self.gradient(i).data for i in range(2, 5)]
+
+
+class TestImageSharpness(object):
+    @staticmethod
+    def image(pixels, encoding="rgb8"):
+        height, width = pixels.shape[:2]
+        return Image(height=height, width=width, encoding=encoding,
+                     step=pixels[0].size, data=pixels.tobytes())
+
+    def test_blur_lowers_score(self):
+        rng = np.random.RandomState(0)
+        sharp = rng.randint(0, 256, (64, 64, 3)).astype(np.uint8)
+        blurred = sharp.astype(float)
+        for axis in (0, 1):
+            blurred = sum(np.roll(blurred, shift, axis)
+                          for shift in range(-4, 5)) / 9
+        blurred = blurred.astype(np.uint8)
+        assert (image_sharpness(self.image(blurred))
+                < 0.1 * image_sharpness(self.image(sharp)))
+
+    def test_flat_image(self):
+        flat = np.full((64, 64), 128, dtype=np.uint8)
+        assert image_sharpness(self.image(flat, "mono8")) == 0
+
+    def test_unsupported_image(self):
+        pixels = np.zeros((64, 64, 2), dtype=np.uint8)
+        assert image_sharpness(self.image(pixels, "yuv422")) is None
+        assert image_sharpness(self.image(pixels[:4, :4], "mono8")) is None
+
+    def test_truncated_image(self):
+        pixels = np.zeros((10, 10, 3), dtype=np.uint8)
+        image = self.image(pixels)
+        image.data = image.data[:-1]
+        assert len(image.data) == 299
+        assert image_sharpness(image) is None
+
+
+class TestImageDecoder(object):
+    @staticmethod
+    def image(value, encoding="rgb8", channels=3, height=4, width=5, pad=0):
+        pixels = np.zeros((height, width * channels + pad), dtype=np.uint8)
+        pixels[:, :width * channels] = (np.arange(width * channels)
+                                        + value) % 256
+        return Image(height=height, width=width, encoding=encoding,
+                     step=width * channels + pad, data=pixels.tobytes())
+
+    def test_packed_rgb_is_not_copied(self):
+        decoder = ImageDecoder()
+        decoder.submit(self.image(1))
+        assert decoder.wait(1)
+        pixels, width, height = decoder.take()
+        assert (width, height) == (5, 4)
+        assert pixels.tobytes() == self.image(1).data
+        assert decoder.n_allocated == 0
+        assert decoder.take() is None
+
+    @pytest.mark.parametrize("encoding, channels, rgb", [
+        ("rgb8", 3, [0, 1, 2]),
+        ("bgr8", 3, [2, 1, 0]),
+        ("rgba8", 4, [0, 1, 2]),
+        ("bgra8", 4, [2, 1, 0]),
+        ("mono8", 1, [0, 0, 0]),
+    ])
+    def test_encodings(self, encoding, channels, rgb):
+        decoder = ImageDecoder()
+        image = self.image(0, encoding, channels, pad=2)
+        decoder.submit(image)
+        assert decoder.wait(1)
+        pixels, _, _ = decoder.take()
+        expected = np.frombuffer(image.data, dtype=np.uint8).reshape(4, -1)
+        expected = expected[:, :5 * channels].reshape(4, 5, channels)
+        np.testing.assert_array_equal(pixels, expected[..., rgb])
+
+    def test_fallback(self):
+        decoder = ImageDecoder(
+            fallback=lambda image: np.full((4, 5, 3), 7, dtype=np.uint8))
+        decoder.submit(self.image(0, encoding="yuv422", channels=2))
+        assert decoder.wait(1)
+        pixels, _, _ = decoder.take()
+        assert (pixels == 7).all()
+
+    def test_unsupported_image_is_dropped(self):
+        decoder = ImageDecoder()
+        decoder.submit(self.image(0, encoding="yuv422", channels=2))
+        assert decoder.wait(1)
+        assert decoder.take() is None
+        assert decoder.n_dropped == 1
+
+    def test_only_newest_is_kept(self):
+        decoder = ImageDecoder()
+        for i in range(5):
+            decoder.submit(self.image(i, encoding="bgr8"))
+        assert decoder.wait(1)
+        pixels, _, _ = decoder.take()
+        assert pixels[0, 0, 2] == 4
+        assert decoder.n_decoded + decoder.n_dropped == 5
+
+    def test_buffers_are_reused(self):
+        decoder = ImageDecoder()
+        for i in range(20):
+            decoder.submit(self.image(i, encoding="bgr8"))
+            assert decoder.wait(1)
+            if i % 2:
+                decoder.take()
+        assert decoder.n_decoded == 20
+        assert decoder.n_allocated <= 3
+
+    def test_callback(self):
+        decoded = threading.Event()
+        decoder = ImageDecoder(callback=decoded.set)
+        decoder.submit(self.image(0))
+        assert decoded.wait(1)
+        decoder.close()
+
+
+class TestRenderScheduler(object):
+    def test_no_request(self):
+        scheduler = RenderScheduler()
+        assert not scheduler.wait(timeout=0.01)
+        assert scheduler.n_frames == 0
+
+    def test_coalesce(self):
+        scheduler = RenderScheduler()
+        for _ in range(3):
+            scheduler.request()
+        assert scheduler.wait(timeout=0)
+        assert not scheduler.wait(timeout=0)
+        assert (scheduler.n_requests, scheduler.n_coalesced,
+                scheduler.n_frames) == (3, 2, 1)
+
+    def test_request_from_thread(self):
+        scheduler = RenderScheduler()
+        threading.Timer(0.01, scheduler.request).start()
+        assert scheduler.wait(timeout=5)
+
+    def test_frame_rate_cap(self):
+        scheduler = RenderScheduler(max_fps=20)
+        scheduler.request()
+        assert scheduler.wait()
+        scheduler.request()
+        assert not scheduler.wait(timeout=0.01)
+        start = timeit.default_timer()
+        assert scheduler.wait(timeout=1)
+        assert timeit.default_timer() - start > 0.03
+
+    def test_low_frame_rate_does_not_spin(self):
+        scheduler = RenderScheduler(max_fps=2)
+        scheduler.request()
+        assert scheduler.wait()
+        scheduler.request()
+        n_calls = 0
+        start = timeit.default_timer()
+        while timeit.default_timer() - start < 0.3:
+            assert not scheduler.wait(timeout=0.1)
+            n_calls += 1
+        assert n_calls <= 4
+
+
+class TestLatencyTracer(object):
+    def test_summary(self):
+        tracer = LatencyTracer(window=100)
+        for i in range(200):
+            tracer.record("select", i / 1000)
+        tracer.record("publish", 0.5)
+        assert tracer.stages == ["select", "publish"]
+
+        summary = tracer.summary()
+        assert summary["select"]["n"] == 100
+        assert summary["select"]["max"] == 0.199
+        assert np.isclose(summary["select"]["p50"], 0.1495)
+        assert summary["publish"]["mean"] == 0.5
+
+    def test_histogram(self):
+        tracer = LatencyTracer()
+        for latency in (0.001, 0.007, 0.008, 0.5):
+            tracer.record("flip", latency)
+        assert tracer.histogram("flip").tolist() == [1, 2, 0, 0, 0, 0, 1]
+
+    def test_timed(self):
+        tracer = LatencyTracer()
+        with tracer.timed("render"):
+            pass
+        assert 0 <= tracer.samples("render")[0] < 1
+
+    def test_diagnostics(self):
+        tracer = LatencyTracer()
+        tracer.record("receive", 0.002)
+        status, = tracer.diagnostics("selector")
+        assert status.name == "selector: receive latency"
+        values = {value.key: value.value for value in status.values}
+        assert values["p50"] == "2.000"
+        assert values["0-5 ms"] == "1"
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+pytest.importorskip("OpenGL")
+pytest.importorskip("pygame")
+
+from OpenGL import GL as gl
+
+from opengl_helpers import gl_font, gl_ortho, OffscreenContext, TextCache
+
+
+@pytest.fixture
+def context():
+    try:
+        context = OffscreenContext(64, 64)
+    except Exception as e:
+        pytest.skip("Cannot render offscreen: {}".format(e))
+    with gl_ortho(64, 64):
+        yield context
+    context.destroy()
+
+
+class TestTextCache(object):
+    font = gl_font("helvetica", 12)
+
+    def test_hits_and_misses(self, context):
+        cache = TextCache()
+        cache.draw("a", 0, 0, self.font, (1, 0, 0))
+        cache.draw("a", 5, 5, self.font, (1, 0, 0))
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        cache.draw("a", 0, 0, self.font, (0, 1, 0))
+        cache.draw("a", 0, 0, gl_font("helvetica", 18), (1, 0, 0))
+        cache.draw("b", 0, 0, self.font, (1, 0, 0))
+        assert (cache.hits, cache.misses) == (1, 4)
+
+    def test_least_recently_used_is_evicted(self, context):
+        cache = TextCache(maxsize=2)
+        for text in ["a", "b"]:
+            cache.draw(text, 0, 0, self.font, (1, 0, 0))
+        texture_b = cache._textures[("b", id(self.font), (1, 0, 0))][0]
+        assert texture_b is not None
+
+        cache.draw("a", 0, 0, self.font, (1, 0, 0))
+        cache.draw("c", 0, 0, self.font, (1, 0, 0))
+        assert [key[0] for key in cache._textures] == ["a", "c"]
+        assert not gl.glIsTexture(texture_b)
+
+        cache.draw("b", 0, 0, self.font, (1, 0, 0))
+        assert [key[0] for key in cache._textures] == ["c", "b"]
+        assert (cache.hits, cache.misses) == (1, 4)
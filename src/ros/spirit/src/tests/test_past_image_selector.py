@@ -3,9 +3,15 @@ try:
 except ImportError:
     from mock import patch, MagicMock
 
+import threading
+import time
+
+import numpy as np
 import pytest
 
 import rospy
+from sensor_msgs.msg import Image
+from std_msgs.msg import Bool
 
 MockTf2 = MagicMock()
 modules = {"tf2_ros": MockTf2}
@@ -18,6 +24,17 @@ try:
 except rospy.exceptions.ROSException:
     pass
 
+from helpers import LatencyTracer, Pose
+from past_image_selector import Selector
+
+
+PARAMS = {
+    "eval_method": "ConstantDistance",
+    "image_queue_length": 10,
+    "coeff_distance": 1,
+    "ref_distance": 1.5,
+}
+
 
 @pytest.fixture(scope="module")
 def teardown_module():
@@ -27,3 +44,187 @@ def teardown_module():
 
 class TestPoseGenerator(object):
     pass
+
+
+@pytest.fixture
+def params():
+    params = dict(PARAMS)
+
+    def get_param(name, default=KeyError):
+        name = name.lstrip("~")
+        if name in params:
+            return params[name]
+        if default is KeyError:
+            raise KeyError(name)
+        return default
+
+    with patch("rospy.get_param", side_effect=get_param):
+        yield params
+
+
+def generate_pose(sequence, position=(0, 0, 1), rate=30):
+    pose_stamped = Pose.generate_stamped(position, [0, 0, 0, 1], sequence)
+    pose_stamped.header.stamp = rospy.Time.from_sec(sequence / rate)
+    return pose_stamped
+
+
+class TestQuality(object):
+    def test_quality_gating(self, params):
+        selector = Selector(min_quality=10, threaded=False)
+        rng = np.random.RandomState(0)
+        sharp = Image(height=32, width=32, encoding="mono8", step=32,
+                      data=rng.randint(0, 256, 32 * 32).astype(np.uint8)
+                      .tobytes())
+        flat = Image(height=32, width=32, encoding="mono8", step=32,
+                     data=b"\x80" * (32 * 32))
+        for i, image in enumerate([flat, sharp, flat, sharp]):
+            selector.pose_callback(generate_pose(i))
+            selector.tracked_callback(Bool(True))
+            selector.image_callback(image)
+        assert len(selector.frames) == 2
+        assert selector.n_rejected == 2
+        assert len(selector.quality_scores) == 4
+
+    def test_truncated_image(self, params):
+        selector = Selector(min_quality=10, threaded=False)
+        image = Image(height=10, width=10, encoding="rgb8", step=30,
+                      data=b"\x80" * 299)
+        assert not selector.assess(generate_pose(0), image)
+        assert selector.n_rejected == 1
+        assert len(selector.frames) == 0
+
+    def test_quality_loop_survives_errors(self, params):
+        selector = Selector(min_quality=10, threaded=False)
+        selector._pending_image = (generate_pose(0), Image())
+        with patch.object(selector, "assess", side_effect=ValueError), \
+                patch("rospy.is_shutdown", side_effect=[False, False, True]):
+            selector._quality_loop()
+            assert selector.assess.call_count == 1
+        assert selector._pending_image is None
+
+
+class TestPoseInterpolation(object):
+    def test_pose_at_image_stamp(self, params):
+        selector = Selector(threaded=False)
+        for i in range(3):
+            selector.pose_callback(generate_pose(i, [i, 0, 1], rate=10))
+        selector.tracked_callback(Bool(True))
+        image = Image()
+        image.header.stamp = rospy.Time.from_sec(0.15)
+        selector.image_callback(image)
+        pose_stamped = selector.frames[-1].pose_stamped
+        assert np.allclose(Pose(pose_stamped).position, [1.5, 0, 1])
+        assert np.isclose(pose_stamped.header.stamp.to_sec(), 0.15)
+
+    def test_delayed_image_at_mocap_rate(self, params):
+        selector = Selector(threaded=False)
+        for i in range(480):
+            selector.pose_callback(generate_pose(i, [i / 240, 0, 1],
+                                                 rate=240))
+        selector.tracked_callback(Bool(True))
+        image = Image()
+        image.header.stamp = rospy.Time.from_sec(0.5)
+        selector.image_callback(image)
+        pose_stamped = selector.frames[-1].pose_stamped
+        assert np.allclose(Pose(pose_stamped).position, [0.5, 0, 1])
+        assert pose_stamped.header.seq == 120
+
+
+class TestEvaluate(object):
+    def test_publish_only_on_change(self, params):
+        selector = Selector(threaded=False)
+        with patch.object(selector, "past_pose_pub") as mock_pub:
+            selector.pose_callback(generate_pose(0))
+            selector.tracked_callback(Bool(True))
+            selector.image_callback(Image())
+            for i in range(1, 6):
+                selector.pose_callback(generate_pose(i))
+            assert mock_pub.publish.call_count == 1
+
+    def test_staleness_of_every_pose(self, params):
+        selector = Selector(threaded=False)
+        selector.pose_callback(generate_pose(0))
+        selector.tracked_callback(Bool(True))
+        selector.image_callback(Image())
+        selector.tracer = LatencyTracer()
+        for i in range(1, 6):
+            selector.pose_callback(generate_pose(i))
+        assert selector.current_frame is selector.frames[0]
+        assert len(selector.tracer.samples("publish")) == 5
+        assert selector.staleness is not None
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestThreaded(object):
+    @pytest.fixture
+    def selector(self, params):
+        selector = Selector(min_quality=0)
+        self.evaluated = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        select_best_frame = selector.evaluator.select_best_frame
+
+        def blocking_select(pose):
+            self.evaluated.append(pose.header.seq)
+            self.started.set()
+            assert self.release.wait(5)
+            return select_best_frame(pose)
+
+        with patch.object(selector.evaluator, "select_best_frame",
+                          side_effect=blocking_select):
+            yield selector
+        self.release.set()
+        selector.stop(timeout=5)
+
+    def test_newest_pose_is_evaluated(self, selector):
+        selector.pose_callback(generate_pose(0))
+        assert self.started.wait(5)
+        for i in range(1, 5):
+            selector.pose_callback(generate_pose(i))
+        assert selector.n_coalesced == 3
+
+        self.release.set()
+        assert wait_until(lambda: len(self.evaluated) == 2)
+        time.sleep(0.2)
+        assert self.evaluated == [0, 4]
+        assert (selector.n_poses, selector.n_coalesced) == (5, 3)
+
+    def test_frames_added_during_evaluation(self, selector):
+        selector.tracked_callback(Bool(True))
+        selector.pose_callback(generate_pose(0))
+        assert self.started.wait(5)
+
+        image_thread = threading.Thread(target=selector.image_callback,
+                                        args=(Image(),))
+        image_thread.start()
+        image_thread.join(0.2)
+        assert image_thread.is_alive()  # Waiting for the evaluation.
+        assert len(selector.frames) == 0
+
+        self.release.set()
+        image_thread.join(5)
+        assert wait_until(lambda: len(selector.frames) == 1)
+
+        selector.pose_callback(generate_pose(1))
+        assert wait_until(lambda: selector.current_frame is not None)
+        assert selector.current_frame is selector.frames[0]
+        assert selector.staleness >= 0
+
+    def test_stop(self, selector):
+        assert len(selector._threads) == 2
+        assert all(thread.is_alive() for thread in selector._threads)
+        self.release.set()
+        selector.stop(timeout=5)
+        assert not any(thread.is_alive() for thread in selector._threads)
+
+        selector.pose_callback(generate_pose(0))
+        time.sleep(0.2)
+        assert self.evaluated == []
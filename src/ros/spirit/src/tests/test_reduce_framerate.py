@@ -3,14 +3,82 @@ try:
 except ImportError:
     import mock
 
+import numpy as np
+import pytest
+
+import rospy
 from sensor_msgs.msg import Image
 
+from helpers import Pose
 from reduce_framerate import FramerateReducer
 
 
+def stamped_image(stamp):
+    image = Image()
+    image.header.stamp = rospy.Time.from_sec(stamp)
+    return image
+
+
 def test_callback():
     r = FramerateReducer()
     with mock.patch.object(r, "image_publisher", autospec=True) as mock_pub:
         for i in range(16):
             r.frame_callback(Image())
         assert mock_pub.publish.call_count == 2  # At 0 and 15
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        FramerateReducer(mode="sometimes")
+
+
+def test_rate_ignores_input_rate():
+    r = FramerateReducer(mode="rate", output_rate=2)
+    with mock.patch.object(r, "image_publisher", autospec=True) as mock_pub:
+        # 30 Hz for 2 s, then 10 Hz for 2 s.
+        stamps = np.concatenate([np.arange(60) / 30, 2 + np.arange(20) / 10])
+        for stamp in stamps:
+            r.frame_callback(stamped_image(1 + stamp))
+        assert mock_pub.publish.call_count == 8
+    assert (r.n_received, r.n_published) == (80, 8)
+
+
+def test_rate_tolerates_jitter():
+    r = FramerateReducer(mode="rate", output_rate=2)
+    jitter = np.random.RandomState(0).uniform(-0.01, 0.01, 300)
+    for stamp in np.arange(300) / 30 + jitter:
+        r.frame_callback(stamped_image(1 + stamp))
+    assert r.n_published == 20
+
+
+def test_interval_after_gap():
+    r = FramerateReducer(mode="interval", interval=1)
+    for stamp in [1, 1.5, 2, 5, 5.9, 6]:
+        r.frame_callback(stamped_image(stamp))
+    assert r.n_published == 4  # At 1, 2, 5, and 6
+
+
+def test_pose_needs_movement():
+    r = FramerateReducer(mode="pose", thresh_distance=0.25, thresh_yaw=0.5)
+    r.frame_callback(Image())
+    assert r.n_published == 0  # No pose yet
+
+    for position, yaw, published in [([0, 0, 0], 0, 1),
+                                     ([0.1, 0, 0], 0, 1),
+                                     ([0.3, 0, 0], 0, 2),
+                                     ([0.3, 0, 0], 0.3, 2),
+                                     ([0.3, 0, 0], -0.6, 3)]:
+        orientation = [0, 0, np.sin(yaw / 2), np.cos(yaw / 2)]
+        r.pose_callback(Pose.generate_stamped(position, orientation))
+        r.frame_callback(Image())
+        assert r.n_published == published
+
+
+def test_rates():
+    r = FramerateReducer(mode="count", slowdown=3)
+    with mock.patch("rospy.Time.now", return_value=rospy.Time.from_sec(10.)):
+        assert r.rates() is None
+    for i in range(30):
+        r.frame_callback(Image())
+    with mock.patch("rospy.Time.now", return_value=rospy.Time.from_sec(12.)):
+        assert r.rates() == (15, 5)